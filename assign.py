@@ -0,0 +1,121 @@
+# -*- coding: utf-8 -*-
+
+"""
+Автоназначение тасок техникам (AUTO_ASSIGN).
+
+Техники на смене лежат в min-heap по ключу (тасок в работе, номер
+последнего назначения): выигрывает наименее загруженный, при равной
+загрузке — тот, кому назначали давнее всех (round-robin). Любое изменение
+техника — новая запись в куче с новым поколением, старые выбрасываются
+при извлечении, как в sla.py. Выбор и обновление — O(log n).
+
+Загрузку двигают те же обёртки, что и SLA-таймеры: взятие таски
+(ручное или автоматическое) и уход из 'in_progress'. При старте пул
+поднимается из БД: кто на смене — из technicians, кто чем занят —
+из тасок в работе.
+
+Работает только из event loop, блокировок нет.
+"""
+
+import heapq
+import itertools
+from typing import Dict, Optional, Tuple
+
+# мусор в куче терпим, пока его не больше живых записей и не меньше этого числа
+COMPACT_MIN_STALE = 256
+
+
+class TechPool:
+    def __init__(self, max_load: int = 0):
+        # max_load — сколько тасок в работе у техника, после чего ему не назначаем (0 — без лимита)
+        self.max_load = max_load
+        # tech_id -> [поколение, тасок в работе, номер последнего назначения, на смене, username]
+        self._techs: Dict[int, list] = {}
+        self._tasks: Dict[int, int] = {}  # task_id в работе -> tech_id
+        self._heap = []  # (тасок в работе, номер последнего назначения, tech_id, поколение)
+        self._generation = itertools.count(1)
+        self._turn = itertools.count(1)
+        self.assigned = 0
+
+    @property
+    def on_duty(self) -> int:
+        return sum(1 for tech in self._techs.values() if tech[3])
+
+    def load(self, tech_id: int) -> int:
+        tech = self._techs.get(tech_id)
+        return tech[1] if tech else 0
+
+    def is_available(self, tech_id: int) -> bool:
+        tech = self._techs.get(tech_id)
+        return bool(tech and tech[3])
+
+    # ----------------- Изменения -----------------
+    def set_available(self, tech_id: int, username: str, available: bool) -> None:
+        tech = self._tech(tech_id, username)
+        tech[3] = available
+        self._touch(tech_id, tech)
+
+    def track(self, task_id: int, tech_id: int, username: str) -> None:
+        """Таска в работе у tech_id (взял сам или назначили)."""
+        if self._tasks.get(task_id) == tech_id:
+            return
+        self.discard(task_id)
+        self._tasks[task_id] = tech_id
+        tech = self._tech(tech_id, username)
+        tech[1] += 1
+        tech[2] = next(self._turn)
+        self._touch(tech_id, tech)
+
+    def discard(self, task_id: int, tech_id: Optional[int] = None) -> None:
+        """Таска ушла из работы; с tech_id — только если она всё ещё числится за ним."""
+        owner = self._tasks.get(task_id)
+        if owner is None or (tech_id is not None and owner != tech_id):
+            return
+        del self._tasks[task_id]
+        tech = self._techs[owner]
+        tech[1] -= 1
+        self._touch(owner, tech)
+
+    def assign(self, task_id: int) -> Optional[Tuple[int, str]]:
+        """
+        Выбирает техника для таски и сразу записывает её на него.
+
+        Запись сразу, а не после commit-а взятия: иначе пачка тасок,
+        пришедших одновременно, ушла бы одному и тому же технику.
+        None — никого нет на смене, все упёрлись в max_load или таска уже
+        числится за кем-то (взяли руками, пока её читали из БД).
+        """
+        if task_id in self._tasks:
+            # не перетягиваем: загрузка владельца ушла бы, а взятие потом не пройдёт compare-and-set
+            return None
+        heap = self._heap
+        while heap:
+            load, _, tech_id, generation = heap[0]
+            tech = self._techs[tech_id]
+            if tech[0] != generation or not tech[3]:
+                heapq.heappop(heap)
+                continue
+            if self.max_load and load >= self.max_load:
+                return None
+            self.track(task_id, tech_id, tech[4])
+            self.assigned += 1
+            return tech_id, tech[4]
+        return None
+
+    def _tech(self, tech_id: int, username: str) -> list:
+        tech = self._techs.get(tech_id)
+        if tech is None:
+            tech = self._techs[tech_id] = [0, 0, 0, False, username]
+        elif username:
+            tech[4] = username
+        return tech
+
+    def _touch(self, tech_id: int, tech: list) -> None:
+        tech[0] = next(self._generation)
+        if tech[3]:
+            heapq.heappush(self._heap, (tech[1], tech[2], tech_id, tech[0]))
+        stale = len(self._heap) - len(self._techs)
+        if stale >= COMPACT_MIN_STALE and stale > len(self._techs):
+            techs = self._techs
+            self._heap = [e for e in self._heap if techs[e[2]][0] == e[3] and techs[e[2]][3]]
+            heapq.heapify(self._heap)
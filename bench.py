@@ -0,0 +1,1127 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Микро-бенчмарки TECH TASK бота.
+
+Запуск:  python bench.py [имя ...]
+Без аргументов гоняет все сценарии. Всё работает на временной БД,
+Telegram не нужен.
+"""
+
+import asyncio
+import os
+import socket
+import sqlite3
+import sys
+import tempfile
+import time
+from contextlib import contextmanager
+from datetime import datetime
+
+from migrations import MIGRATIONS
+from task_store import HOT_QUERIES, SQL, TASK_COLUMNS, AsyncTaskStore, TaskStore
+
+N_OPS = int(os.getenv("BENCH_OPS", "2000"))
+FSYNC_MS = float(os.getenv("BENCH_FSYNC_MS", "2"))
+# loop_lag: p99 задержки тика при AsyncTaskStore выше этого — event loop подвисает
+LOOP_LAG_MAX_MS = float(os.getenv("BENCH_LOOP_LAG_MAX_MS", "50"))
+
+
+def _ops_per_sec(fn, n: int = N_OPS) -> float:
+    started = time.perf_counter()
+    for i in range(n):
+        fn(i)
+    return n / (time.perf_counter() - started)
+
+
+def _print_row(name: str, before: float, after: float) -> None:
+    print(f"{name:<22} {before:>12.0f} {after:>12.0f} {after / before:>8.1f}x")
+
+
+# ----------------- Старые хелперы: sqlite3.connect на каждый вызов -----------------
+class LegacyHelpers:
+    def __init__(self, path: str):
+        self.path = path
+
+    def _write(self, sql: str, params) -> int:
+        conn = sqlite3.connect(self.path)
+        cur = conn.cursor()
+        cur.execute(sql, params)
+        rowid = cur.lastrowid
+        conn.commit()
+        conn.close()
+        return rowid
+
+    def _read(self, sql: str, params, one: bool):
+        conn = sqlite3.connect(self.path)
+        cur = conn.cursor()
+        cur.execute(sql, params)
+        rows = cur.fetchone() if one else cur.fetchall()
+        conn.close()
+        return rows
+
+    def create_task(self, manager_id, manager_username, content):
+        now = datetime.utcnow().isoformat()
+        return self._write(
+            "INSERT INTO tasks (manager_id, manager_username, content, status, created_at, updated_at) VALUES (?, ?, ?, 'new', ?, ?)",
+            (manager_id, manager_username, content, now, now),
+        )
+
+    def set_tech_message_id(self, task_id, chat_id, msg_id):
+        self._write(SQL["set_tech_message_id"], (chat_id, msg_id, datetime.utcnow().isoformat(), task_id))
+
+    def get_task(self, task_id):
+        row = self._read(SQL["get_task"], (task_id,), one=True)
+        return dict(zip(TASK_COLUMNS, row)) if row else None
+
+    # старый UPDATE без RETURNING: строку после него никто не читал
+    UPDATE_STATUS = "UPDATE tasks SET status = ?, tech_id = COALESCE(?, tech_id), tech_username = COALESCE(?, tech_username), updated_at = ? WHERE id = ?"
+
+    def take_task(self, task_id, tech_id, tech_username):
+        self._write(self.UPDATE_STATUS, ("in_progress", tech_id, tech_username, datetime.utcnow().isoformat(), task_id))
+
+    def update_status(self, task_id, status, tech_id=None, tech_username=None):
+        self._write(self.UPDATE_STATUS, (status, tech_id, tech_username, datetime.utcnow().isoformat(), task_id))
+
+    def list_manager_tasks(self, manager_id):
+        # старый /mytasks: все таски менеджера разом, без страниц
+        return self._read("SELECT id, content, status, tech_username, created_at FROM tasks WHERE manager_id = ? ORDER BY id DESC", (manager_id,), one=False)
+
+
+def _helper_suite(api, n: int) -> dict:
+    results = {}
+    ids = []
+    results["create_task"] = _ops_per_sec(lambda i: ids.append(api.create_task(i % 50, f"m{i % 50}", f"task {i}")), n)
+    results["set_tech_message_id"] = _ops_per_sec(lambda i: api.set_tech_message_id(ids[i], -100, 1000 + i), n)
+    results["get_task"] = _ops_per_sec(lambda i: api.get_task(ids[i]), n)
+    results["take_task_db"] = _ops_per_sec(lambda i: api.take_task(ids[i], 7, "tech"), n)
+    results["update_status_db"] = _ops_per_sec(lambda i: api.update_status(ids[i], "done", tech_id=7, tech_username="tech"), n)
+    results["list_manager_tasks"] = _ops_per_sec(lambda i: api.list_manager_tasks(i % 50), n)
+    return results
+
+
+def bench_db_helpers() -> None:
+    """ops/sec каждого DB-хелпера: connect-на-вызов против пула TaskStore."""
+    with tempfile.TemporaryDirectory() as tmp:
+        legacy_path = os.path.join(tmp, "legacy.db")
+        # старые хелперы жили в rollback-журнале с дефолтными pragma; схема та же,
+        # что у пула (колонки, индексы, триггеры), — сравниваем только работу с соединениями
+        conn = sqlite3.connect(legacy_path)
+        for _, _, statements in MIGRATIONS:
+            for sql in statements:
+                conn.execute(sql)
+        conn.commit()
+        conn.close()
+        before = _helper_suite(LegacyHelpers(legacy_path), N_OPS)
+
+        store = TaskStore(os.path.join(tmp, "pooled.db"))
+        store.init_schema()
+        after = _helper_suite(store, N_OPS)
+        store.close()
+
+    print(f"\n== db_helpers ({N_OPS} ops) ==")
+    print(f"{'helper':<22} {'before op/s':>12} {'after op/s':>12} {'speedup':>8}")
+    for name in before:
+        _print_row(name, before[name], after[name])
+
+
+class SlowDiskStore(TaskStore):
+    """TaskStore, у которого каждый commit «платит» FSYNC_MS, как на медленном диске."""
+
+    fsyncs = 0
+
+    @contextmanager
+    def transaction(self):
+        with super().transaction() as conn:
+            yield conn
+        self.fsyncs += 1
+        time.sleep(FSYNC_MS / 1000)
+
+
+async def _loop_lag(handlers) -> tuple:
+    """p99 и максимум задержки тика event loop, пока крутятся handlers."""
+    lags = []
+    stop = asyncio.Event()
+
+    async def ticker():
+        while not stop.is_set():
+            started = time.perf_counter()
+            await asyncio.sleep(0.001)
+            lags.append(time.perf_counter() - started - 0.001)
+
+    tick = asyncio.create_task(ticker())
+    await asyncio.sleep(0.01)
+    started = time.perf_counter()
+    await asyncio.gather(*handlers)
+    elapsed = time.perf_counter() - started
+    stop.set()
+    await tick
+    lags.sort()
+    return lags[int(len(lags) * 0.99)] * 1000, lags[-1] * 1000, elapsed
+
+
+def bench_loop_lag() -> None:
+    """Отзывчивость event loop, пока параллельно идут записи в БД."""
+    n = max(200, N_OPS // 4)
+
+    async def blocking_handler(store: TaskStore, i: int):
+        task_id = store.create_task(i, f"m{i}", f"task {i}")
+        store.take_task(task_id, 7, "tech")
+        store.list_manager_tasks(i)
+
+    async def async_handler(db: AsyncTaskStore, i: int):
+        task_id = await db.create_task(i, f"m{i}", f"task {i}")
+        await db.take_task(task_id, 7, "tech")
+        await db.list_manager_tasks(i)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        store = SlowDiskStore(os.path.join(tmp, "sync.db"))
+        store.init_schema()
+        blocking = asyncio.run(_loop_lag([blocking_handler(store, i) for i in range(n)]))
+        store.close()
+
+        store = SlowDiskStore(os.path.join(tmp, "async.db"))
+        store.init_schema()
+        db = AsyncTaskStore(store)
+        awaited = asyncio.run(_loop_lag([async_handler(db, i) for i in range(n)]))
+        db.close()
+
+    print(f"\n== loop_lag ({n} concurrent handlers, fsync ~{FSYNC_MS} ms) ==")
+    print(f"{'mode':<22} {'p99 lag ms':>12} {'max lag ms':>12} {'total s':>10}")
+    for name, (p99, worst, elapsed) in (("blocking sqlite3", blocking), ("AsyncTaskStore", awaited)):
+        print(f"{name:<22} {p99:>12.1f} {worst:>12.1f} {elapsed:>10.3f}")
+    # записи идут, а loop отвечает: и в абсолютных цифрах, и на порядок лучше блокирующего варианта
+    bound = min(LOOP_LAG_MAX_MS, blocking[0] / 10)
+    if awaited[0] > bound:
+        print(f"FAIL: p99 задержки event loop с AsyncTaskStore {awaited[0]:.1f} мс, допустимо до {bound:.1f} мс")
+        sys.exit(1)
+
+
+class UnbatchedAsyncStore(AsyncTaskStore):
+    """Прежний AsyncTaskStore: каждая запись — своя транзакция на потоке-писателе."""
+
+    async def create_task(self, manager_id, manager_username, content):
+        return await self._run(self._writer, self.store.create_task, manager_id, manager_username, content)
+
+    async def set_tech_message_id(self, task_id, chat_id, msg_id):
+        await self._run(self._writer, self.store.set_tech_message_id, task_id, chat_id, msg_id)
+
+    async def take_task(self, task_id, tech_id, tech_username):
+        return await self._run(self._writer, self.store.take_task, task_id, tech_id, tech_username)
+
+    async def update_status(self, task_id, status, tech_id=None, tech_username=None):
+        await self._run(self._writer, self.store.update_status, task_id, status, tech_id=tech_id, tech_username=tech_username)
+
+
+def bench_write_batch() -> None:
+    """Всплеск /connect + take + done: commit-ы и «fsync»-и с group commit и без."""
+    n = max(200, N_OPS // 4)
+
+    async def flow(db: AsyncTaskStore, i: int) -> float:
+        # как cmd_connect и два нажатия: критичные записи ждём, message_id — нет
+        started = time.perf_counter()
+        task_id = await db.create_task(i, f"m{i}", f"task {i}")
+        await db.set_tech_message_id(task_id, -100, 1000 + i)
+        task = await db.take_task(task_id, 7, "tech")
+        await db.update_status(task_id, "done", tech_id=7, tech_username="tech")
+        return time.perf_counter() - started if task and task.tech_chat_message_id == 1000 + i else -1
+
+    async def burst(db: AsyncTaskStore) -> tuple:
+        started = time.perf_counter()
+        latencies = await asyncio.gather(*(flow(db, i) for i in range(n)))
+        return time.perf_counter() - started, sorted(latencies)
+
+    rows = []
+    with tempfile.TemporaryDirectory() as tmp:
+        for name, cls in (("commit per write", UnbatchedAsyncStore), ("group commit", AsyncTaskStore)):
+            store = SlowDiskStore(os.path.join(tmp, f"{cls.__name__}.db"))
+            store.init_schema()
+            db = cls(store)
+            elapsed, latencies = asyncio.run(burst(db))
+            db.close()
+            rows.append((name, n * 4, store.fsyncs, elapsed, latencies))
+
+    print(f"\n== write_batch ({n} concurrent connect+take+done flows, fsync ~{FSYNC_MS} ms) ==")
+    print(f"{'mode':<18} {'writes':>7} {'commits':>8} {'commits/s':>10} {'writes/s':>9} {'flow p50/p99 ms':>16}")
+    for name, writes, fsyncs, elapsed, latencies in rows:
+        p = lambda q: latencies[min(len(latencies) - 1, int(len(latencies) * q))] * 1000
+        print(f"{name:<18} {writes:>7} {fsyncs:>8} {fsyncs / elapsed:>10.0f} {writes / elapsed:>9.0f} {p(0.5):>7.1f}/{p(0.99):<8.1f}")
+        if latencies[0] < 0:
+            print("FAIL: take_task не увидел message_id, записанный до него")
+            sys.exit(1)
+
+
+def bench_task_cache() -> None:
+    """get_task на нажатиях: живых тасок немного, а дёргают их постоянно."""
+    import random
+    import tracemalloc
+
+    from task_cache import TaskCache
+    from task_store import TaskRecord
+
+    total, live, presses = 5000, 50, N_OPS * 10
+    rnd = random.Random(1)
+    # 90% нажатий — по тасками с живыми кнопками, остальное — старьё из /mytasks
+    ids = [rnd.randint(total - live + 1, total) if rnd.random() < 0.9 else rnd.randint(1, total) for _ in range(presses)]
+
+    async def run(db: AsyncTaskStore, cache) -> float:
+        for i in range(total):
+            await db.create_task(i % 50, f"m{i % 50}", f"task {i} " + "x" * 200)
+        # кэш подключаем после заливки, чтобы он начинал холодным
+        db.cache = cache
+        started = time.perf_counter()
+        for task_id in ids:
+            task = await db.get_task(task_id)
+            if task.id != task_id:
+                raise AssertionError(task_id)
+        rate = presses / (time.perf_counter() - started)
+        # write-through: после смены статуса кэш отдаёт свежую строку
+        await db.update_status(total, "done")
+        assert (await db.get_task(total)).status == "done"
+        return rate
+
+    with tempfile.TemporaryDirectory() as tmp:
+        results = {}
+        for name, cache in (("no cache", None), ("TaskCache(500)", TaskCache(max_entries=500))):
+            store = TaskStore(os.path.join(tmp, f"{len(results)}.db"))
+            store.init_schema()
+            db = AsyncTaskStore(store)
+            results[name] = (asyncio.run(run(db, cache)), cache)
+            db.close()
+
+        # память: dict из get_task до кэша против TaskRecord
+        conn = sqlite3.connect(os.path.join(tmp, "0.db"))
+        row = conn.execute(SQL["get_task"], (1,)).fetchone()
+        conn.close()
+        sizes = {}
+        for name, build in (("dict", lambda: dict(zip(TASK_COLUMNS, row))), ("TaskRecord", lambda: TaskRecord(*row))):
+            tracemalloc.start()
+            objects = [build() for _ in range(10_000)]
+            sizes[name] = tracemalloc.get_traced_memory()[0] / len(objects)
+            tracemalloc.stop()
+            del objects
+
+    print(f"\n== task_cache ({presses} get_task, {live} live of {total} tasks) ==")
+    print(f"{'mode':<16} {'get/s':>10} {'hit rate':>9} {'evictions':>10}")
+    for name, (rate, cache) in results.items():
+        hit_rate = f"{cache.hits / (cache.hits + cache.misses):.0%}" if cache else "-"
+        print(f"{name:<16} {rate:>10.0f} {hit_rate:>9} {cache.evictions if cache else '-':>10}")
+    print(f"bytes per row object: dict {sizes['dict']:.0f}, TaskRecord {sizes['TaskRecord']:.0f}")
+
+
+def bench_events() -> None:
+    """Запросы по task_events на большом журнале: таймлайн, лента техника, счётчики за окно."""
+    from datetime import timedelta
+
+    n_events = int(os.getenv("BENCH_EVENTS", "1000000"))
+    n_tasks, techs = n_events // 4, 50
+    start = datetime(2025, 1, 1)
+    step = timedelta(days=365) / n_events
+
+    def rows():
+        # ~4 перехода на таску: new -> in_progress -> (on_hold) -> done/cancelled
+        for i in range(n_events):
+            task_id = i // 4 + 1
+            status = ("new", "in_progress", "on_hold", "cancelled" if task_id % 7 == 0 else "done")[i % 4]
+            actor = task_id % 97 if status == "new" else 1000 + task_id % techs
+            yield task_id, status, actor, f"u{actor}", (start + step * i).isoformat()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        store = TaskStore(os.path.join(tmp, "events.db"))
+        store.init_schema()
+        started = time.perf_counter()
+        with store.transaction() as conn:
+            conn.executemany(SQL["insert_event"], rows())
+        fill = time.perf_counter() - started
+
+        def timed(fn, repeat: int = 200) -> float:
+            started = time.perf_counter()
+            for i in range(repeat):
+                fn(i)
+            return (time.perf_counter() - started) / repeat * 1000
+
+        month_start, month_end = datetime(2025, 6, 1), datetime(2025, 7, 1)
+        results = {
+            "task_timeline": timed(lambda i: store.task_timeline(1 + i * 997 % n_tasks)),
+            "actor_events (50)": timed(lambda i: store.actor_events(1000 + i % techs, limit=50)),
+            "count_events (day)": timed(lambda i: store.count_events(start + timedelta(days=i % 300), start + timedelta(days=i % 300 + 1)), 50),
+            "count_events (month)": timed(lambda i: store.count_events(month_start, month_end), 10),
+            "count_events tech/month": timed(lambda i: store.count_events(month_start, month_end, actor_id=1000 + i % techs), 50),
+        }
+        counts = store.count_events(month_start, month_end)
+        store.close()
+
+    print(f"\n== events ({n_events} events, filled in {fill:.1f} s) ==")
+    for name, ms in results.items():
+        print(f"{name:<26} {ms:>8.2f} ms")
+    print("June: " + ", ".join(f"{k}={v}" for k, v in counts.items()))
+
+
+def bench_stats() -> None:
+    """/stats: агрегатные таблицы против GROUP BY по всей tasks при растущей истории."""
+    group_by = (
+        "SELECT status, COUNT(*) FROM tasks GROUP BY status",
+        "SELECT tech_id, MAX(tech_username), status, COUNT(*) FROM tasks WHERE tech_id IS NOT NULL GROUP BY tech_id, status",
+    )
+    statuses = ("new", "in_progress", "on_hold", "done", "done", "done", "cancelled")
+    now = datetime.utcnow().isoformat()
+
+    print("\n== stats ==")
+    print(f"{'tasks':>9} {'GROUP BY ms':>12} {'aggregates ms':>14}")
+    with tempfile.TemporaryDirectory() as tmp:
+        store = TaskStore(os.path.join(tmp, "stats.db"))
+        store.init_schema()
+        filled = 0
+        for size in (10_000, 100_000, int(os.getenv("BENCH_STATS_TASKS", "1000000"))):
+            with store.transaction() as conn:
+                # INSERT сразу со статусом и техником — счётчики ведут те же триггеры
+                conn.executemany(
+                    "INSERT INTO tasks (manager_id, manager_username, content, status, tech_id, tech_username, created_at, updated_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                    (
+                        (i % 200, f"m{i % 200}", f"task {i}", statuses[i % 7], None if i % 7 == 0 else 1000 + i % 30, f"t{i % 30}", now, now)
+                        for i in range(filled, size)
+                    ),
+                )
+            filled = size
+            with store.pool.connection() as conn:
+                started = time.perf_counter()
+                for _ in range(5):
+                    expected = dict(conn.execute(group_by[0]).fetchall())
+                    conn.execute(group_by[1]).fetchall()
+                scan_ms = (time.perf_counter() - started) / 5 * 1000
+            started = time.perf_counter()
+            for _ in range(200):
+                counts, _techs = store.stats()
+            agg_ms = (time.perf_counter() - started) / 200 * 1000
+            print(f"{size:>9} {scan_ms:>12.2f} {agg_ms:>14.3f}")
+            if counts != expected:
+                print(f"FAIL: счётчики разошлись с tasks: {counts} != {expected}")
+                sys.exit(1)
+        store.close()
+
+
+def bench_search() -> None:
+    """/find: FTS5 против LIKE '%...%' (для ранжирования нужен полный список совпадений)."""
+    words = ("принтер", "монитор", "роутер", "доступ", "почта", "ноутбук", "сервер", "пароль", "ёлка", "камера")
+    queries = ("принтеры", "кабинете 499", "монитор пароль", "ёлка")
+    now = datetime.utcnow().isoformat()
+    size = int(os.getenv("BENCH_SEARCH_TASKS", "200000"))
+
+    print("\n== search ==")
+    with tempfile.TemporaryDirectory() as tmp:
+        store = TaskStore(os.path.join(tmp, "search.db"))
+        store.init_schema()
+        with store.transaction() as conn:
+            conn.executemany(
+                "INSERT INTO tasks (manager_id, manager_username, content, status, created_at, updated_at) VALUES (?, ?, ?, 'new', ?, ?)",
+                (
+                    (i % 200, f"m{i % 200}", f"не работает {words[i % 10]} в кабинете {i % 500}, {words[(i * 7) % 10]} тоже", now, now)
+                    for i in range(size)
+                ),
+            )
+        print(f"{'query':<14} {'LIKE ms':>9} {'FTS5 ms':>9} {'page 2 ms':>10}")
+        with store.pool.connection() as conn:
+            for text in queries:
+                started = time.perf_counter()
+                conn.execute("SELECT id FROM tasks WHERE content LIKE ?", (f"%{text.split()[0][:5]}%",)).fetchall()
+                like_ms = (time.perf_counter() - started) * 1000
+                started = time.perf_counter()
+                rows, _ = store.search_tasks(text, limit=5)
+                fts_ms = (time.perf_counter() - started) * 1000
+                started = time.perf_counter()
+                store.search_tasks(text, offset=5, limit=5)
+                page_ms = (time.perf_counter() - started) * 1000
+                print(f"{text:<14} {like_ms:>9.2f} {fts_ms:>9.2f} {page_ms:>10.2f}")
+                if not rows:
+                    print(f"FAIL: «{text}» ничего не нашёл")
+                    sys.exit(1)
+        store.close()
+
+
+def bench_sla() -> None:
+    """SLA-таймеры: куча с ленивым удалением против обхода всех таймеров на каждом тике."""
+    import random
+
+    from sla import SlaTimers
+
+    n = int(os.getenv("BENCH_SLA_TIMERS", "50000"))
+    rnd = random.Random(1)
+    now = [0.0]
+    timers = SlaTimers({"new": 3600, "on_hold": 86400}, clock=lambda: now[0])
+
+    started = time.perf_counter()
+    for task_id in range(n):
+        timers.track(task_id, "new", since=-rnd.uniform(0, 3600))
+    track_us = (time.perf_counter() - started) / n * 1e6
+
+    # поток событий: взяли в работу, отложили, вернули — каждое двигает таймер
+    moves = n * 4
+    started = time.perf_counter()
+    for _ in range(moves):
+        task_id = rnd.randrange(n)
+        if rnd.random() < 0.3:
+            timers.discard(task_id)
+        else:
+            timers.track(task_id, rnd.choice(("new", "on_hold")))
+    move_us = (time.perf_counter() - started) / moves * 1e6
+    live, heap = len(timers), len(timers._heap)
+
+    # минута за минутой: куча снимает только наступившее
+    fired = 0
+    started = time.perf_counter()
+    for _ in range(60):
+        now[0] += 60
+        fired += len(timers.pop_due())
+    tick_us = (time.perf_counter() - started) / 60 * 1e6
+
+    # наивный вариант: на каждом тике обойти все таймеры
+    deadlines = {task_id: timer[2] + timers.limits[timer[1]] for task_id, timer in timers._timers.items()}
+    started = time.perf_counter()
+    for _ in range(60):
+        [task_id for task_id, deadline in deadlines.items() if deadline <= now[0]]
+    scan_us = (time.perf_counter() - started) / 60 * 1e6
+
+    print(f"\n== sla ({n} таймеров, {moves} перестановок) ==")
+    print(f"track:            {track_us:>8.2f} мкс")
+    print(f"move/discard:     {move_us:>8.2f} мкс")
+    print(f"живых / в куче:   {live} / {heap} (мусор ограничен компактизацией)")
+    print(f"тик кучи:         {tick_us:>8.1f} мкс ({fired} напоминаний за 60 тиков)")
+    print(f"тик обходом всех: {scan_us:>8.1f} мкс")
+    if heap > 2 * live + 1024:
+        print("FAIL: куча разрослась мусором")
+        sys.exit(1)
+
+
+def bench_assign() -> None:
+    """Автоназначение: симуляция смены — латентность выбора техника и равномерность загрузки."""
+    import heapq
+    import random
+    import statistics
+
+    from assign import TechPool
+
+    techs, tasks = 20, int(os.getenv("BENCH_ASSIGN_TASKS", "100000"))
+    rnd = random.Random(1)
+    # техники работают с разной скоростью: среднее время на таску от 10 до 60 минут
+    speed = {tech_id: rnd.uniform(600, 3600) for tech_id in range(techs)}
+    # поток тасок чуть меньше суммарной пропускной способности смены
+    rate = 0.9 * sum(1 / s for s in speed.values())
+
+    def simulate(pick) -> tuple:
+        pool = TechPool()
+        for tech_id in range(techs):
+            pool.set_available(tech_id, f"t{tech_id}", True)
+        done_at, now, counts, peak, pick_s = [], 0.0, [0] * techs, [0] * techs, 0.0
+        for task_id in range(tasks):
+            now += rnd.expovariate(rate)
+            while done_at and done_at[0][0] <= now:
+                pool.discard(heapq.heappop(done_at)[1])
+            started = time.perf_counter()
+            tech_id = pick(pool, task_id)
+            pick_s += time.perf_counter() - started
+            counts[tech_id] += 1
+            peak[tech_id] = max(peak[tech_id], pool.load(tech_id))
+            heapq.heappush(done_at, (now + rnd.expovariate(1 / speed[tech_id]), task_id))
+        # индекс Джейна по доле времени, которую каждый техник был занят
+        busy = [counts[t] * speed[t] for t in range(techs)]
+        jain = sum(busy) ** 2 / (techs * sum(b * b for b in busy))
+        return pick_s / tasks * 1e6, max(peak), statistics.pstdev(peak), jain
+
+    def first_to_press(pool: TechPool, task_id: int) -> int:
+        # ручной режим: таску берёт тот, кто первым увидел, без оглядки на загрузку
+        tech_id = rnd.randrange(techs)
+        pool.track(task_id, tech_id, f"t{tech_id}")
+        return tech_id
+
+    def heap_assign(pool: TechPool, task_id: int) -> int:
+        return pool.assign(task_id)[0]
+
+    print(f"\n== assign ({tasks} тасок, {techs} техников) ==")
+    print(f"{'strategy':<16} {'pick мкс':>8} {'max load':>9} {'load σ':>7} {'Jain':>6}")
+    for name, pick in (("first to press", first_to_press), ("TechPool", heap_assign)):
+        pick_us, max_load, sigma, jain = simulate(pick)
+        print(f"{name:<16} {pick_us:>8.2f} {max_load:>9} {sigma:>7.2f} {jain:>6.3f}")
+
+
+def bench_backlog() -> None:
+    """/backlog: keyset по частичному индексу против «выбрать все открытые и отсортировать в Python»."""
+    statuses = ("done", "done", "done", "cancelled", "done", "done", "new", "in_progress", "on_hold", "done")
+    now = datetime.utcnow().isoformat()
+    size, pages, limit = int(os.getenv("BENCH_BACKLOG_TASKS", "300000")), 20, 10
+
+    with tempfile.TemporaryDirectory() as tmp:
+        store = TaskStore(os.path.join(tmp, "backlog.db"))
+        store.init_schema()
+        with store.transaction() as conn:
+            conn.executemany(
+                "INSERT INTO tasks (manager_id, manager_username, content, status, priority, created_at, updated_at) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                ((i % 200, f"m{i % 200}", f"task {i}", statuses[i % 10], (i * 7) % 3, now, now) for i in range(size)),
+            )
+
+        def python_sort(page: int) -> list:
+            with store.pool.connection() as conn:
+                rows = conn.execute(
+                    "SELECT id, content, status, tech_username, priority, created_at FROM tasks WHERE status IN ('new', 'in_progress', 'on_hold')"
+                ).fetchall()
+            rows.sort(key=lambda r: (r[4], r[0]))
+            return rows[page * limit : (page + 1) * limit]
+
+        started = time.perf_counter()
+        expected = [python_sort(page) for page in range(pages)]
+        sort_ms = (time.perf_counter() - started) / pages * 1000
+
+        got, cursor = [], None
+        started = time.perf_counter()
+        for _ in range(pages):
+            rows, _, _ = store.backlog(after=cursor, limit=limit)
+            got.append(rows)
+            cursor = (rows[-1][4], rows[-1][0])
+        keyset_ms = (time.perf_counter() - started) / pages * 1000
+        store.close()
+
+    print(f"\n== backlog ({size} тасок, {size * 3 // 10} открытых, {pages} страниц) ==")
+    print(f"Python sort: {sort_ms:>8.2f} мс/страница")
+    print(f"keyset:      {keyset_ms:>8.3f} мс/страница")
+    if got != expected:
+        print("FAIL: страницы keyset не совпали с сортировкой")
+        sys.exit(1)
+
+
+def bench_callbacks() -> None:
+    """Кнопки карточек: подписанная callback_data и отсев устаревших нажатий в памяти против похода в БД."""
+    from callback_codec import CallbackCodec
+
+    codec = CallbackCodec(b"bench", ("take", "done", "hold", "cancel"))
+    n = N_OPS * 50
+    started = time.perf_counter()
+    for i in range(n):
+        codec.encode("done", i, 2)
+    encode_ns = (time.perf_counter() - started) / n * 1e9
+    data = [codec.encode("done", i, 2) for i in range(N_OPS)]
+    started = time.perf_counter()
+    for i in range(n):
+        codec.decode(data[i % N_OPS])
+    decode_ns = (time.perf_counter() - started) / n * 1e9
+    forged = [("B" if d[0] != "B" else "C") + d[1:] for d in data]
+    if any(codec.decode(d) is not None for d in forged) or codec.decode(data[7]) != ("done", 7, 2):
+        print("FAIL: codec пропустил подделку или не разобрал свою же кнопку")
+        sys.exit(1)
+
+    # устаревшие нажатия: «Беру таску» на уже взятой карточке
+    presses = max(1000, N_OPS)
+
+    async def stale_presses(db: AsyncTaskStore, in_memory: bool) -> tuple:
+        task_id = await db.create_task(1, "manager", "stale")
+        task = await db.take_task(task_id, 1, "tech1")
+        versions = {task_id: task.card_version}
+        stale = codec.encode("take", task_id, task.card_version - 1)
+        rejected = 0
+        started = time.perf_counter()
+        for i in range(presses):
+            if in_memory:
+                _, pressed_id, version = codec.decode(stale)
+                rejected += versions.get(pressed_id) != version
+            else:
+                # старая схема: разбор "take:123" и compare-and-set в БД, который не проходит
+                pressed_id = int(f"take:{task_id}".split(":", 1)[1])
+                rejected += await db.take_task(pressed_id, i, f"tech{i}") is None
+        return rejected, (time.perf_counter() - started) / presses * 1e6
+
+    with tempfile.TemporaryDirectory() as tmp:
+        store = TaskStore(os.path.join(tmp, "callbacks.db"))
+        store.init_schema()
+        db = AsyncTaskStore(store)
+        db_rejected, db_us = asyncio.run(stale_presses(db, False))
+        mem_rejected, mem_us = asyncio.run(stale_presses(db, True))
+        db.close()
+
+    print(f"\n== callbacks ({n} encode/decode, {presses} stale presses) ==")
+    print(f"callback_data          {len(codec.encode('cancel', 123456, 3)):>8} символов  (было {len('cancel:123456')}, без версии и подписи)")
+    print(f"encode                 {encode_ns:>8.0f} ns")
+    print(f"decode + HMAC          {decode_ns:>8.0f} ns")
+    print(f"stale press, DB CAS    {db_us:>8.1f} us  ({db_rejected} rejected)")
+    print(f"stale press, in memory {mem_us:>8.1f} us  ({mem_rejected} rejected)")
+    if db_rejected != presses or mem_rejected != presses:
+        print("FAIL: устаревшее нажатие прошло")
+        sys.exit(1)
+
+
+def bench_routing() -> None:
+    """Маршрутизация по тех-чатам: словарь «префикс -> правило» против обхода правил по очереди."""
+    import random
+    import re
+
+    from routing import Router
+
+    rng = random.Random(1)
+    n_chats, n_rules, per_rule = 10, 50, 20
+    letters = "абвгдежзийклмнопрстуфхцчшщыэюя"
+    vocabulary = sorted({"".join(rng.choice(letters) for _ in range(rng.randint(4, 10))) for _ in range(5000)})
+    chats = {f"c{i}": -1000 - i for i in range(n_chats)}
+    rules = [{"chat": f"c{r % n_chats}", "keywords": rng.sample(vocabulary, per_rule)} for r in range(n_rules)]
+    router = Router(-1, chats, rules)
+    texts = [" ".join(rng.choice(vocabulary) for _ in range(30)) for _ in range(N_OPS)]
+
+    def naive(text: str) -> int:
+        words = re.findall(r"\w+", text.lower())
+        for rule in rules:
+            if any(word.startswith(keyword) for keyword in rule["keywords"] for word in words):
+                return chats[rule["chat"]]
+        return -1
+
+    results = {}
+    for name, route in (("rules one by one", naive), ("prefix dict", router.route)):
+        started = time.perf_counter()
+        results[name] = [route(text) for text in texts]
+        results[name + " us"] = (time.perf_counter() - started) / len(texts) * 1e6
+
+    routed = results["prefix dict"]
+    print(f"\n== routing ({n_rules} правил x {per_rule} слов, {n_chats} чатов, {len(texts)} тасок по 30 слов) ==")
+    print(f"rules one by one       {results['rules one by one us']:>8.1f} us/таска")
+    print(f"prefix dict            {results['prefix dict us']:>8.1f} us/таска")
+    busiest = max(routed.count(chat_id) for chat_id in set(routed))
+    print(f"по чатам               {len(set(routed))} чатов, в самом загруженном {busiest * 100 / len(routed):.0f}% тасок")
+    print(f"потолок карточек       {20 * len(routed) / busiest:.0f}/мин при 20/мин на группу (один чат — 20/мин)")
+    if routed != results["rules one by one"]:
+        print("FAIL: собранный матчер разошёлся с правилами")
+        sys.exit(1)
+
+
+def bench_digest() -> None:
+    """Сводки менеджерам: сколько сообщений уходит за рабочий день при разных режимах уведомлений."""
+    import random
+
+    from digest import BATCH, DAILY, IMMEDIATE, DigestSchedule
+
+    rnd = random.Random(1)
+    n_managers = 200
+    # у немногих менеджеров — десятки тасок, у большинства — пара штук (как в живом чате)
+    weights = [1 / (rank + 1) for rank in range(n_managers)]
+    # час пик: вся пачка смен статуса укладывается в один час; размер — свой,
+    # не BENCH_OPS: на малой нагрузке сводкам нечего сливать
+    busy = 3600
+    n_events = int(os.getenv("BENCH_DIGEST_EVENTS", "2000"))
+    events = sorted((rnd.uniform(0, busy), manager) for manager in rnd.choices(range(n_managers), weights, k=n_events))
+    # самые загруженные менеджеры — их immediate заваливает сильнее всех. Цель —
+    # на порядок меньше сообщений им в окне по умолчанию. Всех вместе на порядок
+    # не сократить: почти каждый из 200 менеджеров получает хотя бы одну сводку за окно
+    heavy = set(range(10))
+    default_every = DigestSchedule().batch_minutes
+    target = 10
+
+    print(f"\n== digest ({len(events)} смен статуса за час, {n_managers} менеджеров) ==")
+    print(f"{'режим':<16} {'сообщений':>10} {'топ-10 менеджеров':>18} {'за 15 мин, max':>15} {'задержка p50/max':>18}")
+    results, heavy_results = {}, {}
+    for title, mode, every in (("immediate", IMMEDIATE, None), ("batch 5 мин", BATCH, 5), (f"batch {default_every:g} мин", BATCH, default_every), ("daily", DAILY, None)):
+        now = [0.0]
+        schedule = DigestSchedule(daily_at=(12, 0), clock=lambda: now[0])
+        for manager in range(n_managers):
+            schedule.set_mode(manager, mode, every)
+        first = {}  # manager -> время первого события в очереди
+        sent, sent_heavy, delays, per_slot = 0, 0, [], {}  # per_slot: 15-минутка -> сообщений
+
+        def count(ts: float, manager: int) -> None:
+            nonlocal sent, sent_heavy
+            sent += 1
+            sent_heavy += manager in heavy
+            per_slot[int(ts // 900)] = per_slot.get(int(ts // 900), 0) + 1
+
+        def flush(until: float) -> None:
+            for manager in schedule.pop_due(until):
+                count(until, manager)
+                delays.append(until - first.pop(manager))
+
+        for ts, manager in events:
+            deadline = schedule.next_deadline()
+            while deadline is not None and deadline <= ts:
+                flush(deadline)
+                deadline = schedule.next_deadline()
+            now[0] = ts
+            if not schedule.queues(manager):
+                count(ts, manager)
+                delays.append(0.0)
+                continue
+            first.setdefault(manager, ts)
+            schedule.schedule(manager)
+        while schedule.next_deadline() is not None:
+            flush(schedule.next_deadline())
+        delays.sort()
+        results[title], heavy_results[title] = sent, sent_heavy
+        print(f"{title:<16} {sent:>10} {sent_heavy:>18} {max(per_slot.values()):>15} {delays[len(delays) // 2] / 60:>8.1f}/{delays[-1] / 60:.0f} мин")
+    default = f"batch {default_every:g} мин"
+    overall = results["immediate"] / results[default]
+    heavy_cut = heavy_results["immediate"] / heavy_results[default]
+    print(f"{default} против immediate: в {overall:.1f} раза меньше вызовов sendMessage, у топ-10 менеджеров — в {heavy_cut:.1f} раза")
+    if heavy_cut < target:
+        print(f"FAIL: топ-10 менеджеров получают меньше сообщений только в {heavy_cut:.1f} раза, нужно не меньше чем в {target}")
+        sys.exit(1)
+
+
+def bench_take_race() -> None:
+    """Тысячи параллельных нажатий «Беру таску» на одну и ту же таску."""
+    n = max(1000, N_OPS)
+
+    async def read_then_take(db: AsyncTaskStore, task_id: int, tech_id: int) -> bool:
+        # старая схема callback_handler: get_task -> проверка -> безусловный UPDATE
+        task = await db.get_task(task_id)
+        if task.status != "new":
+            return False
+        await db.update_status(task_id, "in_progress", tech_id=tech_id, tech_username=f"tech{tech_id}")
+        return True
+
+    async def compare_and_set(db: AsyncTaskStore, task_id: int, tech_id: int) -> bool:
+        return await db.take_task(task_id, tech_id, f"tech{tech_id}") is not None
+
+    async def race(db: AsyncTaskStore, press) -> tuple:
+        task_id = await db.create_task(1, "manager", "race")
+        started = time.perf_counter()
+        results = await asyncio.gather(*(press(db, task_id, i) for i in range(n)))
+        return sum(results), time.perf_counter() - started
+
+    with tempfile.TemporaryDirectory() as tmp:
+        store = TaskStore(os.path.join(tmp, "race.db"))
+        store.init_schema()
+        db = AsyncTaskStore(store)
+        old_wins, old_elapsed = asyncio.run(race(db, read_then_take))
+        cas_wins, cas_elapsed = asyncio.run(race(db, compare_and_set))
+        db.close()
+
+    print(f"\n== take_race ({n} parallel presses on one task) ==")
+    print(f"{'mode':<22} {'winners':>12} {'total s':>12}")
+    print(f"{'read then update':<22} {old_wins:>12} {old_elapsed:>12.3f}")
+    print(f"{'compare-and-set':<22} {cas_wins:>12} {cas_elapsed:>12.3f}")
+    if cas_wins != 1:
+        print("FAIL: compare-and-set отдал таску больше чем одному технику")
+        sys.exit(1)
+
+
+def bench_query_plans() -> None:
+    """Регрессия EXPLAIN QUERY PLAN: горячие запросы не должны сканировать tasks."""
+    with tempfile.TemporaryDirectory() as tmp:
+        store = TaskStore(os.path.join(tmp, "plans.db"))
+        store.init_schema()
+        for i in range(N_OPS):
+            store.create_task(i % 50, f"m{i % 50}", f"task {i}")
+        bad = store.check_query_plans()
+        store.close()
+
+    print("\n== query_plans ==")
+    for name in HOT_QUERIES:
+        print(f"{name:<26} {'SCAN' if name in bad else 'ok'}")
+    for name, plan in bad.items():
+        print(f"FAIL: {name}: {' | '.join(plan)}")
+    if bad:
+        sys.exit(1)
+
+
+def _bucket_overflow(times: list, rate: float, capacity: float) -> float:
+    """Сколько токенов не хватило бы token bucket-у (rate, capacity) на эти моменты отправки."""
+    tokens, last, worst = capacity, None, 0.0
+    for ts in sorted(times):
+        if last is not None:
+            tokens = min(capacity, tokens + (ts - last) * rate)
+        last = ts
+        tokens -= 1
+        worst = max(worst, -tokens)
+    return worst
+
+
+def bench_rate_limiter() -> None:
+    """Rate limiter через настоящий HTTP к fake_bot_api.py: потолки по чату и глобально, RetryAfter, приоритеты."""
+    from telegram.error import RetryAfter
+    from telegram.ext import ExtBot
+    from telegram.request import HTTPXRequest
+
+    from fake_bot_api import FakeBotAPI, serve
+    from ratelimit import PRIORITY_EDIT, PRIORITY_NOTIFY, PRIORITY_TASK, TechTaskRateLimiter
+
+    scale = 30.0  # лимиты Telegram x30, чтобы прогон шёл секунды, а не минуты
+    global_rate, group_rate, private_rate = 30 * scale, 20 * scale / 60, 1 * scale
+    global_burst, group_burst, private_burst = 30, 20, 3
+    retry_after = 1
+    # опоздание запроса к фейку (event loop, HTTP): столько токенов прощаем при проверке потолков
+    slack = 2
+    tech_chat = -100
+    # очередь отправок в порядке появления: пачка тасок, правки карточек и уведомления вперемешку
+    plan = []
+    for i in range(60):
+        plan.append(("sendMessage", tech_chat, PRIORITY_TASK))
+        plan.append(("editMessageText", tech_chat, PRIORITY_EDIT))
+        plan.extend(("sendMessage", 1000 + (i * 3 + k) % 40, PRIORITY_NOTIFY) for k in range(3))
+
+    attempts, floods = [], []  # (момент, chat_id) глазами лимитера: выпущенный запрос и полученный 429
+
+    class RecordingLimiter(TechTaskRateLimiter):
+        async def process_request(self, callback, args, kwargs, endpoint, data, rate_limit_args):
+            async def recorded(*a, **kw):
+                attempts.append((time.perf_counter(), data.get("chat_id")))
+                try:
+                    return await callback(*a, **kw)
+                except RetryAfter:
+                    floods.append((time.perf_counter(), data.get("chat_id")))
+                    raise
+
+            return await super().process_request(recorded, args, kwargs, endpoint, data, rate_limit_args)
+
+    async def run() -> tuple:
+        api = FakeBotAPI(latency=0.002, flood_rate=0.03, retry_after=retry_after, seed=1)
+        with socket.socket() as s:
+            s.bind(("127.0.0.1", 0))
+            port = s.getsockname()[1]
+        runner = await serve(api, "127.0.0.1", port)
+        limiter = RecordingLimiter(
+            global_per_sec=global_rate,
+            group_per_min=group_rate * 60,
+            private_per_sec=private_rate,
+            max_retries=50,
+            global_burst=global_burst,
+            group_burst=group_burst,
+            private_burst=private_burst,
+        )
+        bot = ExtBot("1:bench", base_url=f"http://127.0.0.1:{port}/bot", request=HTTPXRequest(connection_pool_size=len(plan), pool_timeout=60), rate_limiter=limiter)
+        latencies = {PRIORITY_TASK: [], PRIORITY_EDIT: [], PRIORITY_NOTIFY: []}
+
+        async def one(endpoint, chat_id, priority):
+            started = time.perf_counter()
+            if endpoint == "editMessageText":
+                await bot.edit_message_text("card", chat_id=chat_id, message_id=1, rate_limit_args={"priority": priority})
+            else:
+                await bot.send_message(chat_id, "text", rate_limit_args={"priority": priority})
+            latencies[priority].append(time.perf_counter() - started)
+
+        await bot.initialize()
+        try:
+            started = time.perf_counter()
+            await asyncio.gather(*(one(*item) for item in plan))
+            elapsed = time.perf_counter() - started
+        finally:
+            await bot.shutdown()
+            await runner.cleanup()
+        return api, latencies, elapsed, limiter.retries
+
+    api, latencies, elapsed, retries = asyncio.run(run())
+    sends = [c for c in api.calls if c.method in ("sendMessage", "editMessageText")]
+    by_chat = {}
+    for call in sends:
+        by_chat.setdefault(int(call.params["chat_id"]), []).append(call.ts)
+
+    print(f"\n== rate_limiter ({len(plan)} sends via fake_bot_api, limits x{scale:.0f}) ==")
+    print(f"delivered {len(plan)} in {elapsed:.1f} s ({len(sends) / elapsed:.0f} calls/s), 429 from fake {api.flooded}, retried {retries}")
+    medians = {}
+    parts = []
+    for prio, name in ((PRIORITY_TASK, "task"), (PRIORITY_EDIT, "edit"), (PRIORITY_NOTIFY, "notify")):
+        lat = sorted(latencies[prio])
+        medians[prio] = lat[len(lat) // 2]
+        parts.append(f"{name} {medians[prio] * 1000:.0f}/{lat[int(len(lat) * 0.95)] * 1000:.0f}")
+    print("p50/p95 ms: " + " | ".join(parts))
+
+    failures = []
+    if sum(len(lat) for lat in latencies.values()) != len(plan):
+        failures.append("не все отправки дошли")
+    # потолки: моменты вызовов должны укладываться в token bucket с теми же лимитами
+    overflow = _bucket_overflow([c.ts for c in sends], global_rate, global_burst)
+    if overflow > slack:
+        failures.append(f"глобальный лимит превышен на {overflow:.1f} сообщений")
+    for chat_id, times in by_chat.items():
+        rate, burst = (group_rate, group_burst) if chat_id < 0 else (private_rate, private_burst)
+        overflow = _bucket_overflow(times, rate, burst)
+        if overflow > slack:
+            failures.append(f"лимит чата {chat_id} превышен на {overflow:.1f} сообщений")
+    # RetryAfter: после полученного 429 лимитер не выпускает в этот чат ничего retry_after секунд
+    for flooded_at, chat_id in floods:
+        early = [ts for ts, chat in attempts if chat == chat_id and flooded_at < ts < flooded_at + retry_after]
+        if early:
+            failures.append(f"чат {chat_id}: {len(early)} запрос(ов) раньше конца retry_after")
+    if not floods:
+        failures.append("фейк ни разу не ответил 429 — RetryAfter не проверен")
+    if medians[PRIORITY_TASK] >= medians[PRIORITY_NOTIFY]:
+        failures.append("посты тасок не обгоняют уведомления менеджерам (p50)")
+    for failure in failures:
+        print(f"FAIL: {failure}")
+    if failures:
+        sys.exit(1)
+
+
+def bench_edit_queue() -> None:
+    """Сколько edit_message_text экономит коалесинг при частых сменах статуса."""
+    import random
+
+    from edit_queue import EditQueue
+    from ratelimit import TokenBucket
+
+    cards, changes = 40, 5
+
+    class SlowGroupBot:
+        # тех-чат: 20 правок в минуту, ускорено в 30 раз
+        def __init__(self):
+            self.bucket = TokenBucket(20 / 60 * 30, 5)
+            self.calls = 0
+            self.edits: dict = {}  # message_id -> [(время вызова, текст)]
+
+        async def edit_message_text(self, chat_id, message_id, text, reply_markup=None, rate_limit_args=None):
+            self.edits.setdefault(message_id, []).append((time.perf_counter(), text))
+            await self.bucket.acquire()
+            await asyncio.sleep(0.002)
+            self.calls += 1
+
+    async def run() -> tuple:
+        bot = SlowGroupBot()
+        queue = EditQueue(window=0.05)
+        queue.start(bot)
+        rnd = random.Random(1)
+        started = time.perf_counter()
+
+        async def card(message_id: int):
+            statuses = ["👤 Взято в работу", "🟡 On Hold", "👤 Взято в работу", "🟢 Done", "🟢 Done"]
+            for status in statuses[:changes]:
+                text = f"card {message_id}\n\n{status}"
+                queue.submit(-100, message_id, text)
+                last[message_id] = text
+                await asyncio.sleep(rnd.uniform(0, 0.3))
+
+        last: dict = {}
+        await asyncio.gather(*(card(i) for i in range(cards)))
+        await queue.stop(timeout=60)
+        return queue, bot, last, time.perf_counter() - started
+
+    queue, bot, last, elapsed = asyncio.run(run())
+    print(f"\n== edit_queue ({cards} cards x {changes} status changes) ==")
+    print(f"requested {queue.stats['requested']}, API calls {bot.calls}, saved {queue.saved} "
+          f"(merged {queue.stats['merged']}, unchanged {queue.stats['unchanged']}), drained in {elapsed:.1f} s")
+
+    # по карточке не больше одной правки за окно, и на экране остаётся последнее состояние
+    failures = []
+    jitter = queue.window * 0.1
+    for message_id, text in last.items():
+        edits = bot.edits.get(message_id, [])
+        bursts = sum(1 for (a, _), (b, _) in zip(edits, edits[1:]) if b - a < queue.window - jitter)
+        if bursts:
+            failures.append(f"карточка {message_id}: {bursts} правок(и) чаще окна {queue.window * 1000:.0f} мс")
+        shown = edits[-1][1] if edits else None
+        if shown != text:
+            failures.append(f"карточка {message_id}: показано {shown!r}, последнее состояние {text!r}")
+    for failure in failures:
+        print(f"FAIL: {failure}")
+    if failures:
+        sys.exit(1)
+
+
+def bench_concurrency() -> None:
+    """Пропускная способность OrderedUpdateProcessor в зависимости от лимита параллельности."""
+    from telegram import Update
+
+    from callback_codec import CallbackCodec
+    from update_processor import OrderedUpdateProcessor
+    from webhook_replay import sample_updates
+
+    handler_ms = 10  # типичный хэндлер: один-два запроса к Bot API
+    codec = CallbackCodec(b"bench", ("take", "done", "hold", "cancel"))
+    raw = sample_updates(200, -100, codec, managers=100, techs=40)
+
+    def task_id_of(data: str):
+        decoded = codec.decode(data)
+        return decoded[1] if decoded else None
+
+    async def run(limit: int) -> tuple:
+        processor = OrderedUpdateProcessor(limit, task_id_of=task_id_of)
+        updates = [Update.de_json(u, None) for u in raw]
+        seen = {}
+        violations = 0
+
+        async def handle(update, seq):
+            nonlocal violations
+            # разная длительность, чтобы без упорядочивания поздний апдейт обгонял ранний
+            await asyncio.sleep(handler_ms / 1000 * (0.2 + (seq * 7919 % 17) / 10))
+            for key in processor.ordering_keys(update):
+                if seen.get(key, -1) > seq:
+                    violations += 1
+                seen[key] = seq
+
+        started = time.perf_counter()
+        # как Application: по задаче на апдейт, в порядке прихода
+        tasks = [asyncio.create_task(processor.process_update(u, handle(u, i))) for i, u in enumerate(updates)]
+        await asyncio.gather(*tasks)
+        return len(updates) / (time.perf_counter() - started), violations
+
+    print(f"\n== concurrency ({len(raw)} updates, handler ~{handler_ms} ms) ==")
+    print(f"{'limit':>6} {'updates/s':>10} {'order violations':>17}")
+    broken = []
+    for limit in (1, 2, 4, 8, 16, 32, 64):
+        rate, violations = asyncio.run(run(limit))
+        print(f"{limit:>6} {rate:>10.0f} {violations:>17}")
+        if violations:
+            broken.append(limit)
+    # порядок внутри таски и пользователя — весь смысл OrderedUpdateProcessor
+    if broken:
+        print(f"FAIL: нарушен порядок апдейтов при лимите {', '.join(map(str, broken))}")
+        sys.exit(1)
+
+
+def bench_metrics() -> None:
+    """Цена инструментирования: пустая корутина с @timed против голой."""
+    from metrics import Registry, timed
+
+    registry = Registry()
+    hist = registry.histogram("bench_seconds", "bench", ("handler",))
+    errors = registry.counter("bench_errors_total", "bench", ("handler",))
+
+    async def handler():
+        pass
+
+    wrapped = timed(hist, "handler", errors=errors)(handler)
+    n = N_OPS * 50
+
+    async def run(fn) -> float:
+        started = time.perf_counter()
+        for _ in range(n):
+            await fn()
+        return (time.perf_counter() - started) / n * 1e9
+
+    bare, timed_ns = asyncio.run(run(handler)), asyncio.run(run(wrapped))
+    child = hist.labels("handler")
+    started = time.perf_counter()
+    for i in range(n):
+        child.observe(i * 1e-6)
+    observe_ns = (time.perf_counter() - started) / n * 1e9
+    started = time.perf_counter()
+    text = registry.render()
+    render_ms = (time.perf_counter() - started) * 1000
+
+    print(f"\n== metrics ({n} calls) ==")
+    print(f"bare coroutine         {bare:>8.0f} ns")
+    print(f"@timed coroutine       {timed_ns:>8.0f} ns  (+{timed_ns - bare:.0f} ns per handler call)")
+    print(f"Histogram.observe      {observe_ns:>8.0f} ns")
+    print(f"render                 {render_ms:>8.2f} ms  ({len(text.splitlines())} lines)")
+
+
+BENCHMARKS = {
+    "db_helpers": bench_db_helpers,
+    "loop_lag": bench_loop_lag,
+    "take_race": bench_take_race,
+    "query_plans": bench_query_plans,
+    "rate_limiter": bench_rate_limiter,
+    "edit_queue": bench_edit_queue,
+    "concurrency": bench_concurrency,
+    "write_batch": bench_write_batch,
+    "task_cache": bench_task_cache,
+    "events": bench_events,
+    "stats": bench_stats,
+    "search": bench_search,
+    "sla": bench_sla,
+    "assign": bench_assign,
+    "backlog": bench_backlog,
+    "callbacks": bench_callbacks,
+    "routing": bench_routing,
+    "digest": bench_digest,
+    "metrics": bench_metrics,
+}
+
+
+if __name__ == "__main__":
+    names = sys.argv[1:] or list(BENCHMARKS)
+    for name in names:
+        if name not in BENCHMARKS:
+            print(f"Неизвестный бенчмарк: {name}. Доступны: {', '.join(BENCHMARKS)}")
+            sys.exit(2)
+        BENCHMARKS[name]()
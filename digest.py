@@ -0,0 +1,178 @@
+# -*- coding: utf-8 -*-
+
+"""
+Расписание сводок для менеджеров вместо уведомления на каждую смену статуса.
+
+У менеджера один из режимов:
+  immediate — как раньше, сообщение на каждое событие (очередь не нужна);
+  batch     — события копятся, сводка уходит через every минут после первого
+              из них (окно считается от первого события, а не скользит);
+  daily     — одна сводка в день в заданное время (UTC).
+
+Сами события лежат в БД (pending_notifications), здесь только кому и когда
+слать: менеджер -> время сводки и min-heap по этому времени, устаревшие
+записи кучи выбрасываются при извлечении, как в sla.py. Воркер просыпается
+к ближайшей сводке и вызывает on_due(manager_id).
+
+    schedule = DigestSchedule(batch_minutes=15, daily_at=(6, 0))
+    schedule.set_mode(manager_id, "batch", every=30)
+    schedule.schedule(manager_id)  # событие в очереди: сводка не позже чем через 30 мин
+    schedule.start(on_due)         # on_due(manager_id) — корутина
+
+Работает только из event loop, блокировок нет.
+"""
+
+import asyncio
+import heapq
+import logging
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Awaitable, Callable, Dict, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# мусор в куче терпим, пока его не больше живых сводок и не меньше этого числа
+COMPACT_MIN_STALE = 1024
+
+IMMEDIATE, BATCH, DAILY = "immediate", "batch", "daily"
+MODES = (IMMEDIATE, BATCH, DAILY)
+
+
+def parse_daily_at(value: str) -> Tuple[int, int]:
+    """'06:00' -> (6, 0); ValueError на кривое значение."""
+    hour, _, minute = value.strip().partition(":")
+    hour, minute = int(hour), int(minute or 0)
+    if not (0 <= hour < 24 and 0 <= minute < 60):
+        raise ValueError(f"время сводки вне суток: {value!r}")
+    return hour, minute
+
+
+class DigestSchedule:
+    def __init__(self, batch_minutes: float = 15, daily_at: Tuple[int, int] = (6, 0), default_mode: str = IMMEDIATE, clock: Callable[[], float] = time.time):
+        if default_mode not in MODES:
+            raise ValueError(f"неизвестный режим уведомлений: {default_mode!r}")
+        self.batch_minutes = batch_minutes
+        self.daily_at = daily_at
+        self.default_mode = default_mode
+        self.clock = clock
+        # manager_id -> (режим, минут в окне batch или None); менеджеров с режимом по умолчанию здесь нет
+        self._modes: Dict[int, tuple] = {}
+        self._due: Dict[int, float] = {}  # manager_id -> время ближайшей сводки
+        self._heap = []  # (время сводки, manager_id); запись живая, пока совпадает с _due
+        self._wake = asyncio.Event()
+        self._worker: Optional[asyncio.Task] = None
+        self._tasks = set()
+
+    def __len__(self) -> int:
+        return len(self._due)
+
+    # ----------------- Режимы -----------------
+    def mode(self, manager_id: int) -> tuple:
+        """(режим, минут в окне) — для batch окно своё или batch_minutes."""
+        mode, every = self._modes.get(manager_id, (self.default_mode, None))
+        if mode == BATCH and not every:
+            every = self.batch_minutes
+        return mode, every
+
+    def set_mode(self, manager_id: int, mode: str, every: Optional[float] = None) -> None:
+        """Новый режим; уже назначенная сводка переносится под него."""
+        if mode not in MODES:
+            raise ValueError(f"неизвестный режим уведомлений: {mode!r}")
+        self._modes[manager_id] = (mode, every if mode == BATCH else None)
+        if manager_id in self._due:
+            # immediate — отдать накопленное сразу, остальные — пересчитать срок
+            self._push(manager_id, self.clock() if mode == IMMEDIATE else self._deadline(manager_id, self.clock()))
+
+    def queues(self, manager_id: int) -> bool:
+        """Копить ли события менеджера, а не слать сразу."""
+        return self.mode(manager_id)[0] != IMMEDIATE
+
+    # ----------------- Сводки -----------------
+    def schedule(self, manager_id: int, since: Optional[float] = None) -> None:
+        """
+        У менеджера появилось событие в очереди (since — когда, по умолчанию сейчас).
+
+        Уже назначенную сводку не двигает: окно batch считается от первого
+        события, иначе при непрерывном потоке сводка не ушла бы никогда.
+        """
+        if manager_id not in self._due:
+            self._push(manager_id, self._deadline(manager_id, self.clock() if since is None else since))
+
+    def retry(self, manager_id: int, delay: float) -> None:
+        """Сводка не ушла: повторить через delay секунд, в каком бы режиме ни был менеджер."""
+        if manager_id not in self._due:
+            self._push(manager_id, self.clock() + delay)
+
+    def _deadline(self, manager_id: int, since: float) -> float:
+        mode, every = self.mode(manager_id)
+        if mode == BATCH:
+            return since + every * 60
+        if mode == DAILY:
+            moment = datetime.fromtimestamp(since, timezone.utc)
+            at = moment.replace(hour=self.daily_at[0], minute=self.daily_at[1], second=0, microsecond=0)
+            if at <= moment:
+                at += timedelta(days=1)
+            return at.timestamp()
+        return since
+
+    def pop_due(self, now: Optional[float] = None) -> list:
+        """Снимает менеджеров, которым пора слать сводку."""
+        now = self.clock() if now is None else now
+        due = []
+        while self._heap and self._heap[0][0] <= now:
+            deadline, manager_id = heapq.heappop(self._heap)
+            if self._due.get(manager_id) == deadline:
+                del self._due[manager_id]
+                due.append(manager_id)
+        return due
+
+    def next_deadline(self) -> Optional[float]:
+        heap = self._heap
+        while heap and self._due.get(heap[0][1]) != heap[0][0]:
+            heapq.heappop(heap)
+        return heap[0][0] if heap else None
+
+    def _push(self, manager_id: int, deadline: float) -> None:
+        top = self.next_deadline()
+        self._due[manager_id] = deadline
+        heapq.heappush(self._heap, (deadline, manager_id))
+        if top is None or deadline < top:
+            self._wake.set()
+        stale = len(self._heap) - len(self._due)
+        if stale >= COMPACT_MIN_STALE and stale > len(self._due):
+            self._heap = [(d, m) for m, d in self._due.items()]
+            heapq.heapify(self._heap)
+
+    # ----------------- Воркер -----------------
+    def start(self, on_due: Callable[[int], Awaitable[None]]) -> None:
+        self._worker = asyncio.create_task(self._run(on_due))
+
+    async def stop(self) -> None:
+        if self._worker:
+            self._worker.cancel()
+            self._worker = None
+        for task in list(self._tasks):
+            task.cancel()
+
+    async def _run(self, on_due) -> None:
+        while True:
+            self._wake.clear()
+            deadline = self.next_deadline()
+            timeout = None if deadline is None else max(0.0, deadline - self.clock())
+            if timeout is None or timeout > 0:
+                try:
+                    await asyncio.wait_for(self._wake.wait(), timeout)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            for manager_id in self.pop_due():
+                # отправка ждёт rate limiter — воркер на это время не блокируем
+                task = asyncio.create_task(self._fire(on_due, manager_id))
+                self._tasks.add(task)
+                task.add_done_callback(self._tasks.discard)
+
+    async def _fire(self, on_due, manager_id: int) -> None:
+        try:
+            await on_due(manager_id)
+        except Exception:
+            logger.exception(f"Не удалось отправить сводку менеджеру {manager_id}")
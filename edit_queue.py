@@ -0,0 +1,132 @@
+# -*- coding: utf-8 -*-
+
+"""
+Очередь правок сообщений в тех-чате с коалесингом.
+
+Правки складываются по ключу (chat_id, message_id): если карточку успели
+поменять несколько раз, пока предыдущая правка ждала своей очереди в rate
+limiter-е, уйдёт только последняя версия текста и клавиатуры. Правки,
+которые ничего не меняют относительно уже отправленного, не отправляются
+вовсе (и не ловят "message is not modified").
+"""
+
+import asyncio
+import logging
+from collections import OrderedDict
+from typing import Optional
+
+from telegram import InlineKeyboardMarkup
+from telegram.error import BadRequest
+
+from ratelimit import PRIORITY_EDIT
+
+logger = logging.getLogger(__name__)
+
+
+def _fingerprint(text: str, reply_markup: Optional[InlineKeyboardMarkup]) -> int:
+    return hash((text, reply_markup.to_json() if reply_markup else None))
+
+
+class EditQueue:
+    def __init__(self, window: float = 0.05, concurrency: int = 8, remember: int = 10_000):
+        # window — сколько ждём после первой правки, чтобы собрать следом идущие
+        self.window = window
+        self._sem = asyncio.Semaphore(concurrency)
+        self._remember = remember
+        self._pending: "OrderedDict[tuple, tuple]" = OrderedDict()
+        self._sent: "OrderedDict[tuple, int]" = OrderedDict()  # LRU отпечатков отправленного
+        self._inflight = set()
+        self._tasks = set()
+        self._wake = asyncio.Event()
+        self._worker: Optional[asyncio.Task] = None
+        self.bot = None
+        self.stats = {"requested": 0, "sent": 0, "merged": 0, "unchanged": 0, "failed": 0}
+
+    @property
+    def saved(self) -> int:
+        """Сколько вызовов edit_message_text удалось не делать."""
+        return self.stats["merged"] + self.stats["unchanged"]
+
+    def depth(self) -> int:
+        return len(self._pending)
+
+    def start(self, bot) -> None:
+        self.bot = bot
+        self._worker = asyncio.create_task(self._run())
+
+    async def stop(self, timeout: float = 10) -> None:
+        """Досылает накопленное и останавливает воркер."""
+        deadline = asyncio.get_running_loop().time() + timeout
+        while (self._pending or self._tasks) and asyncio.get_running_loop().time() < deadline:
+            self._wake.set()
+            await asyncio.sleep(0.05)
+        if self._worker:
+            self._worker.cancel()
+            self._worker = None
+        logger.info(
+            f"Edit queue: запрошено {self.stats['requested']}, отправлено {self.stats['sent']}, "
+            f"сэкономлено {self.saved} (слито {self.stats['merged']}, без изменений {self.stats['unchanged']})"
+        )
+
+    def remember(self, chat_id: int, message_id: int, text: str, reply_markup: Optional[InlineKeyboardMarkup] = None) -> None:
+        """Запоминает, что сейчас показано в сообщении (например, сразу после send_message)."""
+        key = (chat_id, message_id)
+        self._sent[key] = _fingerprint(text, reply_markup)
+        self._sent.move_to_end(key)
+        while len(self._sent) > self._remember:
+            self._sent.popitem(last=False)
+
+    def submit(self, chat_id: int, message_id: int, text: str, reply_markup: Optional[InlineKeyboardMarkup] = None) -> None:
+        key = (chat_id, message_id)
+        self.stats["requested"] += 1
+        if key in self._pending:
+            self.stats["merged"] += 1
+        self._pending[key] = (text, reply_markup)
+        self._wake.set()
+
+    async def _run(self) -> None:
+        while True:
+            await self._wake.wait()
+            self._wake.clear()
+            if self.window:
+                await asyncio.sleep(self.window)
+            for key in list(self._pending):
+                # по одному ключу одновременно летит не больше одной правки
+                if key in self._inflight:
+                    continue
+                text, reply_markup = self._pending.pop(key)
+                if self._sent.get(key) == _fingerprint(text, reply_markup):
+                    self.stats["unchanged"] += 1
+                    continue
+                self._inflight.add(key)
+                task = asyncio.create_task(self._send(key, text, reply_markup))
+                self._tasks.add(task)
+                task.add_done_callback(self._tasks.discard)
+
+    async def _send(self, key: tuple, text: str, reply_markup: Optional[InlineKeyboardMarkup]) -> None:
+        chat_id, message_id = key
+        try:
+            async with self._sem:
+                await self.bot.edit_message_text(
+                    chat_id=chat_id,
+                    message_id=message_id,
+                    text=text,
+                    reply_markup=reply_markup,
+                    rate_limit_args={"priority": PRIORITY_EDIT},
+                )
+            self.stats["sent"] += 1
+            self.remember(chat_id, message_id, text, reply_markup)
+        except BadRequest as e:
+            if "not modified" in str(e):
+                self.stats["unchanged"] += 1
+                self.remember(chat_id, message_id, text, reply_markup)
+            else:
+                self.stats["failed"] += 1
+                logger.exception(f"Failed to edit message {chat_id}/{message_id}")
+        except Exception:
+            self.stats["failed"] += 1
+            logger.exception(f"Failed to edit message {chat_id}/{message_id}")
+        finally:
+            self._inflight.discard(key)
+            if key in self._pending:
+                self._wake.set()
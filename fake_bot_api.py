@@ -0,0 +1,193 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Локальный фейковый Bot API для нагрузочных прогонов.
+
+Бот подключается к нему через BOT_API_URL (ApplicationBuilder.base_url):
+
+    python fake_bot_api.py --port 8081 --latency-ms 40 --flood-rate 0.01
+    BOT_API_URL=http://127.0.0.1:8081/bot python main.py
+
+Реализованы getMe, getUpdates (long polling), sendMessage, editMessageText,
+answerCallbackQuery, sendPhoto/sendDocument/sendVideo и sendMediaGroup
+(только по file_id, без загрузки файлов); остальные методы отвечают {"ok": true, "result": true}.
+Каждый вызов записывается в FakeBotAPI.calls. Задержка ответа и доля
+ответов 429 (RetryAfter) настраиваются.
+"""
+
+import argparse
+import asyncio
+import json
+import random
+import time
+from collections import namedtuple
+from typing import Callable, List, Optional
+
+from aiohttp import web
+
+Call = namedtuple("Call", "ts method params")
+
+BOT_USER = {"id": 4242, "is_bot": True, "first_name": "TECH TASK", "username": "tech_task_fake_bot"}
+
+# поля, которые PTB шлёт как JSON-строки внутри form-data
+_JSON_FIELDS = ("chat_id", "message_id", "offset", "limit", "timeout", "reply_markup", "allowed_updates", "show_alert", "cache_time", "media")
+
+
+class FakeBotAPI:
+    def __init__(self, latency: float = 0.0, jitter: float = 0.0, flood_rate: float = 0.0, retry_after: int = 1, seed: Optional[int] = None):
+        self.latency = latency
+        self.jitter = jitter
+        self.flood_rate = flood_rate
+        self.retry_after = retry_after
+        self.calls: List[Call] = []
+        self.listeners: List[Callable[[Call], None]] = []
+        self.flooded = 0
+        self._rnd = random.Random(seed)
+        self._updates = []
+        self._next_update_id = 1
+        self._new_updates = asyncio.Event()
+        self._message_ids = {}
+
+    # ----------------- Сторона «пользователей» -----------------
+    def push_update(self, update: dict) -> int:
+        """Кладёт апдейт в очередь getUpdates; update_id проставляется сам."""
+        update = dict(update, update_id=self._next_update_id)
+        self._next_update_id += 1
+        self._updates.append(update)
+        self._new_updates.set()
+        return update["update_id"]
+
+    def calls_of(self, method: str) -> List[Call]:
+        return [c for c in self.calls if c.method == method]
+
+    # ----------------- HTTP -----------------
+    def build_web_app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_route("*", "/bot{token}/{method}", self._handle)
+        return app
+
+    async def _read_params(self, request: web.Request) -> dict:
+        if request.content_type == "application/json":
+            return await request.json()
+        params = dict(await request.post()) if request.can_read_body else {}
+        params.update(request.query)
+        for key in _JSON_FIELDS:
+            if isinstance(params.get(key), str):
+                try:
+                    params[key] = json.loads(params[key])
+                except ValueError:
+                    pass
+        return params
+
+    async def _handle(self, request: web.Request) -> web.Response:
+        method = request.match_info["method"]
+        params = await self._read_params(request)
+        if method in ("sendMessage", "sendPhoto", "sendDocument", "sendVideo"):
+            # id выдаётся при получении запроса: слушатели видят его в params["message_id"]
+            # ещё до ответа, даже если несколько отправок в чат летят одновременно
+            params["message_id"] = self._next_message_id(params["chat_id"])
+        call = Call(time.perf_counter(), method, params)
+        self.calls.append(call)
+        for listener in self.listeners:
+            listener(call)
+
+        if method == "getUpdates":
+            return web.json_response({"ok": True, "result": await self._get_updates(params)})
+
+        if self.latency or self.jitter:
+            await asyncio.sleep(self.latency + self._rnd.uniform(0, self.jitter))
+        if method not in ("getMe", "deleteWebhook", "setWebhook") and self.flood_rate and self._rnd.random() < self.flood_rate:
+            self.flooded += 1
+            return web.json_response(
+                {
+                    "ok": False,
+                    "error_code": 429,
+                    "description": f"Too Many Requests: retry after {self.retry_after}",
+                    "parameters": {"retry_after": self.retry_after},
+                },
+                # PTB превращает в RetryAfter только ответ с HTTP 429, на 200 он ищет "result"
+                status=429,
+            )
+        handler = getattr(self, "_m_" + method, None)
+        result = handler(params) if handler else True
+        return web.json_response({"ok": True, "result": result})
+
+    async def _get_updates(self, params: dict) -> list:
+        offset = int(params.get("offset") or 0)
+        limit = int(params.get("limit") or 100)
+        timeout = float(params.get("timeout") or 0)
+        if offset:
+            self._updates = [u for u in self._updates if u["update_id"] >= offset]
+        if not self._updates and timeout:
+            self._new_updates.clear()
+            try:
+                await asyncio.wait_for(self._new_updates.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+        return self._updates[:limit]
+
+    # ----------------- Методы Bot API -----------------
+    def _next_message_id(self, chat_id) -> int:
+        message_id = self._message_ids.get(chat_id, 0) + 1
+        self._message_ids[chat_id] = message_id
+        return message_id
+
+    def _message(self, params: dict, message_id: int) -> dict:
+        chat_id = params["chat_id"]
+        message = {
+            "message_id": message_id,
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "group" if int(chat_id) < 0 else "private"},
+            "from": BOT_USER,
+            "text": params.get("text", ""),
+        }
+        if params.get("reply_markup"):
+            message["reply_markup"] = params["reply_markup"]
+        return message
+
+    def _m_getMe(self, params: dict) -> dict:
+        return BOT_USER
+
+    def _m_sendMessage(self, params: dict) -> dict:
+        return self._message(params, message_id=params["message_id"])
+
+    def _m_editMessageText(self, params: dict) -> dict:
+        return self._message(params, message_id=int(params["message_id"]))
+
+    def _m_sendPhoto(self, params: dict) -> dict:
+        return self._message(params, message_id=params["message_id"])
+
+    _m_sendDocument = _m_sendVideo = _m_sendPhoto
+
+    def _m_sendMediaGroup(self, params: dict) -> list:
+        return [self._message(params, message_id=self._next_message_id(params["chat_id"])) for _ in params.get("media") or ()]
+
+
+async def serve(api: FakeBotAPI, host: str, port: int) -> web.AppRunner:
+    runner = web.AppRunner(api.build_web_app(), access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    return runner
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8081)
+    parser.add_argument("--latency-ms", type=float, default=0)
+    parser.add_argument("--jitter-ms", type=float, default=0)
+    parser.add_argument("--flood-rate", type=float, default=0, help="доля ответов 429")
+    args = parser.parse_args()
+
+    async def run():
+        api = FakeBotAPI(args.latency_ms / 1000, args.jitter_ms / 1000, args.flood_rate)
+        await serve(api, args.host, args.port)
+        print(f"Fake Bot API: http://{args.host}:{args.port}/bot")
+        await asyncio.Event().wait()
+
+    asyncio.run(run())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,355 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Нагрузочный прогон бота против fake_bot_api.py.
+
+Поднимает фейковый Bot API, запускает `python main.py` отдельным процессом
+(BOT_API_URL указывает на фейк, БД — во временной папке) и гоняет
+синтетический трафик: менеджеры шлют /connect, техники жмут кнопки
+на появившихся в тех-чате карточках (callback_data берётся из реальной
+клавиатуры, которую бот отправил).
+
+    python loadtest.py --connects 500 --rate 50 --techs 5 --latency-ms 30
+    python loadtest.py --mode webhook --dup-presses 3 --flood-rate 0.02
+    python loadtest.py --album-rate 0.3 --bot-env MEDIA_GROUP_MS=300
+
+Отчёт: p50/p95/p99 сквозной задержки /connect (апдейт -> ответ менеджеру)
+и нажатий «Беру таску» / «Done» (апдейт -> тост answerCallbackQuery, то есть
+первый видимый технику отклик, и апдейт -> правка карточки), повторные
+answerCallbackQuery, updates/sec и средние из /metrics бота (хэндлеры, БД,
+Bot API). Взявший таску техник закрывает её кнопкой Done (--done-rate).
+Доля --album-rate /connect уходит альбомом из трёх фото (подпись у первого);
+задержка таких /connect включает окно сборки альбома MEDIA_GROUP_MS.
+"""
+
+import argparse
+import asyncio
+import os
+import random
+import signal
+import socket
+import sys
+import tempfile
+import time
+
+import aiohttp
+
+from fake_bot_api import FakeBotAPI, serve
+from webhook import SECRET_HEADER
+from webhook_replay import callback_update, message_update, user
+
+TECH_CHAT_ID = -100_100
+BOT_TOKEN = "123456:LOADTEST"
+WEBHOOK_SECRET = "loadtest-secret"
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def metric_means(text: str, prefix: str) -> dict:
+    """Средние по гистограмме из текста /metrics: {значение первой метки: (мс, count)}."""
+    sums, counts = {}, {}
+    for line in text.splitlines():
+        if not line.startswith(prefix) or "{" not in line:
+            continue
+        name, rest = line.split("{", 1)
+        label = rest.split('"', 2)[1]
+        value = float(rest.rsplit(" ", 1)[1])
+        if name == prefix + "_sum":
+            sums[label] = value
+        elif name == prefix + "_count":
+            counts[label] = value
+    return {k: (sums[k] / counts[k] * 1000, int(counts[k])) for k in counts if counts[k] and k in sums}
+
+
+def percentiles(values: list) -> str:
+    if not values:
+        return "n/a"
+    values = sorted(values)
+    pick = lambda q: values[min(len(values) - 1, int(len(values) * q))] * 1000
+    return f"p50={pick(0.5):.1f} p95={pick(0.95):.1f} p99={pick(0.99):.1f} ms (n={len(values)})"
+
+
+def album_updates(sender: dict, caption: str, album: int, parts: int) -> list:
+    """Альбом из parts фото: отдельный апдейт на каждую часть, подпись у первой."""
+    updates = []
+    for part in range(parts):
+        update = message_update(None, sender, "", message_id=part + 1)
+        message = update["message"]
+        del message["text"]
+        message["media_group_id"] = f"album{album}"
+        message["photo"] = [{"file_id": f"photo{album}_{part}", "file_unique_id": f"u{album}_{part}", "width": 90, "height": 90}]
+        if not part:
+            message["caption"] = caption
+            message["caption_entities"] = [{"type": "bot_command", "offset": 0, "length": len(caption.split(maxsplit=1)[0])}]
+        updates.append(update)
+    return updates
+
+
+class LoadDriver:
+    def __init__(self, api: FakeBotAPI, args):
+        self.api = api
+        self.args = args
+        self.rnd = random.Random(args.seed)
+        self.techs = [user(200_000 + i, f"Tech{i}") for i in range(args.techs)]
+        self.session = None
+        self.webhook_url = None
+        self.connect_sent = {}  # manager chat_id -> время отправки /connect
+        self.connect_latency = []
+        self.press_sent = {}  # callback_query_id -> время нажатия
+        self.press_info = {}  # callback_query_id -> (вид нажатия, техник, message_id карточки)
+        self.answers = {}  # callback_query_id -> сколько раз бот ответил
+        self.toast = {"take": {}, "done": {}}  # вид -> {callback_query_id: задержка тоста}
+        self.card_latency = {"take": [], "done": []}
+        self.card_waiting = {}  # message_id карточки -> [(вид, время нажатия)] ждут правки
+        self.card_markup = {}  # message_id -> клавиатура после взятия
+        self.winners = {}  # message_id -> техник, взявший таску
+        self.done_planned = 0
+        self.already_taken = 0
+        self.updates_sent = 0
+        self.albums_sent = 0
+        self.first_sent = None
+        self.last_done = None
+        self.done = asyncio.Event()
+        self._press_tasks = set()
+        self._query_seq = 0
+        api.listeners.append(self.on_call)
+
+    @property
+    def expected_presses(self) -> int:
+        return self.args.connects * self.args.dup_presses
+
+    def _finished(self) -> bool:
+        return (
+            len(self.connect_latency) >= self.args.connects
+            and len(self.toast["take"]) >= self.expected_presses
+            and len(self.toast["done"]) >= self.done_planned
+        )
+
+    def _mark(self) -> None:
+        self.last_done = time.perf_counter()
+        if self._finished():
+            self.done.set()
+
+    async def inject(self, update: dict) -> None:
+        self.updates_sent += 1
+        if self.first_sent is None:
+            self.first_sent = time.perf_counter()
+        if self.webhook_url:
+            if update.get("update_id") is None:
+                update["update_id"] = 1_000_000 + self.updates_sent
+            async with self.session.post(self.webhook_url, json=update, headers={SECRET_HEADER: WEBHOOK_SECRET}) as resp:
+                await resp.read()
+        else:
+            self.api.push_update(update)
+
+    # ----------------- Реакция на вызовы бота -----------------
+    def on_call(self, call) -> None:
+        params = call.params
+        if call.method == "sendMessage":
+            chat_id = params.get("chat_id")
+            if chat_id == TECH_CHAT_ID and params.get("reply_markup"):
+                self._schedule_presses(params["reply_markup"], params["message_id"])
+            elif chat_id in self.connect_sent:
+                self.connect_latency.append(call.ts - self.connect_sent.pop(chat_id))
+                self._mark()
+        elif call.method == "editMessageText" and params.get("chat_id") == TECH_CHAT_ID:
+            message_id = int(params["message_id"])
+            for kind, pressed in self.card_waiting.pop(message_id, ()):
+                self.card_latency[kind].append(call.ts - pressed)
+            if params.get("reply_markup") and message_id not in self.card_markup:
+                self.card_markup[message_id] = params["reply_markup"]
+                self._maybe_close(message_id)
+        elif call.method == "answerCallbackQuery":
+            query_id = params.get("callback_query_id")
+            sent = self.press_sent.get(query_id)
+            if sent is None:
+                return
+            self.answers[query_id] = self.answers.get(query_id, 0) + 1
+            kind, tech, message_id = self.press_info[query_id]
+            if query_id in self.toast[kind]:
+                return
+            self.toast[kind][query_id] = call.ts - sent
+            text = params.get("text") or ""
+            if "уже взяли" in text:
+                self.already_taken += 1
+            elif kind == "take" and "взяли в работу" in text:
+                self.card_waiting.setdefault(message_id, []).append((kind, sent))
+                if self.rnd.random() < self.args.done_rate:
+                    self.winners[message_id] = tech
+                    self.done_planned += 1
+                    self._maybe_close(message_id)
+            elif kind == "done":
+                self.card_waiting.setdefault(message_id, []).append((kind, sent))
+            self._mark()
+
+    def _schedule_presses(self, reply_markup: dict, message_id: int) -> None:
+        button = reply_markup["inline_keyboard"][0][0]
+        for tech in self.rnd.sample(self.techs, min(self.args.dup_presses, len(self.techs))):
+            self._spawn(self._press("take", tech, button["callback_data"], message_id))
+
+    def _maybe_close(self, message_id: int) -> None:
+        # Done жмёт победитель, когда увидел и свой тост, и карточку с новыми кнопками
+        if message_id in self.winners and message_id in self.card_markup:
+            done = self.card_markup[message_id]["inline_keyboard"][0][0]
+            self._spawn(self._press("done", self.winners.pop(message_id), done["callback_data"], message_id))
+
+    def _spawn(self, coro) -> None:
+        task = asyncio.ensure_future(coro)
+        self._press_tasks.add(task)
+        task.add_done_callback(self._press_tasks.discard)
+
+    async def _press(self, kind: str, tech: dict, data: str, message_id: int) -> None:
+        await asyncio.sleep(self.rnd.uniform(0, self.args.think_ms / 1000))
+        self._query_seq += 1
+        query_id = f"q{self._query_seq}"
+        self.press_sent[query_id] = time.perf_counter()
+        self.press_info[query_id] = (kind, tech, message_id)
+        await self.inject(callback_update(None, query_id, tech, data, TECH_CHAT_ID, message_id))
+
+    # ----------------- Нагрузка -----------------
+    async def run(self) -> float:
+        interval = 1 / self.args.rate if self.args.rate else 0
+        started = time.perf_counter()
+        for i in range(self.args.connects):
+            manager = user(1_000_000 + i, f"Manager{i}")
+            self.connect_sent[manager["id"]] = time.perf_counter()
+            text = f"/connect нагрузочная таска {i}"
+            if self.rnd.random() < self.args.album_rate:
+                self.albums_sent += 1
+                for update in album_updates(manager, text, i, parts=3):
+                    await self.inject(update)
+            else:
+                await self.inject(message_update(None, manager, text))
+            if interval:
+                await asyncio.sleep(max(0.0, started + (i + 1) * interval - time.perf_counter()))
+        try:
+            await asyncio.wait_for(self.done.wait(), self.args.timeout)
+        except asyncio.TimeoutError:
+            print("⚠️  не все ответы дошли до конца таймаута")
+        return (self.last_done or time.perf_counter()) - self.first_sent
+
+    def report_metrics(self, text: str) -> None:
+        for title, prefix in (("хэндлеры", "tech_task_handler_seconds"), ("БД", "tech_task_db_seconds"), ("Bot API", "tech_task_bot_api_seconds")):
+            means = metric_means(text, prefix)
+            if means:
+                print(f"{title + ', среднее:':<27}" + ", ".join(f"{k}={ms:.1f}ms×{n}" for k, (ms, n) in sorted(means.items())))
+
+    def report(self, elapsed: float) -> None:
+        print(f"\n== loadtest: {self.args.connects} /connect, {self.expected_presses} + {self.done_planned} нажатий, mode={self.args.mode} ==")
+        print(f"updates отправлено:        {self.updates_sent}")
+        print(f"updates/sec:               {self.updates_sent / elapsed:.1f}")
+        print(f"/connect -> ответ:         {percentiles(self.connect_latency)}")
+        # тост — первое, что видит техник; правка карточки видна всему чату
+        print(f"take -> тост:              {percentiles(list(self.toast['take'].values()))}")
+        print(f"take -> правка карточки:   {percentiles(self.card_latency['take'])}")
+        print(f"done -> тост:              {percentiles(list(self.toast['done'].values()))}")
+        print(f"done -> правка карточки:   {percentiles(self.card_latency['done'])}")
+        if self.albums_sent:
+            print(f"альбомов / sendMediaGroup: {self.albums_sent} / {len(self.api.calls_of('sendMediaGroup'))}")
+        print(f"«уже взяли»:               {self.already_taken}")
+        print(f"повторные answerCallback:  {sum(n - 1 for n in self.answers.values())}")
+        print(f"429 от фейка:              {self.api.flooded}")
+        counts = {}
+        for call in self.api.calls:
+            counts[call.method] = counts.get(call.method, 0) + 1
+        print("вызовы Bot API:            " + ", ".join(f"{m}={n}" for m, n in sorted(counts.items())))
+
+
+async def wait_until(predicate, timeout: float, proc) -> None:
+    deadline = time.perf_counter() + timeout
+    while not predicate():
+        if proc.returncode is not None:
+            raise RuntimeError(f"бот завершился с кодом {proc.returncode}")
+        if time.perf_counter() > deadline:
+            raise RuntimeError("бот не поднялся вовремя")
+        await asyncio.sleep(0.05)
+
+
+async def main_async(args) -> None:
+    api = FakeBotAPI(args.latency_ms / 1000, args.jitter_ms / 1000, args.flood_rate, seed=args.seed)
+    api_port = free_port()
+    runner = await serve(api, "127.0.0.1", api_port)
+
+    tmp = tempfile.mkdtemp(prefix="tech_task_load_")
+    env = dict(
+        os.environ,
+        BOT_TOKEN=BOT_TOKEN,
+        BOT_API_URL=f"http://127.0.0.1:{api_port}/bot",
+        TECH_CHAT_ID=str(TECH_CHAT_ID),
+        DB_PATH=os.path.join(tmp, "tasks.db"),
+        MAX_CONCURRENT_UPDATES=str(args.concurrency),
+        METRICS_HOST="127.0.0.1",
+        METRICS_PORT=str(free_port()),
+    )
+    if not args.real_limits:
+        env.update(RATE_GLOBAL_PER_SEC="100000", RATE_GROUP_PER_MIN="6000000", RATE_PRIVATE_PER_SEC="100000")
+    webhook_port = free_port()
+    if args.mode == "webhook":
+        env.update(WEBHOOK_URL=f"http://127.0.0.1:{webhook_port}", PORT=str(webhook_port), WEBHOOK_HOST="127.0.0.1", WEBHOOK_SECRET=WEBHOOK_SECRET)
+    for item in args.bot_env:
+        key, _, value = item.partition("=")
+        env[key] = value
+
+    log_path = os.path.join(tmp, "bot.log")
+    here = os.path.dirname(os.path.abspath(__file__))
+    with open(log_path, "wb") as log:
+        proc = await asyncio.create_subprocess_exec(sys.executable, os.path.join(here, "main.py"), env=env, cwd=here, stdout=log, stderr=log)
+    driver = LoadDriver(api, args)
+    try:
+        async with aiohttp.ClientSession() as session:
+            driver.session = session
+            if args.mode == "webhook":
+                await wait_until(lambda: api.calls_of("setWebhook"), 20, proc)
+                await asyncio.sleep(0.2)
+                driver.webhook_url = f"http://127.0.0.1:{webhook_port}/telegram"
+            else:
+                await wait_until(lambda: api.calls_of("getUpdates"), 20, proc)
+            elapsed = await driver.run()
+            metrics_url = f"http://127.0.0.1:{env['METRICS_PORT']}/metrics"
+            async with session.get(metrics_url) as resp:
+                metrics_text = await resp.text()
+        driver.report(elapsed)
+        driver.report_metrics(metrics_text)
+    except RuntimeError as e:
+        print(f"Ошибка: {e}")
+        with open(log_path, encoding="utf-8", errors="replace") as log:
+            print(log.read()[-3000:])
+    finally:
+        if proc.returncode is None:
+            proc.send_signal(signal.SIGINT)
+            try:
+                await asyncio.wait_for(proc.wait(), 15)
+            except asyncio.TimeoutError:
+                proc.kill()
+        await runner.cleanup()
+        print(f"лог бота: {log_path}")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--connects", type=int, default=300, help="сколько /connect отправить")
+    parser.add_argument("--rate", type=float, default=50, help="/connect в секунду (0 — залпом)")
+    parser.add_argument("--techs", type=int, default=5)
+    parser.add_argument("--dup-presses", type=int, default=1, help="сколько техников одновременно жмут одну карточку")
+    parser.add_argument("--done-rate", type=float, default=1.0, help="доля взятых тасок, которые закрывают кнопкой Done")
+    parser.add_argument("--album-rate", type=float, default=0, help="доля /connect альбомом из трёх фото")
+    parser.add_argument("--think-ms", type=float, default=200, help="задержка техника перед нажатием (до)")
+    parser.add_argument("--latency-ms", type=float, default=30, help="задержка ответа Bot API")
+    parser.add_argument("--jitter-ms", type=float, default=10)
+    parser.add_argument("--flood-rate", type=float, default=0, help="доля ответов 429")
+    parser.add_argument("--concurrency", type=int, default=16, help="MAX_CONCURRENT_UPDATES бота")
+    parser.add_argument("--mode", choices=("polling", "webhook"), default="polling")
+    parser.add_argument("--real-limits", action="store_true", help="не ослаблять исходящие лимиты бота")
+    parser.add_argument("--bot-env", action="append", default=[], metavar="KEY=VALUE", help="доп. переменные окружения бота")
+    parser.add_argument("--timeout", type=float, default=120)
+    parser.add_argument("--seed", type=int, default=1)
+    asyncio.run(main_async(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
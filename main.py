@@ -11,28 +11,111 @@
 """
 
 import os
+import asyncio
+import functools
+import hashlib
+import heapq
 import logging
-import sqlite3
-from datetime import datetime
+import re
+from datetime import datetime, timezone
 from typing import Optional
 
-from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
+from telegram import (
+    Update,
+    InlineKeyboardButton,
+    InlineKeyboardMarkup,
+    InlineQueryResultArticle,
+    InputMediaDocument,
+    InputMediaPhoto,
+    InputMediaVideo,
+    InputTextMessageContent,
+)
+from telegram.error import BadRequest, Forbidden
 from telegram.ext import (
     ApplicationBuilder,
     CommandHandler,
     CallbackQueryHandler,
+    InlineQueryHandler,
     MessageHandler,
     ContextTypes,
     filters,
 )
 
+import metrics
+from assign import TechPool
+from callback_codec import CallbackCodec
+from digest import BATCH, DAILY, MODES, DigestSchedule, parse_daily_at
+from edit_queue import EditQueue
+from media_group import MediaGroupBuffer
+from metrics import HANDLER_ERRORS, HANDLER_SECONDS, REGISTRY, timed
+from ratelimit import PRIORITY_NOTIFY, PRIORITY_TASK, TechTaskRateLimiter
+from routing import Router
+from sla import SlaTimers
+from task_cache import TaskCache
+from task_store import CARD_STATUSES, DEFAULT_PRIORITY, FIRST_CARD_VERSION, AsyncTaskStore, TaskRecord, TaskStore, fts_query
+from update_processor import OrderedUpdateProcessor
+
 # ----------------- Конфиг (берём из env, если есть) -----------------
 BOT_TOKEN = os.getenv("BOT_TOKEN", "8265362344:AAGrWtKnFOT7ZTZpq6rK6MIfDvDBydKfxzo")  # муляж по умолчанию
 try:
     TECH_CHAT_ID = int(os.getenv("TECH_CHAT_ID", "-4844266445"))
 except Exception:
     TECH_CHAT_ID = -4844266445
+# несколько тех-чатов и правила, по которым таски в них раскладываются (см. routing.py);
+# пусто — всё в TECH_CHAT_ID
+ROUTING = os.getenv("ROUTING", "")
 DB_PATH = os.getenv("DB_PATH", "tasks.db")
+# свой Bot API (например, fake_bot_api.py для нагрузочных прогонов); пусто — api.telegram.org
+BOT_API_URL = os.getenv("BOT_API_URL", "")
+DB_READERS = int(os.getenv("DB_READERS", "3"))
+# group commit записей в БД: окно для отложенных записей и максимум операций в транзакции
+WRITE_BATCH_MS = float(os.getenv("WRITE_BATCH_MS", "5"))
+WRITE_BATCH_MAX = int(os.getenv("WRITE_BATCH_MAX", "100"))
+# кэш горячих тасок перед БД: лимит по числу записей и по памяти
+TASK_CACHE_SIZE = int(os.getenv("TASK_CACHE_SIZE", "2000"))
+TASK_CACHE_MB = float(os.getenv("TASK_CACHE_MB", "16"))
+MYTASKS_PAGE_SIZE = int(os.getenv("MYTASKS_PAGE_SIZE", "10"))
+# SLA: через сколько минут в статусе напоминать (и повторять); 0 — не напоминать
+SLA_NEW_MIN = float(os.getenv("SLA_NEW_MIN", "60"))
+SLA_HOLD_MIN = float(os.getenv("SLA_HOLD_MIN", "1440"))
+# автоназначение: новая таска сразу уходит наименее загруженному технику на смене (/duty)
+AUTO_ASSIGN = os.getenv("AUTO_ASSIGN", "0") == "1"
+AUTO_ASSIGN_MAX_LOAD = int(os.getenv("AUTO_ASSIGN_MAX_LOAD", "5"))  # 0 — без лимита
+# уведомления менеджерам о смене статуса (см. digest.py): режим для тех, кто не выбрал
+# свой через /notify (immediate | batch | daily), окно batch и время дневной сводки (UTC)
+NOTIFY_MODE = os.getenv("NOTIFY_MODE", "immediate")
+NOTIFY_BATCH_MIN = float(os.getenv("NOTIFY_BATCH_MIN", "15"))
+NOTIFY_DIGEST_AT = os.getenv("NOTIFY_DIGEST_AT", "06:00")
+
+# Исходящие лимиты Telegram (см. ratelimit.py)
+RATE_GLOBAL_PER_SEC = float(os.getenv("RATE_GLOBAL_PER_SEC", "30"))
+RATE_GROUP_PER_MIN = float(os.getenv("RATE_GROUP_PER_MIN", "20"))
+RATE_PRIVATE_PER_SEC = float(os.getenv("RATE_PRIVATE_PER_SEC", "1"))
+RATE_MAX_RETRIES = int(os.getenv("RATE_MAX_RETRIES", "3"))
+
+# сколько апдейтов обрабатываем одновременно (порядок внутри таски/пользователя сохраняется)
+MAX_CONCURRENT_UPDATES = int(os.getenv("MAX_CONCURRENT_UPDATES", "16"))
+
+# окно, в котором правки одной карточки сливаются в одну (см. edit_queue.py)
+EDIT_COALESCE_MS = float(os.getenv("EDIT_COALESCE_MS", "50"))
+# сколько ждём следующую часть альбома, прежде чем считать его полным (см. media_group.py)
+MEDIA_GROUP_MS = float(os.getenv("MEDIA_GROUP_MS", "1000"))
+
+# Webhook-режим включается, если задан публичный адрес сервиса (иначе — polling)
+WEBHOOK_URL = os.getenv("WEBHOOK_URL", "")
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/telegram")
+WEBHOOK_HOST = os.getenv("WEBHOOK_HOST", "0.0.0.0")
+WEBHOOK_PORT = int(os.getenv("PORT", "8080"))
+# по умолчанию секрет выводится из токена: 1-256 символов [A-Za-z0-9_-]
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET") or hashlib.sha256(BOT_TOKEN.encode()).hexdigest()[:32]
+# ключ подписи callback_data кнопок карточек (см. callback_codec.py); смена ключа
+# делает недействительными кнопки на всех уже разосланных карточках
+CALLBACK_SECRET = os.getenv("CALLBACK_SECRET") or hashlib.sha256(("callback:" + BOT_TOKEN).encode()).hexdigest()
+
+# Prometheus /metrics на отдельном локальном порту (0 — выключено; в webhook-режиме
+# те же метрики есть и на /metrics webhook-сервера)
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+METRICS_PORT = int(os.getenv("METRICS_PORT", "9108"))
 
 # ----------------- Логирование -----------------
 logging.basicConfig(
@@ -41,154 +124,531 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+# правила собираются один раз на старте; кривой ROUTING валит запуск сразу
+router = Router.from_config(TECH_CHAT_ID, ROUTING)
+TASKS_ROUTED = REGISTRY.counter("tech_task_routed_total", "Таски, отправленные в тех-чат", ("chat",))
+# immediate — отдельные сообщения, queued — события, ушедшие в очередь сводок, digest — сами сводки
+NOTIFICATIONS = REGISTRY.counter("tech_task_manager_notifications_total", "Уведомления менеджерам о смене статуса", ("delivery",))
+
 
 # ----------------- Работа с БД -----------------
+# Пул соединений живёт всё время работы бота (см. task_store.py):
+# один поток-писатель + DB_READERS читателей, хэндлеры только await-ят.
+# Записи коммитятся пачками; message_id карточки пишется отложенно.
+# get_task сначала смотрит в task_cache (write-through, LRU).
+store = TaskStore(DB_PATH, pool_size=DB_READERS + 1)
+task_cache = TaskCache(max_entries=TASK_CACHE_SIZE, max_bytes=int(TASK_CACHE_MB * 1024 * 1024))
+db = AsyncTaskStore(store, readers=DB_READERS, batch_window=WRITE_BATCH_MS / 1000, batch_max=WRITE_BATCH_MAX, cache=task_cache)
+# таймеры SLA двигают обёртки ниже (create/take/смена статуса), БД по таймеру не опрашивается
+sla_timers = SlaTimers({"new": SLA_NEW_MIN * 60, "on_hold": SLA_HOLD_MIN * 60})
+# загрузка техников для автоназначения — двигают те же обёртки
+tech_pool = TechPool(max_load=AUTO_ASSIGN_MAX_LOAD)
+# таски, которым не хватило техника: куча (priority, id) — раздаются срочные и старые
+# первыми, как только у кого-то освободится место
+unassigned = []
+# раздача из unassigned — по одной за раз: её запускает каждое закрытие таски и /duty
+assign_lock = asyncio.Lock()
+# id таски -> версия её карточки, только для карточек с кнопками: устаревшие
+# нажатия отсекаются по этому словарю, до БД дело не доходит
+card_versions = {}
+# когда слать сводки менеджерам; сами события ждут в pending_notifications
+digests = DigestSchedule(batch_minutes=NOTIFY_BATCH_MIN, daily_at=parse_daily_at(NOTIFY_DIGEST_AT), default_mode=NOTIFY_MODE)
+
+
 def init_db() -> None:
-    conn = sqlite3.connect(DB_PATH)
-    cur = conn.cursor()
-    cur.execute(
-        """
-    CREATE TABLE IF NOT EXISTS tasks (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        manager_id INTEGER,
-        manager_username TEXT,
-        content TEXT,
-        status TEXT,
-        tech_id INTEGER,
-        tech_username TEXT,
-        tech_chat_message_id INTEGER,
-        created_at TEXT,
-        updated_at TEXT
-    )
-    """
-    )
-    conn.commit()
-    conn.close()
-
-
-def create_task(manager_id: int, manager_username: str, content: str) -> int:
-    now = datetime.utcnow().isoformat()
-    conn = sqlite3.connect(DB_PATH)
-    cur = conn.cursor()
-    cur.execute(
-        """
-        INSERT INTO tasks (manager_id, manager_username, content, status, created_at, updated_at)
-        VALUES (?, ?, ?, 'new', ?, ?)
-    """,
-        (manager_id, manager_username, content, now, now),
-    )
-    task_id = cur.lastrowid
-    conn.commit()
-    conn.close()
+    store.init_schema()
+    for name, plan in store.check_query_plans().items():
+        logger.warning(f"Запрос {name} идёт без индекса: {' | '.join(plan)}")
+
+
+async def on_startup(app) -> None:
+    # тяжёлые backfill-и миграций догоняются пачками уже при живом боте
+    app.bot_data["backfills"] = asyncio.create_task(db.run_backfills())
+    edit_queue.start(app.bot)
+    await load_card_versions()
+    await load_sla_timers()
+    if AUTO_ASSIGN:
+        await load_tech_pool()
+    sla_timers.start(functools.partial(remind_stale_task, app.bot))
+    await load_digests()
+    digests.start(functools.partial(send_digest, app.bot))
+    if METRICS_PORT:
+        try:
+            app.bot_data["metrics_runner"] = await metrics.serve(METRICS_HOST, METRICS_PORT)
+        except OSError:
+            logger.exception(f"Не удалось открыть порт метрик {METRICS_HOST}:{METRICS_PORT}")
+
+
+async def on_stop(app) -> None:
+    # недособранные альбомы становятся тасками, пока БД и очередь правок живы
+    await media_groups.stop()
+    # backfill продолжит со своего водяного знака при следующем старте; пачку,
+    # уже отданную писателю, close_db дождётся
+    backfills = app.bot_data.pop("backfills", None)
+    if backfills is not None:
+        backfills.cancel()
+    await sla_timers.stop()
+    # неотправленные сводки остаются в БД и поднимаются при следующем старте
+    await digests.stop()
+    await edit_queue.stop()
+    runner = app.bot_data.pop("metrics_runner", None)
+    if runner is not None:
+        await runner.cleanup()
+
+
+async def close_db(app=None) -> None:
+    db.close()
+
+
+async def create_task(manager_id: int, manager_username: str, content: str, priority: int = DEFAULT_PRIORITY, attachments: tuple = ()) -> int:
+    task_id = await db.create_task(manager_id, manager_username, content, priority, attachments)
+    sla_timers.track(task_id, "new")
+    card_versions[task_id] = FIRST_CARD_VERSION
     return task_id
 
 
-def set_tech_message_id(task_id: int, msg_id: int) -> None:
-    now = datetime.utcnow().isoformat()
-    conn = sqlite3.connect(DB_PATH)
-    cur = conn.cursor()
-    cur.execute(
-        "UPDATE tasks SET tech_chat_message_id = ?, updated_at = ? WHERE id = ?",
-        (msg_id, now, task_id),
-    )
-    conn.commit()
-    conn.close()
-
-
-def get_task(task_id: int) -> Optional[dict]:
-    conn = sqlite3.connect(DB_PATH)
-    cur = conn.cursor()
-    cur.execute(
-        """
-        SELECT id, manager_id, manager_username, content, status, tech_id, tech_username, tech_chat_message_id, created_at, updated_at
-        FROM tasks WHERE id = ?
-    """,
-        (task_id,),
-    )
-    row = cur.fetchone()
-    conn.close()
-    if not row:
-        return None
-    keys = [
-        "id",
-        "manager_id",
-        "manager_username",
-        "content",
-        "status",
-        "tech_id",
-        "tech_username",
-        "tech_chat_message_id",
-        "created_at",
-        "updated_at",
-    ]
-    return dict(zip(keys, row))
-
-
-def take_task_db(task_id: int, tech_id: int, tech_username: str) -> None:
-    now = datetime.utcnow().isoformat()
-    conn = sqlite3.connect(DB_PATH)
-    cur = conn.cursor()
-    cur.execute(
-        """
-        UPDATE tasks
-        SET tech_id = ?, tech_username = ?, status = 'in_progress', updated_at = ?
-        WHERE id = ?
-    """,
-        (tech_id, tech_username, now, task_id),
+async def set_tech_message_id(task_id: int, chat_id: int, msg_id: int) -> None:
+    await db.set_tech_message_id(task_id, chat_id, msg_id)
+
+
+async def get_task(task_id: int) -> Optional[TaskRecord]:
+    return await db.get_task(task_id)
+
+
+async def take_task_db(task_id: int, tech_id: int, tech_username: str) -> Optional[TaskRecord]:
+    # None — таску уже взяли/закрыли (или её нет); иначе строка после апдейта
+    task = await db.take_task(task_id, tech_id, tech_username)
+    if task:
+        sla_timers.discard(task_id)
+        tech_pool.track(task_id, tech_id, tech_username)
+        track_card(task)
+    return task
+
+
+async def update_status_db(task_id: int, status: str, tech_id: Optional[int] = None, tech_username: Optional[str] = None) -> Optional[TaskRecord]:
+    # строка после апдейта (RETURNING) — отдельный get_task не нужен; None — таски нет
+    task = await db.update_status(task_id, status, tech_id=tech_id, tech_username=tech_username)
+    if task:
+        sla_timers.track(task_id, status)
+        if status != "in_progress":
+            tech_pool.discard(task_id)
+        track_card(task)
+    return task
+
+
+async def search_tasks(text: str, user_id: Optional[int], offset: int, limit: int) -> tuple:
+    return await db.search_tasks(text, user_id=user_id, offset=offset, limit=limit)
+
+
+async def get_stats() -> tuple:
+    return await db.stats()
+
+
+async def get_backlog(after: Optional[tuple] = None, before: Optional[tuple] = None) -> tuple:
+    return await db.backlog(after=after, before=before, limit=BACKLOG_PAGE_SIZE)
+
+
+async def list_manager_tasks(manager_id: int, status: Optional[str] = None, before_id: Optional[int] = None, after_id: Optional[int] = None) -> tuple:
+    return await db.list_manager_tasks(manager_id, status=status, before_id=before_id, after_id=after_id, limit=MYTASKS_PAGE_SIZE)
+
+
+# ----------------- Версии карточек -----------------
+def track_card(task: TaskRecord) -> None:
+    # переход перерисовывает кнопки карточки (или убирает их совсем)
+    if task.status in CARD_STATUSES:
+        card_versions[task.id] = task.card_version
+    else:
+        card_versions.pop(task.id, None)
+
+
+async def load_card_versions() -> None:
+    card_versions.clear()
+    card_versions.update(await db.card_versions())
+    logger.info(f"Карточек с кнопками: {len(card_versions)}")
+
+
+# ----------------- SLA-напоминания -----------------
+def utc_ts(value: str) -> float:
+    # в БД лежит datetime.utcnow().isoformat() без таймзоны
+    return datetime.fromisoformat(value).replace(tzinfo=timezone.utc).timestamp()
+
+
+def format_age(seconds: float) -> str:
+    minutes = int(seconds // 60)
+    if minutes < 60:
+        return f"{minutes} мин"
+    if minutes < 48 * 60:
+        return f"{minutes // 60} ч {minutes % 60} мин"
+    return f"{minutes // (24 * 60)} дн {minutes // 60 % 24} ч"
+
+
+async def load_sla_timers() -> None:
+    # один проход по индексу статуса на старте
+    for status in sla_timers.limits:
+        for task_id, since, _ in await db.status_since(status):
+            sla_timers.track(task_id, status, since=utc_ts(since))
+    logger.info(f"SLA: поднято таймеров — {len(sla_timers)}")
+
+
+async def remind_stale_task(bot, task_id: int, status: str, since: float, fired: int) -> None:
+    task = await get_task(task_id)
+    if not task or task.status != status:
+        # статус поменяли мимо обёрток (другой процесс, ручная правка БД)
+        if task:
+            sla_timers.track(task_id, task.status, since=utc_ts(task.updated_at))
+        else:
+            sla_timers.discard(task_id)
+        return
+    age = format_age(sla_timers.clock() - since)
+    label = STATUS_READABLE.get(status, status)
+    await bot.send_message(
+        chat_id=card_chat_id(task),
+        text=f"⏰ Таска #{task_id} от @{task.manager_username} уже {age} в статусе {label}",
+        reply_to_message_id=task.tech_chat_message_id,
+        allow_sending_without_reply=True,
+        rate_limit_args={"priority": PRIORITY_NOTIFY},
     )
-    conn.commit()
-    conn.close()
-
-
-def update_status_db(task_id: int, status: str, tech_id: Optional[int] = None, tech_username: Optional[str] = None) -> None:
-    now = datetime.utcnow().isoformat()
-    conn = sqlite3.connect(DB_PATH)
-    cur = conn.cursor()
-    if tech_id is not None or tech_username is not None:
-        cur.execute(
-            """
-            UPDATE tasks
-            SET status = ?, tech_id = COALESCE(?, tech_id), tech_username = COALESCE(?, tech_username), updated_at = ?
-            WHERE id = ?
-        """,
-            (status, tech_id, tech_username, now, task_id),
+    if task.manager_id:
+        await bot.send_message(
+            chat_id=task.manager_id,
+            text=f"⏰ Ваша таска #{task_id} уже {age} в статусе {label}. Техотдел получил напоминание.",
+            rate_limit_args={"priority": PRIORITY_NOTIFY},
         )
+
+
+# ----------------- Автоназначение -----------------
+async def load_tech_pool() -> None:
+    for tech_id, username, available in await db.list_technicians():
+        tech_pool.set_available(tech_id, username, available)
+    for task in await db.list_status_tasks("in_progress"):
+        if task.tech_id is not None:
+            tech_pool.track(task.id, task.tech_id, task.tech_username)
+    unassigned[:] = [(priority, task_id) for task_id, _, priority in await db.status_since("new")]
+    heapq.heapify(unassigned)
+    logger.info(f"Автоназначение: на смене {tech_pool.on_duty}, ждут назначения {len(unassigned)}")
+
+
+async def auto_assign(bot, task_id: int, manager_username: str, content: str, card: tuple, priority: int = DEFAULT_PRIORITY) -> bool:
+    """
+    card — (chat_id, message_id) карточки в тех-чате.
+    False — некому назначить, таска ждёт кнопку «Беру таску» или освободившегося техника.
+    """
+    picked = tech_pool.assign(task_id)
+    if picked is None:
+        return False
+    tech_id, username = picked
+    task = await take_task_db(task_id, tech_id, username)
+    if not task:
+        # успели взять руками, пока шёл commit
+        tech_pool.discard(task_id, tech_id)
+        return True
+    logger.info(f"Таска #{task_id} назначена на @{username}")
+    text = format_task_message(task_id, manager_username, content, status_line=f"👤 Назначено на @{username}", priority=priority)
+    edit_queue.submit(*card, text, kb_after_take(task))
+    try:
+        await bot.send_message(
+            chat_id=tech_id,
+            text=f"📌 Вам назначена таска #{task_id} от @{manager_username}{PRIORITY_SUFFIX.get(priority, '')}:\n{content}",
+            rate_limit_args={"priority": PRIORITY_NOTIFY},
+        )
+    except Exception:
+        # личку бот может писать, только если техник хоть раз нажал /start
+        logger.warning(f"Не удалось написать @{username} о таске #{task_id}")
+    return True
+
+
+async def assign_waiting(bot) -> None:
+    # запись снимается с кучи до await: пока ждём БД, в кучу пишет создание тасок,
+    # и unassigned[0] после await — уже другая таска
+    async with assign_lock:
+        while unassigned:
+            entry = heapq.heappop(unassigned)
+            task = await get_task(entry[1])
+            # взятые руками или закрытые за это время пропускаем
+            if not task or task.status != "new" or not task.tech_chat_message_id:
+                continue
+            if not await auto_assign(bot, task.id, task.manager_username, task.content, (card_chat_id(task), task.tech_chat_message_id), task.priority):
+                heapq.heappush(unassigned, entry)
+                return
+
+
+# ----------------- Уведомления -----------------
+# сводка: сколько тасок перечислять и сколько символов текста таски показывать
+DIGEST_MAX_TASKS = 30
+DIGEST_EXCERPT_LEN = 40
+# через сколько секунд повторить сводку, если Telegram её не принял
+DIGEST_RETRY_SEC = 60
+
+
+async def notify_manager(bot, task: TaskRecord, status_text: str) -> None:
+    try:
+        await bot.send_message(
+            chat_id=task.manager_id,
+            text=f"🔔 Таска #{task.id} обновлена: {status_text}",
+            rate_limit_args={"priority": PRIORITY_NOTIFY},
+        )
+        NOTIFICATIONS.labels("immediate").inc()
+    except Exception:
+        logger.exception("Failed to notify manager")
+
+
+async def queue_notification(task: TaskRecord, status_text: str) -> None:
+    # commit вместе с соседними записями пачки; сводка прочитает уже закоммиченное
+    await db.queue_notification(task.manager_id, task.id, status_text)
+    digests.schedule(task.manager_id)
+    NOTIFICATIONS.labels("queued").inc()
+
+
+async def load_digests() -> None:
+    for manager_id, mode, every in await db.list_notify_modes():
+        if mode in MODES:
+            digests.set_mode(manager_id, mode, every)
+    # очередь, оставшаяся с прошлого запуска: окно считается от первого события
+    for manager_id, first in await db.pending_managers():
+        digests.schedule(manager_id, since=utc_ts(first))
+    logger.info(f"Сводки: ждут отправки — {len(digests)}")
+
+
+def format_digest(rows: list) -> str:
+    # по таске — только последний статус: hold и потом done дают одну строку
+    latest = {}
+    for _, task_id, status_text, content in rows:
+        latest[task_id] = (status_text, content)
+    lines = [f"🔔 Сводка по вашим таскам: изменений — {len(rows)}, тасок — {len(latest)}"]
+    for task_id, (status_text, content) in list(latest.items())[:DIGEST_MAX_TASKS]:
+        excerpt = (content or "").split("\n", 1)[0]
+        if len(excerpt) > DIGEST_EXCERPT_LEN:
+            excerpt = excerpt[: DIGEST_EXCERPT_LEN - 1] + "…"
+        lines.append(f"#{task_id} {excerpt} — {status_text}")
+    if len(latest) > DIGEST_MAX_TASKS:
+        lines.append(f"…и ещё {len(latest) - DIGEST_MAX_TASKS}, все — в /mytasks")
+    return "\n".join(lines)
+
+
+async def send_digest(bot, manager_id: int) -> None:
+    rows = await db.pending_notifications(manager_id)
+    if not rows:
+        return
+    try:
+        await bot.send_message(chat_id=manager_id, text=format_digest(rows), rate_limit_args={"priority": PRIORITY_NOTIFY})
+        NOTIFICATIONS.labels("digest").inc()
+    except Forbidden:
+        # менеджер заблокировал бота — копить дальше бессмысленно
+        logger.warning(f"Сводка менеджеру {manager_id} не доставлена (бот заблокирован), событий: {len(rows)}")
+    except Exception:
+        # сеть или Telegram: события остаются в очереди до следующей попытки
+        logger.exception(f"Не удалось отправить сводку менеджеру {manager_id}")
+        digests.retry(manager_id, DIGEST_RETRY_SEC)
+        return
+    # только прочитанное: события, пришедшие во время отправки, ждут следующей сводки
+    await db.delete_notifications(manager_id, rows[-1][0])
+
+
+def describe_notify_mode(mode: str, every: Optional[float]) -> str:
+    if mode == BATCH:
+        return f"сводкой раз в {every:g} мин"
+    if mode == DAILY:
+        return "сводкой раз в день в {:02d}:{:02d} UTC".format(*digests.daily_at)
+    return "сразу, сообщением на каждое изменение"
+
+
+# ----------------- Вложения -----------------
+# файлы не скачиваются: в БД и в тех-чат уходит только file_id, Telegram
+# пересылает сам файл у себя. Альбом приходит частями — их собирает media_groups
+media_groups = MediaGroupBuffer(window=MEDIA_GROUP_MS / 1000)
+CONNECT_CAPTION = re.compile(r"/connect(@\w+)?(\s|$)", re.IGNORECASE)
+INPUT_MEDIA = {"photo": InputMediaPhoto, "document": InputMediaDocument, "video": InputMediaVideo}
+NO_TEXT_CONTENT = "📎 (без текста, см. вложения)"
+
+
+def message_attachment(message) -> Optional[tuple]:
+    """(kind, file_id, file_unique_id) вложения сообщения; у фото — самый крупный размер."""
+    if message.photo:
+        kind, media = "photo", message.photo[-1]
+    elif message.document:
+        kind, media = "document", message.document
+    elif message.video:
+        kind, media = "video", message.video
+    else:
+        return None
+    return kind, media.file_id, media.file_unique_id
+
+
+async def send_attachments(bot, chat_id: int, reply_to: int, attachments: tuple) -> None:
+    # вложения — ответом на карточку: кнопки у карточки, альбом прямо под ней
+    reply = {"reply_to_message_id": reply_to, "allow_sending_without_reply": True, "rate_limit_args": {"priority": PRIORITY_TASK}}
+    if len(attachments) == 1:
+        kind, file_id, _ = attachments[0]
+        send = {"photo": bot.send_photo, "document": bot.send_document, "video": bot.send_video}[kind]
+        await send(chat_id, file_id, **reply)
     else:
-        cur.execute("UPDATE tasks SET status = ?, updated_at = ? WHERE id = ?", (status, now, task_id))
-    conn.commit()
-    conn.close()
+        # альбом целиком — одним вызовом
+        await bot.send_media_group(chat_id, [INPUT_MEDIA[kind](file_id) for kind, file_id, _ in attachments], **reply)
+
 
+# ----------------- Правки карточек в тех-чате -----------------
+edit_queue = EditQueue(window=EDIT_COALESCE_MS / 1000)
 
-def list_manager_tasks(manager_id: int):
-    conn = sqlite3.connect(DB_PATH)
-    cur = conn.cursor()
-    cur.execute("SELECT id, content, status, tech_username, created_at FROM tasks WHERE manager_id = ? ORDER BY id DESC", (manager_id,))
-    rows = cur.fetchall()
-    conn.close()
-    return rows
+
+def card_chat_id(task: TaskRecord) -> int:
+    # у тасок до v10 чат не записан — они все в чате по умолчанию
+    return task.tech_chat_id or TECH_CHAT_ID
+
+
+def edit_task_card(query, task: TaskRecord, text: str, reply_markup: Optional[InlineKeyboardMarkup] = None) -> None:
+    # правка уходит через очередь: быстрые смены статуса одной карточки сливаются
+    if task.tech_chat_message_id:
+        edit_queue.submit(card_chat_id(task), task.tech_chat_message_id, text, reply_markup)
+    elif query.message:
+        # fallback: редактируем само сообщение, откуда пришёл callback
+        edit_queue.submit(query.message.chat_id, query.message.message_id, text, reply_markup)
+    else:
+        logger.warning(f"Нет сообщения для правки карточки #{task.id}")
 
 
 # ----------------- Клавиатуры / форматирование -----------------
+# кнопки карточки: порядок — коды действий в callback_data, новые только в конец
+TASK_ACTIONS = ("take", "done", "hold", "cancel")
+callback_codec = CallbackCodec(CALLBACK_SECRET.encode(), TASK_ACTIONS)
+
+
+def task_id_from_callback(data: str) -> Optional[int]:
+    decoded = callback_codec.decode(data)
+    return decoded[1] if decoded else None
+
+
 def kb_take(task_id: int) -> InlineKeyboardMarkup:
-    return InlineKeyboardMarkup([[InlineKeyboardButton("🔏 Беру таску", callback_data=f"take:{task_id}")]])
+    # кнопка только у новой карточки — её версия всегда первая
+    return InlineKeyboardMarkup([[InlineKeyboardButton("🔏 Беру таску", callback_data=callback_codec.encode("take", task_id, FIRST_CARD_VERSION))]])
 
 
-def kb_after_take(task_id: int) -> InlineKeyboardMarkup:
+def kb_after_take(task: TaskRecord) -> InlineKeyboardMarkup:
     return InlineKeyboardMarkup(
         [
             [
-                InlineKeyboardButton("🟢 Done", callback_data=f"done:{task_id}"),
-                InlineKeyboardButton("🟡 On Hold", callback_data=f"hold:{task_id}"),
-                InlineKeyboardButton("🔴 Cancel Task", callback_data=f"cancel:{task_id}"),
+                InlineKeyboardButton("🟢 Done", callback_data=callback_codec.encode("done", task.id, task.card_version)),
+                InlineKeyboardButton("🟡 On Hold", callback_data=callback_codec.encode("hold", task.id, task.card_version)),
+                InlineKeyboardButton("🔴 Cancel Task", callback_data=callback_codec.encode("cancel", task.id, task.card_version)),
             ]
         ]
     )
 
 
-def format_task_message(task_id: int, manager_username: str, content: str, status_line: Optional[str] = None) -> str:
+STATUS_READABLE = {
+    "new": "🟦 Новый",
+    "in_progress": "🟧 В работе",
+    "done": "🟢 Выполнено",
+    "on_hold": "🟡 On Hold",
+    "cancelled": "🔴 Отменено",
+}
+
+# фильтры /mytasks: код в callback_data -> статус в БД (None — все)
+MYTASKS_FILTERS = {
+    "all": None,
+    "new": "new",
+    "work": "in_progress",
+    "hold": "on_hold",
+    "done": "done",
+    "cncl": "cancelled",
+}
+MYTASKS_FILTER_LABELS = {"all": "Все", "new": "🟦", "work": "🟧", "hold": "🟡", "done": "🟢", "cncl": "🔴"}
+MYTASKS_PREVIEW_CHARS = 300
+BACKLOG_PAGE_SIZE = 10
+BACKLOG_PREVIEW_CHARS = 150
+# /connect !high текст — значения tasks.priority (см. TASK_PRIORITIES в task_store.py)
+PRIORITY_TAGS = {"high": 0, "urgent": 0, "срочно": 0, "normal": 1, "low": 2, "потом": 2}
+PRIORITY_LABELS = {0: "🔥 Высокий приоритет", 2: "🐢 Низкий приоритет"}
+PRIORITY_SUFFIX = {0: " 🔥", 2: " 🐢"}
+STATS_TOP_TECHS = 20
+FIND_PAGE_SIZE = 5
+FIND_INLINE_RESULTS = 20
+FIND_HEADER = "🔎 Поиск: "
+
+
+def kb_find(offset: int, has_more: bool) -> Optional[InlineKeyboardMarkup]:
+    # сам запрос не влезает в 64 байта callback_data — он берётся из первой строки сообщения
+    nav = []
+    if offset:
+        nav.append(InlineKeyboardButton("◀️ Prev", callback_data=f"find:{max(0, offset - FIND_PAGE_SIZE)}"))
+    if has_more:
+        nav.append(InlineKeyboardButton("Next ▶️", callback_data=f"find:{offset + FIND_PAGE_SIZE}"))
+    return InlineKeyboardMarkup([nav]) if nav else None
+
+
+def format_found_task(row: tuple) -> str:
+    tid, snippet, status, tech_username, manager_username = row
+    tech_part = f" — @{tech_username}" if tech_username else ""
+    return f"#{tid} {STATUS_READABLE.get(status, status)}{tech_part}\n{snippet}"
+
+
+def format_stats(status_counts: dict, techs: dict) -> str:
+    lines = ["📊 Статистика тасок"]
+    for status, label in STATUS_READABLE.items():
+        lines.append(f"{label}: {status_counts.get(status, 0)}")
+    lines.append(f"Всего: {sum(status_counts.values())}")
+    if techs:
+        # сначала самые загруженные сейчас, потом самые результативные
+        ranked = sorted(techs.items(), key=lambda kv: (-kv[1][1].get("in_progress", 0), -kv[1][1].get("done", 0)))
+        lines.append("")
+        lines.append("👥 По техникам (в работе / on hold / выполнено):")
+        for tech_id, (username, counts) in ranked[:STATS_TOP_TECHS]:
+            name = f"@{username}" if username else f"id {tech_id}"
+            lines.append(f"{name} — {counts.get('in_progress', 0)} / {counts.get('on_hold', 0)} / {counts.get('done', 0)}")
+        if len(ranked) > STATS_TOP_TECHS:
+            lines.append(f"…и ещё {len(ranked) - STATS_TOP_TECHS}")
+    return "\n".join(lines)
+
+
+def kb_mytasks(flt: str, first_id: Optional[int], last_id: Optional[int], has_newer: bool, has_older: bool) -> InlineKeyboardMarkup:
+    # callback_data: my:<o|n>:<курсор>:<фильтр>; o — старше курсора, n — новее
+    nav = []
+    if has_newer:
+        nav.append(InlineKeyboardButton("◀️ Prev", callback_data=f"my:n:{first_id}:{flt}"))
+    if has_older:
+        nav.append(InlineKeyboardButton("Next ▶️", callback_data=f"my:o:{last_id}:{flt}"))
+    filters_row = [
+        InlineKeyboardButton(("• " if code == flt else "") + label, callback_data=f"my:o:0:{code}")
+        for code, label in MYTASKS_FILTER_LABELS.items()
+    ]
+    return InlineKeyboardMarkup([nav, filters_row] if nav else [filters_row])
+
+
+def parse_tags(content: str) -> tuple:
+    """
+    Метки в начале текста, в любом порядке:
+    '!high #hw сервер упал' -> (0, 'hw', 'сервер упал').
+    Без меток — обычный приоритет и чат по правилам маршрутизации (None).
+    """
+    priority, category = DEFAULT_PRIORITY, None
+    while True:
+        parts = content.split(maxsplit=1)
+        tag = parts[0].lower() if parts else ""
+        tag_category = router.parse_category(tag)
+        if tag.startswith("!") and tag[1:] in PRIORITY_TAGS:
+            priority = PRIORITY_TAGS[tag[1:]]
+        elif tag_category is not None:
+            category = tag_category
+        else:
+            return priority, category, content
+        content = parts[1].strip() if len(parts) > 1 else ""
+
+
+def kb_backlog(first: Optional[tuple], last: Optional[tuple], has_prev: bool, has_next: bool) -> Optional[InlineKeyboardMarkup]:
+    # callback_data: bl:<a|b>:<priority>:<id>; a — после курсора, b — до
+    nav = []
+    if has_prev:
+        nav.append(InlineKeyboardButton("◀️ Prev", callback_data=f"bl:b:{first[0]}:{first[1]}"))
+    if has_next:
+        nav.append(InlineKeyboardButton("Next ▶️", callback_data=f"bl:a:{last[0]}:{last[1]}"))
+    return InlineKeyboardMarkup([nav]) if nav else None
+
+
+def format_task_message(task_id: int, manager_username: str, content: str, status_line: Optional[str] = None, priority: int = DEFAULT_PRIORITY) -> str:
     lines = []
     lines.append("🛠 Новая таска от " + (f"@{manager_username}" if manager_username else "менеджера"))
     lines.append(f"# {task_id}")
+    if priority in PRIORITY_LABELS:
+        lines.append(PRIORITY_LABELS[priority])
     lines.append(content)
     if status_line:
         lines.append("")  # blank line
@@ -197,6 +657,12 @@ def format_task_message(task_id: int, manager_username: str, content: str, statu
 
 
 # ----------------- Хэндлеры -----------------
+def instrumented(handler):
+    # гистограмма времени и счётчик исключений по имени хэндлера
+    return timed(HANDLER_SECONDS, handler.__name__, errors=HANDLER_ERRORS)(handler)
+
+
+@instrumented
 async def cmd_start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await update.message.reply_text(
         "Привет! Я — 🛠 TECH TASK бот.\n"
@@ -205,17 +671,54 @@ async def cmd_start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     )
 
 
+@instrumented
 async def cmd_help(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await update.message.reply_text(
-        "/connect <текст> — создать таску\n"
+        "/connect <текст> — создать таску (!high или !low в начале — приоритет, #категория — тех-чат)\n"
+        "   можно и подписью к фото, файлу или альбому — вложения уйдут в тех-чат вместе с таской\n"
         "/mytasks — посмотреть свои таски\n"
+        "/notify — как присылать обновления по таскам: сразу, сводкой раз в N минут или раз в день\n"
+        "/find <слова> — поиск по тексту тасок (в тех-чате — по всем)\n"
+        "/stats — сводка по таскам (в тех-чате)\n"
+        "/backlog — открытые таски по приоритету и возрасту (в тех-чате)\n"
+        "/duty — встать на смену / уйти со смены для автоназначения (в тех-чате)\n"
         "/start — приветствие\n"
         "/help — помощь"
     )
 
 
+@instrumented
 async def cmd_connect(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    raw = update.message.text or ""
+    await connect_task(update, context, update.message.text or "")
+
+
+@instrumented
+async def media_connect(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    # /connect подписью к фото, файлу или видео; у альбома подпись обычно только у одной части
+    message = update.message
+    attachment = message_attachment(message) if message else None
+    if attachment is None:
+        return
+    if message.media_group_id:
+        if router.is_tech_chat(message.chat_id):
+            return  # альбомы техников в тех-чате — не таски
+        part = (message.message_id, attachment, message.caption or "", update)
+        media_groups.add((message.chat_id, message.media_group_id), part, functools.partial(connect_album, context))
+        return
+    if CONNECT_CAPTION.match(message.caption or ""):
+        await connect_task(update, context, message.caption, (attachment,))
+
+
+async def connect_album(context: ContextTypes.DEFAULT_TYPE, parts: list) -> None:
+    # части альбома могут прийти не по порядку; таску создаёт та, что с /connect в подписи
+    parts.sort(key=lambda part: part[0])
+    captioned = next((part for part in parts if CONNECT_CAPTION.match(part[2])), None)
+    if captioned is None:
+        return
+    await connect_task(captioned[3], context, captioned[2], tuple(part[1] for part in parts))
+
+
+async def connect_task(update: Update, context: ContextTypes.DEFAULT_TYPE, raw: str, attachments: tuple = ()) -> None:
     parts = raw.split(" ", 1)
     if len(parts) > 1 and parts[1].strip():
         content = parts[1].strip()
@@ -223,6 +726,9 @@ async def cmd_connect(update: Update, context: ContextTypes.DEFAULT_TYPE):
         rest = raw.split("\n", 1)
         content = rest[1].strip() if len(rest) > 1 else ""
 
+    priority, category, content = parse_tags(content)
+    if not content and attachments:
+        content = NO_TEXT_CONTENT
     if not content:
         await update.message.reply_text("Пожалуйста, укажите текст таски после /connect.")
         return
@@ -231,180 +737,444 @@ async def cmd_connect(update: Update, context: ContextTypes.DEFAULT_TYPE):
     manager_id = manager.id
     manager_username = manager.username or manager.full_name or "manager"
 
-    # создаём таску
-    task_id = create_task(manager_id, manager_username, content)
+    # создаём таску (вложения — в той же транзакции)
+    task_id = await create_task(manager_id, manager_username, content, priority, attachments)
     logger.info(f"Создана таска #{task_id} от @{manager_username}")
 
-    # отправляем в тех-чат
-    text = format_task_message(task_id, manager_username, content)
+    # отправляем в тех-чат по правилам маршрутизации; у каждого чата свой лимит в rate limiter-е
+    chat_id = router.route(content, manager_id, manager_username, category)
+    text = format_task_message(task_id, manager_username, content, priority=priority)
+    markup = kb_take(task_id)
     try:
-        sent = await context.bot.send_message(chat_id=TECH_CHAT_ID, text=text, reply_markup=kb_take(task_id))
-    except Exception as e:
+        sent = await context.bot.send_message(chat_id=chat_id, text=text, reply_markup=markup, rate_limit_args={"priority": PRIORITY_TASK})
+    except Exception:
         logger.exception("Failed to send to tech chat")
         await update.message.reply_text("Ошибка: не удалось отправить таску в тех-чат. Проверьте что бот добавлен в чат и имеет права.")
         return
 
-    # сохраняем message_id
-    set_tech_message_id(task_id, sent.message_id)
+    # сохраняем карточку: (чат, message_id)
+    await set_tech_message_id(task_id, chat_id, sent.message_id)
+    edit_queue.remember(chat_id, sent.message_id, text, markup)
+    TASKS_ROUTED.labels(router.name(chat_id)).inc()
+    if attachments:
+        try:
+            await send_attachments(context.bot, chat_id, sent.message_id, attachments)
+        except Exception:
+            logger.exception(f"Не удалось отправить вложения таски #{task_id}")
+
+    if AUTO_ASSIGN and not await auto_assign(context.bot, task_id, manager_username, content, (chat_id, sent.message_id), priority):
+        heapq.heappush(unassigned, (priority, task_id))
 
     # подтверждение менеджеру
-    await update.message.reply_text(f"✅ Таска #{task_id} отправлена в технический отдел.")
+    attached = f" Вложений: {len(attachments)}." if attachments else ""
+    await update.message.reply_text(f"✅ Таска #{task_id} отправлена в технический отдел.{attached}")
 
 
-async def cmd_mytasks(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    manager = update.effective_user
-    rows = list_manager_tasks(manager.id)
+async def render_mytasks(manager_id: int, flt: str = "all", before_id: Optional[int] = None, after_id: Optional[int] = None) -> tuple:
+    rows, has_older, has_newer = await list_manager_tasks(manager_id, status=MYTASKS_FILTERS[flt], before_id=before_id, after_id=after_id)
     if not rows:
-        await update.message.reply_text("У вас пока нет задач.")
-        return
+        if flt == "all" and before_id is None and after_id is None:
+            return "У вас пока нет задач.", None
+        return "Нет задач с таким статусом.", kb_mytasks(flt, None, None, False, False)
     text_lines = []
     for r in rows:
         tid, content, status, tech_username, created_at = r
-        status_readable = {
-            "new": "🟦 Новый",
-            "in_progress": "🟧 В работе",
-            "done": "🟢 Выполнено",
-            "on_hold": "🟡 On Hold",
-            "cancelled": "🔴 Отменено",
-        }.get(status, status)
+        status_readable = STATUS_READABLE.get(status, status)
         tech_part = f" — @{tech_username}" if tech_username else ""
+        if len(content) > MYTASKS_PREVIEW_CHARS:
+            content = content[:MYTASKS_PREVIEW_CHARS] + "…"
         text_lines.append(f"#{tid} {status_readable}{tech_part}\n{content}")
-    await update.message.reply_text("\n\n".join(text_lines))
+    return "\n\n".join(text_lines), kb_mytasks(flt, rows[0][0], rows[-1][0], has_newer, has_older)
 
 
-async def callback_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
+@instrumented
+async def cmd_mytasks(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    manager = update.effective_user
+    text, markup = await render_mytasks(manager.id)
+    await update.message.reply_text(text, reply_markup=markup)
+
+
+async def render_backlog(after: Optional[tuple] = None, before: Optional[tuple] = None) -> tuple:
+    rows, has_prev, has_next = await get_backlog(after=after, before=before)
+    if not rows:
+        return "📋 Открытых тасок нет.", None
+    now = datetime.now(timezone.utc).timestamp()
+    lines = ["📋 Открытые таски: срочные первыми, внутри — по возрасту"]
+    for tid, content, status, tech_username, priority, created_at in rows:
+        tech_part = f" — @{tech_username}" if tech_username else ""
+        if len(content) > BACKLOG_PREVIEW_CHARS:
+            content = content[:BACKLOG_PREVIEW_CHARS] + "…"
+        age = format_age(now - utc_ts(created_at)) if created_at else "?"
+        lines.append(f"#{tid}{PRIORITY_SUFFIX.get(priority, '')} {STATUS_READABLE.get(status, status)}{tech_part} · {age}\n{content}")
+    first, last = (rows[0][4], rows[0][0]), (rows[-1][4], rows[-1][0])
+    return "\n\n".join(lines), kb_backlog(first, last, has_prev, has_next)
+
+
+@instrumented
+async def cmd_backlog(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if update.effective_chat is None or not router.is_tech_chat(update.effective_chat.id):
+        await update.message.reply_text("Команда /backlog доступна только в тех-чате.")
+        return
+    text, markup = await render_backlog()
+    await update.message.reply_text(text, reply_markup=markup)
+
+
+async def render_find(text: str, chat_id: int, user_id: int, offset: int = 0) -> tuple:
+    # в тех-чате ищем по всем таскам, в личке — по своим (созданным или взятым)
+    scope = None if router.is_tech_chat(chat_id) else user_id
+    rows, has_more = await search_tasks(text, scope, offset, FIND_PAGE_SIZE)
+    header = FIND_HEADER + text
+    if not rows:
+        return header + "\n\nНичего не нашлось.", kb_find(offset, False)
+    body = "\n\n".join(format_found_task(r) for r in rows)
+    return f"{header}\n\n{body}", kb_find(offset, has_more)
+
+
+@instrumented
+async def cmd_find(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    text = " ".join(context.args or [])[:200]
+    if not fts_query(text):
+        await update.message.reply_text("Укажите, что искать: /find <слова из текста таски>")
+        return
+    reply, markup = await render_find(text, update.effective_chat.id, update.effective_user.id)
+    await update.message.reply_text(reply, reply_markup=markup)
+
+
+@instrumented
+async def inline_find(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    iq = update.inline_query
+    text = iq.query.strip()[:200]
+    if not fts_query(text):
+        await iq.answer([], cache_time=0, is_personal=True)
+        return
+    try:
+        offset = int(iq.offset or 0)
+    except ValueError:
+        offset = 0
+    rows, has_more = await search_tasks(text, iq.from_user.id, offset, FIND_INLINE_RESULTS)
+    results = [
+        InlineQueryResultArticle(
+            id=str(row[0]),
+            title=f"#{row[0]} {STATUS_READABLE.get(row[2], row[2])}",
+            description=row[1],
+            input_message_content=InputTextMessageContent(format_found_task(row)),
+        )
+        for row in rows
+    ]
+    await iq.answer(results, cache_time=5, is_personal=True, next_offset=str(offset + FIND_INLINE_RESULTS) if has_more else "")
+
+
+@instrumented
+async def cmd_stats(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if update.effective_chat is None or not router.is_tech_chat(update.effective_chat.id):
+        await update.message.reply_text("Команда /stats доступна только в тех-чате.")
+        return
+    # счётчики ведут триггеры в БД, здесь только чтение пары маленьких таблиц
+    status_counts, techs = await get_stats()
+    await update.message.reply_text(format_stats(status_counts, techs))
+
+
+@instrumented
+async def cmd_duty(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if update.effective_chat is None or not router.is_tech_chat(update.effective_chat.id):
+        await update.message.reply_text("Команда /duty доступна только в тех-чате.")
+        return
+    user = update.effective_user
+    username = user.username or user.full_name or "tech"
+    # /duty on|off; без аргумента — переключить
+    arg = context.args[0].lower() if context.args else ""
+    available = {"on": True, "off": False}.get(arg, not tech_pool.is_available(user.id))
+    await db.set_tech_available(user.id, username, available)
+    tech_pool.set_available(user.id, username, available)
+    if available:
+        text = f"🟢 @{username} на смене: новые таски назначаются автоматически (в работе {tech_pool.load(user.id)})."
+    else:
+        text = f"⚪️ @{username} не на смене, новые таски не назначаются."
+    if not AUTO_ASSIGN:
+        text += "\nАвтоназначение сейчас выключено (AUTO_ASSIGN)."
+    await update.message.reply_text(text)
+    if AUTO_ASSIGN and available:
+        await assign_waiting(context.bot)
+
+
+@instrumented
+async def cmd_notify(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    user = update.effective_user
+    args = [arg.lower() for arg in context.args or ()]
+    usage = (
+        "/notify immediate — сообщение на каждое изменение\n"
+        f"/notify batch [минут] — сводка раз в N минут (по умолчанию {NOTIFY_BATCH_MIN:g})\n"
+        "/notify daily — одна сводка в день"
+    )
+    if not args:
+        await update.message.reply_text(f"Обновления по таскам сейчас приходят {describe_notify_mode(*digests.mode(user.id))}.\n\n{usage}")
+        return
+    # /notify 30 — то же, что /notify batch 30
+    mode, every = args[0], None
+    raw_every = mode if mode.isdigit() else (args[1] if mode == BATCH and len(args) > 1 else None)
+    if raw_every is not None:
+        mode = BATCH
+        every = float(raw_every) if raw_every.isdigit() else 0
+    if mode not in MODES or (every is not None and not 1 <= every <= 24 * 60):
+        await update.message.reply_text(usage)
+        return
+    await db.set_notify_mode(user.id, mode, every)
+    digests.set_mode(user.id, mode, every)
+    await update.message.reply_text(f"✅ Обновления по таскам будут приходить {describe_notify_mode(*digests.mode(user.id))}.")
+
+
+# ----------------- Кнопки -----------------
+# на callback отвечаем ровно один раз: второй answer Telegram молча выбрасывает.
+# Поэтому сначала переход в БД, потом ответ с итоговым тостом, а правки
+# карточки и уведомления — уже в фоне, после ответа
+async def on_find_page(update: Update, context: ContextTypes.DEFAULT_TYPE, payload: str) -> None:
+    # /find: листаем результаты, запрос — из первой строки сообщения
     query = update.callback_query
-    if not query:
+    message_text = query.message.text if query.message else ""
+    first_line = (message_text or "").split("\n", 1)[0]
+    try:
+        offset = int(payload)
+        if not first_line.startswith(FIND_HEADER):
+            raise ValueError(first_line)
+    except ValueError:
+        await query.answer("Неверные данные.")
         return
     await query.answer()
-    data = query.data or ""
+    text, markup = await render_find(first_line[len(FIND_HEADER):], query.message.chat_id, query.from_user.id, offset)
+    try:
+        await query.edit_message_text(text=text, reply_markup=markup)
+    except BadRequest as e:
+        if "not modified" not in str(e):
+            logger.exception("Failed to edit /find page")
+
+
+async def on_backlog_page(update: Update, context: ContextTypes.DEFAULT_TYPE, payload: str) -> None:
+    # /backlog: курсор (priority, id) соседней страницы
+    query = update.callback_query
+    try:
+        direction, raw_priority, raw_id = payload.split(":", 2)
+        cursor = (int(raw_priority), int(raw_id))
+        if direction not in ("a", "b"):
+            raise ValueError(payload)
+    except ValueError:
+        await query.answer("Неверные данные.")
+        return
+    await query.answer()
+    if direction == "a":
+        text, markup = await render_backlog(after=cursor)
+    else:
+        text, markup = await render_backlog(before=cursor)
+    try:
+        await query.edit_message_text(text=text, reply_markup=markup)
+    except BadRequest as e:
+        if "not modified" not in str(e):
+            logger.exception("Failed to edit /backlog page")
+
+
+async def on_mytasks_page(update: Update, context: ContextTypes.DEFAULT_TYPE, payload: str) -> None:
+    # /mytasks: листаем страницы в том же сообщении
+    query = update.callback_query
+    try:
+        direction, raw, flt = payload.split(":", 2)
+        cursor = int(raw) or None
+        if flt not in MYTASKS_FILTERS or direction not in ("o", "n"):
+            raise ValueError(payload)
+    except ValueError:
+        await query.answer("Неверные данные.")
+        return
+    await query.answer()
+    if direction == "n":
+        text, markup = await render_mytasks(query.from_user.id, flt, after_id=cursor)
+    else:
+        text, markup = await render_mytasks(query.from_user.id, flt, before_id=cursor)
+    try:
+        await query.edit_message_text(text=text, reply_markup=markup)
+    except BadRequest as e:
+        # та же страница ещё раз — Telegram отвечает "message is not modified"
+        if "not modified" not in str(e):
+            logger.exception("Failed to edit /mytasks page")
+
+
+async def on_take(update: Update, context: ContextTypes.DEFAULT_TYPE, action: str, task_id: int) -> None:
+    query = update.callback_query
     user = query.from_user
     username = user.username or user.full_name or "tech"
 
-    # TAKE
-    if data.startswith("take:"):
-        try:
-            task_id = int(data.split(":", 1)[1])
-        except Exception:
-            await query.answer("Неверный ID.")
-            return
+    # атомарный апдейт бд: из двух одновременных нажатий выиграет одно
+    task = await take_task_db(task_id, user.id, username)
+    if not task:
+        await query.answer("Эту таску уже взяли или она закрыта.", show_alert=True)
+        return
+    await query.answer("Таску взяли в работу ✅")
 
-        task = get_task(task_id)
-        if not task:
-            await query.answer("Таска не найдена.", show_alert=True)
-            return
+    # правка карточки уходит через edit_queue, хэндлер её не ждёт
+    status_line = f"👤 Взято в работу @{username}"
+    new_text = format_task_message(task_id, task.manager_username, task.content, status_line=status_line, priority=task.priority)
+    edit_task_card(query, task, new_text, kb_after_take(task))
 
-        if task["status"] != "new":
-            await query.answer("Эту таску уже взяли или она закрыта.", show_alert=True)
-            return
 
-        # апдейт бд
-        take_task_db(task_id, user.id, username)
+# действие кнопки -> (статус в БД, строка статуса на карточке)
+STATUS_ACTIONS = {
+    "done": ("done", "🟢 Done by @{}"),
+    "hold": ("on_hold", "🟡 On Hold by @{}"),
+    "cancel": ("cancelled", "🔴 Cancel Task by @{}"),
+}
 
-        # редактируем сообщение в тех-чате
-        status_line = f"👤 Взято в работу @{username}"
-        new_text = format_task_message(task_id, task["manager_username"], task["content"], status_line=status_line)
-        try:
-            # пытаемся редактировать по сохранённому message_id в чате техников
-            await context.bot.edit_message_text(chat_id=TECH_CHAT_ID, message_id=task["tech_chat_message_id"], text=new_text, reply_markup=kb_after_take(task_id))
-        except Exception:
-            # fallback: редактируем само сообщение, откуда пришёл callback
-            try:
-                await query.edit_message_text(text=new_text, reply_markup=kb_after_take(task_id))
-            except Exception:
-                logger.exception("Failed to edit message on take")
-        await query.answer("Таску взяли в работу ✅")
+
+async def on_set_status(update: Update, context: ContextTypes.DEFAULT_TYPE, action: str, task_id: int) -> None:
+    query = update.callback_query
+    user = query.from_user
+    username = user.username or user.full_name or "tech"
+    db_status, status_line = STATUS_ACTIONS[action]
+    status_text = status_line.format(username)
+
+    # один вызов в БД: UPDATE ... RETURNING отдаёт и проверку, и строку для карточки
+    task = await update_status_db(task_id, db_status, tech_id=user.id, tech_username=username)
+    if not task:
+        await query.answer("Таска не найдена.", show_alert=True)
         return
+    await query.answer("Статус обновлён.")
 
-    # DONE / HOLD / CANCEL
-    if any(data.startswith(pref) for pref in ("done:", "hold:", "cancel:")):
-        try:
-            action, raw = data.split(":", 1)
-            task_id = int(raw)
-        except Exception:
-            await query.answer("Неверные данные.")
-            return
-
-        task = get_task(task_id)
-        if not task:
-            await query.answer("Таска не найдена.", show_alert=True)
-            return
-
-        if action == "done":
-            status_text = f"🟢 Done by @{username}"
-            db_status = "done"
-        elif action == "hold":
-            status_text = f"🟡 On Hold by @{username}"
-            db_status = "on_hold"
+    # редактируем сообщение в тех-чате — убираем кнопки, добавляем статус
+    new_text = format_task_message(task_id, task.manager_username, task.content, status_line=status_text, priority=task.priority)
+    edit_task_card(query, task, new_text)
+
+    # уведомление менеджеру и раздача ждущих тасок — в фоне; PTB дождётся их на остановке.
+    # Кто выбрал сводки (/notify), получит событие в ней, а не отдельным сообщением
+    if task.manager_id:
+        if digests.queues(task.manager_id):
+            await queue_notification(task, status_text)
         else:
-            status_text = f"🔴 Cancel Task by @{username}"
-            db_status = "cancelled"
+            context.application.create_task(notify_manager(context.bot, task, status_text), update=update, name=f"notify:{task_id}")
+    if AUTO_ASSIGN:
+        # у техника освободилось место — раздаём ждущие таски
+        context.application.create_task(assign_waiting(context.bot), update=update, name="assign_waiting")
 
-        # обновляем бд
-        update_status_db(task_id, db_status, tech_id=user.id, tech_username=username)
 
-        # редактируем сообщение в тех-чате — убираем кнопки, добавляем статус
-        new_text = format_task_message(task_id, task["manager_username"], task["content"], status_line=status_text)
-        try:
-            await context.bot.edit_message_text(chat_id=TECH_CHAT_ID, message_id=task["tech_chat_message_id"], text=new_text)
-        except Exception:
-            try:
-                await query.edit_message_text(text=new_text)
-            except Exception:
-                logger.exception("Failed to edit message on final status")
+# страницы списков: "<префикс>:<курсор>" открытым текстом, подпись им не нужна
+PAGE_CALLBACKS = {"find": on_find_page, "bl": on_backlog_page, "my": on_mytasks_page}
+# кнопки карточки: действие из подписанной callback_data (callback_codec.py)
+TASK_CALLBACKS = {"take": on_take, "done": on_set_status, "hold": on_set_status, "cancel": on_set_status}
+CALLBACKS_REJECTED = REGISTRY.counter("tech_task_callbacks_rejected_total", "Нажатия, отброшенные без похода в БД", ("reason",))
 
-        # уведомляем менеджера
-        try:
-            if task["manager_id"]:
-                await context.bot.send_message(chat_id=task["manager_id"], text=f"🔔 Таска #{task_id} обновлена: {status_text}")
-        except Exception:
-            logger.exception("Failed to notify manager")
 
-        await query.answer("Статус обновлён.")
+@instrumented
+async def callback_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    query = update.callback_query
+    if not query:
         return
+    data = query.data or ""
 
-    # default
-    await query.answer("Неизвестное действие.", show_alert=True)
+    prefix, sep, payload = data.partition(":")
+    page = PAGE_CALLBACKS.get(prefix) if sep else None
+    if page is not None:
+        await page(update, context, payload)
+        return
 
+    # подпись и версия карточки проверяются в памяти: подделки и нажатия
+    # на устаревшие кнопки до БД не доходят
+    decoded = callback_codec.decode(data)
+    if decoded is None:
+        CALLBACKS_REJECTED.labels("invalid").inc()
+        await query.answer("Неизвестное действие.", show_alert=True)
+        return
+    action, task_id, version = decoded
+    if card_versions.get(task_id) != version:
+        CALLBACKS_REJECTED.labels("stale").inc()
+        await query.answer("Карточка устарела: таску уже взяли или закрыли.", show_alert=True)
+        return
+    await TASK_CALLBACKS[action](update, context, action, task_id)
 
+
+@instrumented
 async def unknown_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await update.message.reply_text("Неизвестная команда. Используйте /help.")
 
 
 # ----------------- Запуск -----------------
-def main() -> None:
-    init_db()
-    if not BOT_TOKEN:
-        logger.error("BOT_TOKEN is not set. Set environment variable BOT_TOKEN or hardcode it (not recommended).")
-        return
-
-    app = ApplicationBuilder().token(BOT_TOKEN).build()
+def register_gauges(app, rate_limiter: TechTaskRateLimiter, processor: OrderedUpdateProcessor) -> None:
+    # значения снимаются в момент скрейпа, на горячий путь не влияют
+    REGISTRY.gauge("tech_task_update_queue_depth", "Апдейты в очереди Application", fn=app.update_queue.qsize)
+    REGISTRY.gauge("tech_task_updates_in_flight", "Апдейты в обработке", fn=lambda: processor.in_flight)
+    REGISTRY.gauge("tech_task_updates_queued", "Апдейты, ждущие предшественников или слота", fn=lambda: processor.queued)
+    REGISTRY.gauge("tech_task_edit_queue_depth", "Правки карточек, ждущие отправки", fn=edit_queue.depth)
+    REGISTRY.gauge("tech_task_media_groups_pending", "Альбомы, ждущие остальных частей", fn=lambda: len(media_groups))
+    REGISTRY.counter("tech_task_edits_saved_total", "Правки, которые не пришлось отправлять", fn=lambda: edit_queue.saved)
+    REGISTRY.gauge("tech_task_db_pending_writes", "Записи, ждущие commit-а пачки", fn=db.pending_writes)
+    REGISTRY.gauge("tech_task_sla_timers", "Таски с активным SLA-таймером", fn=lambda: len(sla_timers))
+    REGISTRY.gauge("tech_task_sla_heap_stale", "Устаревшие записи в куче SLA-таймеров", fn=lambda: sla_timers.stale)
+    REGISTRY.counter("tech_task_sla_reminders_total", "Отправленные SLA-напоминания", fn=lambda: sla_timers.fired)
+    REGISTRY.gauge("tech_task_techs_on_duty", "Техники на смене для автоназначения", fn=lambda: tech_pool.on_duty)
+    REGISTRY.counter("tech_task_auto_assigned_total", "Таски, назначенные автоматически", fn=lambda: tech_pool.assigned)
+    REGISTRY.gauge("tech_task_digests_scheduled", "Менеджеры, у которых ждёт сводка", fn=lambda: len(digests))
+    REGISTRY.counter("tech_task_cache_hits_total", "Попадания в кэш тасок", fn=lambda: task_cache.hits)
+    REGISTRY.counter("tech_task_cache_misses_total", "Промахи кэша тасок", fn=lambda: task_cache.misses)
+    REGISTRY.counter("tech_task_cache_evictions_total", "Вытеснения из кэша тасок", fn=lambda: task_cache.evictions)
+    REGISTRY.gauge("tech_task_cache_entries", "Таски в кэше", fn=lambda: len(task_cache))
+    REGISTRY.gauge("tech_task_cache_bytes", "Примерный объём кэша тасок", fn=lambda: task_cache.bytes)
+    REGISTRY.gauge("tech_task_ratelimit_waiting", "Запросы, ждущие токена в rate limiter-е", fn=rate_limiter.queue_depth)
+    REGISTRY.counter("tech_task_ratelimit_retries_total", "Повторы после 429", fn=lambda: rate_limiter.retries)
+
+
+def build_application():
+    rate_limiter = TechTaskRateLimiter(
+        global_per_sec=RATE_GLOBAL_PER_SEC,
+        group_per_min=RATE_GROUP_PER_MIN,
+        private_per_sec=RATE_PRIVATE_PER_SEC,
+        max_retries=RATE_MAX_RETRIES,
+        chat_overrides=router.budgets,
+    )
+    processor = OrderedUpdateProcessor(MAX_CONCURRENT_UPDATES, task_id_of=task_id_from_callback)
+    builder = (
+        ApplicationBuilder()
+        .token(BOT_TOKEN)
+        .rate_limiter(rate_limiter)
+        .concurrent_updates(processor)
+        .post_init(on_startup)
+        .post_stop(on_stop)
+        .post_shutdown(close_db)
+    )
+    if BOT_API_URL:
+        builder = builder.base_url(BOT_API_URL)
+    if WEBHOOK_URL:
+        # апдейты приходят в наш aiohttp-сервер, getUpdates-Updater не нужен
+        builder = builder.updater(None)
+    app = builder.build()
+    register_gauges(app, rate_limiter, processor)
 
     # handlers
     app.add_handler(CommandHandler("start", cmd_start))
     app.add_handler(CommandHandler("help", cmd_help))
     app.add_handler(CommandHandler("connect", cmd_connect))  # менеджеры создают таски этой командой
     app.add_handler(CommandHandler("mytasks", cmd_mytasks))
+    app.add_handler(CommandHandler("notify", cmd_notify))
+    app.add_handler(CommandHandler("stats", cmd_stats))
+    app.add_handler(CommandHandler("duty", cmd_duty))
+    app.add_handler(CommandHandler("backlog", cmd_backlog))
+    app.add_handler(CommandHandler("find", cmd_find))
+    app.add_handler(InlineQueryHandler(inline_find))  # нужен включённый inline-режим в @BotFather
     app.add_handler(CallbackQueryHandler(callback_handler))
+    app.add_handler(MessageHandler(filters.PHOTO | filters.Document.ALL | filters.VIDEO, media_connect))
     app.add_handler(MessageHandler(filters.COMMAND, unknown_command))
+    return app
 
-    logger.info("Бот запущен и готов принимать задачи.")
-    app.run_polling()
 
+def main() -> None:
+    init_db()
+    if not BOT_TOKEN:
+        logger.error("BOT_TOKEN is not set. Set environment variable BOT_TOKEN or hardcode it (not recommended).")
+        return
 
-if __name__ == "__main__":
-    main()
-from flask import Flask
-import os
+    app = build_application()
+
+    logger.info("Бот запущен и готов принимать задачи.")
+    if WEBHOOK_URL:
+        import webhook
 
-app = Flask(__name__)
+        asyncio.run(webhook.serve(app, WEBHOOK_URL, WEBHOOK_PATH, WEBHOOK_SECRET, host=WEBHOOK_HOST, port=WEBHOOK_PORT))
+    else:
+        app.run_polling()
 
-@app.route('/')
-def home():
-    return "Bot is running!"
 
 if __name__ == "__main__":
-    port = int(os.environ.get("PORT", 5000))
-    app.run(host="0.0.0.0", port=port)
-
-    
+    main()
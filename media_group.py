@@ -0,0 +1,81 @@
+# -*- coding: utf-8 -*-
+
+"""
+Сборка альбомов (media group) из отдельных апдейтов.
+
+Альбом Telegram присылает пачкой сообщений с общим media_group_id, каждое
+своим апдейтом, и признака «последняя часть» нет. Буфер копит части по
+ключу (chat_id, media_group_id) и отдаёт альбом целиком, когда после
+последней пришедшей части прошло window секунд без новых.
+
+В буфере только то, что вызывающий сам положил (file_id, подпись, ...):
+сами файлы бот не скачивает.
+
+    buffer = MediaGroupBuffer(window=1.0)
+    buffer.add((chat_id, media_group_id), part, on_complete)  # on_complete(parts) — корутина
+
+Работает только из event loop, блокировок нет.
+"""
+
+import asyncio
+import logging
+from typing import Awaitable, Callable, Dict, Hashable, Optional
+
+logger = logging.getLogger(__name__)
+
+# в альбоме Telegram не больше 10 элементов; сверх этого части не копим
+MAX_PARTS = 10
+# незавершённых альбомов одновременно — больше не держим, новые сразу отбрасываем
+DEFAULT_MAX_GROUPS = 1000
+
+
+class MediaGroupBuffer:
+    def __init__(self, window: float = 1.0, max_groups: int = DEFAULT_MAX_GROUPS):
+        self.window = window
+        self.max_groups = max_groups
+        # ключ -> [части, on_complete, таймер]
+        self._groups: Dict[Hashable, list] = {}
+        self._tasks = set()
+        self.completed = 0
+        self.dropped = 0
+
+    def __len__(self) -> int:
+        return len(self._groups)
+
+    def add(self, key: Hashable, part, on_complete: Callable[[list], Awaitable[None]]) -> None:
+        """Кладёт часть альбома; on_complete берётся от первой части."""
+        group = self._groups.get(key)
+        if group is None:
+            if len(self._groups) >= self.max_groups:
+                self.dropped += 1
+                logger.warning(f"Слишком много незавершённых альбомов, часть {key} отброшена")
+                return
+            group = self._groups[key] = [[], on_complete, None]
+        elif group[2] is not None:
+            group[2].cancel()
+        if len(group[0]) < MAX_PARTS:
+            group[0].append(part)
+        # окно считается от последней части: альбом дошёл, когда части перестали приходить
+        group[2] = asyncio.get_running_loop().call_later(self.window, self._complete, key)
+
+    def _complete(self, key: Hashable) -> None:
+        parts, on_complete, _ = self._groups.pop(key)
+        self.completed += 1
+        task = asyncio.create_task(self._run(on_complete, parts, key))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _run(self, on_complete, parts: list, key: Hashable) -> None:
+        try:
+            await on_complete(parts)
+        except Exception:
+            logger.exception(f"Не удалось обработать альбом {key}")
+
+    async def stop(self, timeout: Optional[float] = 10) -> None:
+        """Отдаёт недособранные альбомы как есть и дожидается обработчиков."""
+        for key, group in list(self._groups.items()):
+            if group[2] is not None:
+                group[2].cancel()
+            self._complete(key)
+        if self._tasks:
+            await asyncio.wait(list(self._tasks), timeout=timeout)
@@ -0,0 +1,276 @@
+# -*- coding: utf-8 -*-
+
+"""
+Метрики бота в текстовом формате Prometheus.
+
+Без сторонних зависимостей: счётчики, gauge-и и гистограммы с фиксированными
+бакетами живут в одном реестре REGISTRY. Всё обновляется только из event loop
+(хэндлеры, rate limiter, обёртки над БД), поэтому блокировок нет — на горячем
+пути это поиск в словаре, bisect и пара сложений.
+
+    HANDLER_SECONDS.labels("cmd_connect").observe(0.012)
+
+    @timed(HANDLER_SECONDS, "cmd_connect")
+    async def cmd_connect(...): ...
+
+Отдаются через serve() на отдельном порту (METRICS_PORT) и на /metrics
+webhook-сервера. aiohttp импортируется только там, где собирается
+веб-приложение: БД, rate limiter и bench работают и без него.
+"""
+
+import functools
+import logging
+import time
+from bisect import bisect_left
+from typing import TYPE_CHECKING, Callable, Dict, Iterable, List, Optional, Tuple
+
+if TYPE_CHECKING:
+    from aiohttp import web
+
+logger = logging.getLogger(__name__)
+
+# от 1 мс до 10 с: хэндлеры, запросы в БД и вызовы Bot API укладываются сюда
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Tuple[str, ...], values: Tuple[str, ...], extra: str = "") -> str:
+    pairs = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) and not value.is_integer() else str(int(value))
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Iterable[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._children: Dict[tuple, object] = {}
+
+    def labels(self, *values):
+        """Дочерняя метрика для набора значений меток (кэшируется)."""
+        child = self._children.get(values)
+        if child is None:
+            if len(values) != len(self.labelnames):
+                raise ValueError(f"{self.name}: ожидались метки {self.labelnames}, пришло {values}")
+            child = self._children[values] = self._new_child()
+        return child
+
+    def _new_child(self):
+        raise NotImplementedError
+
+    def samples(self) -> List[str]:
+        raise NotImplementedError
+
+    def render(self) -> List[str]:
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"] + self.samples()
+
+
+class _Value:
+    __slots__ = ("value",)
+
+    def __init__(self):
+        self.value = 0.0
+
+    def inc(self, amount: float = 1) -> None:
+        self.value += amount
+
+    def dec(self, amount: float = 1) -> None:
+        self.value -= amount
+
+    def set(self, value: float) -> None:
+        self.value = value
+
+
+class _ValueMetric(_Metric):
+    def __init__(self, name: str, documentation: str, labelnames: Iterable[str] = (), fn: Optional[Callable[[], float]] = None):
+        super().__init__(name, documentation, labelnames)
+        # fn — значение снимается в момент скрейпа (глубины очередей и т.п.)
+        self._fn = fn
+
+    def _new_child(self):
+        return _Value()
+
+    def set_function(self, fn: Callable[[], float]) -> None:
+        self._fn = fn
+
+    # метрика без меток ведёт себя как собственный ребёнок
+    def inc(self, amount: float = 1) -> None:
+        self.labels().inc(amount)
+
+    def samples(self) -> List[str]:
+        if self._fn is not None:
+            try:
+                return [f"{self.name} {_format_value(self._fn())}"]
+            except Exception:
+                logger.exception(f"Не удалось снять метрику {self.name}")
+                return []
+        return [
+            f"{self.name}{_format_labels(self.labelnames, values)} {_format_value(child.value)}"
+            for values, child in self._children.items()
+        ]
+
+
+class Counter(_ValueMetric):
+    kind = "counter"
+
+
+class Gauge(_ValueMetric):
+    kind = "gauge"
+
+    def set(self, value: float) -> None:
+        self.labels().set(value)
+
+
+class _HistogramValue:
+    __slots__ = ("bounds", "counts", "sum", "count")
+
+    def __init__(self, bounds: tuple):
+        self.bounds = bounds
+        self.counts = [0] * len(bounds)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        # считаем «свой» бакет, кумулятивные суммы — только при рендере
+        i = bisect_left(self.bounds, value)
+        if i < len(self.counts):
+            self.counts[i] += 1
+        self.sum += value
+        self.count += 1
+
+
+_INF_LE = 'le="+Inf"'
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Iterable[str] = (), buckets: tuple = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def _new_child(self):
+        return _HistogramValue(self.buckets)
+
+    def observe(self, value: float) -> None:
+        self.labels().observe(value)
+
+    def samples(self) -> List[str]:
+        lines = []
+        for values, child in self._children.items():
+            cumulative = 0
+            for bound, count in zip(child.bounds, child.counts):
+                cumulative += count
+                le = f'le="{_format_value(bound)}"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, values, le)} {cumulative}")
+            lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, values, _INF_LE)} {child.count}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labelnames, values)} {repr(child.sum)}")
+            lines.append(f"{self.name}_count{_format_labels(self.labelnames, values)} {child.count}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+
+    def _register(self, metric: _Metric) -> _Metric:
+        existing = self._metrics.get(metric.name)
+        if existing is not None:
+            # повторная регистрация (второй build_application, бенчмарки) не должна падать
+            return existing
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, documentation: str, labelnames: Iterable[str] = (), fn: Optional[Callable[[], float]] = None) -> Counter:
+        metric = self._register(Counter(name, documentation, labelnames, fn))
+        if fn is not None:
+            metric.set_function(fn)
+        return metric
+
+    def gauge(self, name: str, documentation: str, labelnames: Iterable[str] = (), fn: Optional[Callable[[], float]] = None) -> Gauge:
+        metric = self._register(Gauge(name, documentation, labelnames, fn))
+        if fn is not None:
+            metric.set_function(fn)
+        return metric
+
+    def histogram(self, name: str, documentation: str, labelnames: Iterable[str] = (), buckets: tuple = DEFAULT_BUCKETS) -> Histogram:
+        return self._register(Histogram(name, documentation, labelnames, buckets))
+
+    def get(self, name: str) -> Optional[_Metric]:
+        return self._metrics.get(name)
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics.values():
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+# ----------------- Общие метрики -----------------
+HANDLER_SECONDS = REGISTRY.histogram("tech_task_handler_seconds", "Время работы хэндлера", ("handler",))
+HANDLER_ERRORS = REGISTRY.counter("tech_task_handler_errors_total", "Исключения, вылетевшие из хэндлера", ("handler",))
+DB_SECONDS = REGISTRY.histogram("tech_task_db_seconds", "Время операции хранилища, включая ожидание потока", ("op",))
+BOT_API_SECONDS = REGISTRY.histogram("tech_task_bot_api_seconds", "Время вызова Bot API без ожидания в лимитере", ("method",))
+BOT_API_REQUESTS = REGISTRY.counter("tech_task_bot_api_requests_total", "Вызовы Bot API по результату", ("method", "result"))
+RATELIMIT_WAIT_SECONDS = REGISTRY.histogram("tech_task_ratelimit_wait_seconds", "Ожидание токена в rate limiter-е", ("method",))
+
+
+def timed(histogram: Histogram, *labels: str, errors: Optional[Counter] = None):
+    """Декоратор для корутин: пишет длительность в histogram, исключения — в errors."""
+
+    def decorator(fn):
+        child = histogram.labels(*labels)
+        error_child = errors.labels(*labels) if errors is not None else None
+
+        @functools.wraps(fn)
+        async def wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return await fn(*args, **kwargs)
+            except Exception:
+                if error_child is not None:
+                    error_child.inc()
+                raise
+            finally:
+                child.observe(time.perf_counter() - started)
+
+        return wrapper
+
+    return decorator
+
+
+def build_web_app(registry: Registry = REGISTRY) -> "web.Application":
+    from aiohttp import web
+
+    async def handle(request: web.Request) -> web.Response:
+        return web.Response(text=registry.render(), content_type="text/plain", charset="utf-8")
+
+    web_app = web.Application()
+    web_app.router.add_get("/metrics", handle)
+    return web_app
+
+
+async def serve(host: str, port: int, registry: Registry = REGISTRY) -> "web.AppRunner":
+    """Поднимает /metrics на отдельном порту в текущем event loop; остановка — runner.cleanup()."""
+    from aiohttp import web
+
+    runner = web.AppRunner(build_web_app(registry), access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    logger.info(f"Метрики: http://{host}:{port}/metrics")
+    return runner
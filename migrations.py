@@ -0,0 +1,414 @@
+# -*- coding: utf-8 -*-
+
+"""
+Версионные миграции tasks.db.
+
+Версия схемы хранится в PRAGMA user_version. При старте все недостающие
+миграции из MIGRATIONS накатываются по порядку в одной транзакции
+(вместе с новым user_version). DDL в миграциях заморожен: уже выпущенные
+шаги не редактируются, изменения схемы — только новой миграцией в конце.
+
+Тяжёлые правки данных (backfill) в транзакцию миграций не входят: они
+описаны в BACKFILLS и выполняются небольшими пачками уже во время работы
+бота, каждая пачка — отдельная короткая транзакция на потоке-писателе.
+"""
+
+import logging
+import sqlite3
+from collections import namedtuple
+
+logger = logging.getLogger(__name__)
+
+# (версия, описание, SQL-выражения)
+MIGRATIONS = [
+    (
+        1,
+        "tasks table",
+        (
+            """
+            CREATE TABLE IF NOT EXISTS tasks (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                manager_id INTEGER,
+                manager_username TEXT,
+                content TEXT,
+                status TEXT,
+                tech_id INTEGER,
+                tech_username TEXT,
+                tech_chat_message_id INTEGER,
+                created_at TEXT,
+                updated_at TEXT
+            )
+            """,
+        ),
+    ),
+    (
+        2,
+        "indexes for /mytasks, status and tech_id lookups",
+        (
+            "CREATE INDEX IF NOT EXISTS idx_tasks_manager ON tasks (manager_id, id DESC, content, status, tech_username, created_at)",
+            "CREATE INDEX IF NOT EXISTS idx_tasks_status ON tasks (status)",
+            "CREATE INDEX IF NOT EXISTS idx_tasks_tech ON tasks (tech_id)",
+        ),
+    ),
+    (
+        3,
+        "index for /mytasks status filters",
+        ("CREATE INDEX IF NOT EXISTS idx_tasks_manager_status ON tasks (manager_id, status, id DESC)",),
+    ),
+    (
+        4,
+        "task_events: append-only history of status transitions",
+        (
+            """
+            CREATE TABLE IF NOT EXISTS task_events (
+                id INTEGER PRIMARY KEY,
+                task_id INTEGER NOT NULL,
+                status TEXT NOT NULL,
+                actor_id INTEGER,
+                actor_username TEXT,
+                at TEXT NOT NULL
+            )
+            """,
+            "CREATE INDEX IF NOT EXISTS idx_task_events_task ON task_events (task_id, at)",
+            "CREATE INDEX IF NOT EXISTS idx_task_events_actor ON task_events (actor_id, at, status)",
+            "CREATE INDEX IF NOT EXISTS idx_task_events_status ON task_events (status, at)",
+        ),
+    ),
+    (
+        5,
+        "aggregate counters for /stats, maintained by triggers",
+        (
+            "CREATE TABLE IF NOT EXISTS task_status_counts (status TEXT PRIMARY KEY, n INTEGER NOT NULL) WITHOUT ROWID",
+            """
+            CREATE TABLE IF NOT EXISTS tech_status_counts (
+                tech_id INTEGER NOT NULL,
+                status TEXT NOT NULL,
+                tech_username TEXT,
+                n INTEGER NOT NULL,
+                PRIMARY KEY (tech_id, status)
+            ) WITHOUT ROWID
+            """,
+            # стартовые значения — один проход по индексам; дальше только триггеры
+            "INSERT INTO task_status_counts (status, n) SELECT status, COUNT(*) FROM tasks WHERE status IS NOT NULL GROUP BY status",
+            """
+            INSERT INTO tech_status_counts (tech_id, status, tech_username, n)
+            SELECT tech_id, status, MAX(tech_username), COUNT(*) FROM tasks
+            WHERE tech_id IS NOT NULL AND status IS NOT NULL GROUP BY tech_id, status
+            """,
+            """
+            CREATE TRIGGER IF NOT EXISTS trg_tasks_counts_insert AFTER INSERT ON tasks
+            BEGIN
+                INSERT INTO task_status_counts (status, n) SELECT NEW.status, 1 WHERE NEW.status IS NOT NULL
+                    ON CONFLICT (status) DO UPDATE SET n = n + 1;
+                INSERT INTO tech_status_counts (tech_id, status, tech_username, n)
+                    SELECT NEW.tech_id, NEW.status, NEW.tech_username, 1 WHERE NEW.tech_id IS NOT NULL AND NEW.status IS NOT NULL
+                    ON CONFLICT (tech_id, status) DO UPDATE SET n = n + 1, tech_username = excluded.tech_username;
+            END
+            """,
+            """
+            CREATE TRIGGER IF NOT EXISTS trg_tasks_counts_update AFTER UPDATE OF status, tech_id ON tasks
+            WHEN OLD.status IS NOT NEW.status OR OLD.tech_id IS NOT NEW.tech_id
+            BEGIN
+                UPDATE task_status_counts SET n = n - 1 WHERE status = OLD.status;
+                INSERT INTO task_status_counts (status, n) SELECT NEW.status, 1 WHERE NEW.status IS NOT NULL
+                    ON CONFLICT (status) DO UPDATE SET n = n + 1;
+                UPDATE tech_status_counts SET n = n - 1 WHERE tech_id = OLD.tech_id AND status = OLD.status;
+                INSERT INTO tech_status_counts (tech_id, status, tech_username, n)
+                    SELECT NEW.tech_id, NEW.status, NEW.tech_username, 1 WHERE NEW.tech_id IS NOT NULL AND NEW.status IS NOT NULL
+                    ON CONFLICT (tech_id, status) DO UPDATE SET n = n + 1, tech_username = excluded.tech_username;
+            END
+            """,
+            """
+            CREATE TRIGGER IF NOT EXISTS trg_tasks_counts_delete AFTER DELETE ON tasks
+            BEGIN
+                UPDATE task_status_counts SET n = n - 1 WHERE status = OLD.status;
+                UPDATE tech_status_counts SET n = n - 1 WHERE tech_id = OLD.tech_id AND status = OLD.status;
+            END
+            """,
+        ),
+    ),
+    (
+        6,
+        "tasks_fts: full-text index over tasks.content",
+        (
+            # external content: сам текст живёт в tasks, в индексе только токены.
+            # unicode61 приводит регистр и для кириллицы, remove_diacritics 2 снимает
+            # латинскую диакритику (café = cafe); «ё» он не трогает — её триггеры
+            # заменяют на «е» сами. prefix — быстрые запросы вида «принт*».
+            """
+            CREATE VIRTUAL TABLE IF NOT EXISTS tasks_fts USING fts5(
+                content,
+                content='tasks',
+                content_rowid='id',
+                tokenize='unicode61 remove_diacritics 2',
+                prefix='2 3'
+            )
+            """,
+            # уже существующие таски индексирует backfill «tasks_fts: content» (после v14)
+            """
+            CREATE TRIGGER IF NOT EXISTS trg_tasks_fts_insert AFTER INSERT ON tasks
+            BEGIN
+                INSERT INTO tasks_fts (rowid, content) VALUES (NEW.id, replace(replace(NEW.content, 'ё', 'е'), 'Ё', 'Е'));
+            END
+            """,
+            """
+            CREATE TRIGGER IF NOT EXISTS trg_tasks_fts_delete AFTER DELETE ON tasks
+            BEGIN
+                INSERT INTO tasks_fts (tasks_fts, rowid, content) VALUES ('delete', OLD.id, replace(replace(OLD.content, 'ё', 'е'), 'Ё', 'Е'));
+            END
+            """,
+            """
+            CREATE TRIGGER IF NOT EXISTS trg_tasks_fts_update AFTER UPDATE OF content ON tasks
+            BEGIN
+                INSERT INTO tasks_fts (tasks_fts, rowid, content) VALUES ('delete', OLD.id, replace(replace(OLD.content, 'ё', 'е'), 'Ё', 'Е'));
+                INSERT INTO tasks_fts (rowid, content) VALUES (NEW.id, replace(replace(NEW.content, 'ё', 'е'), 'Ё', 'Е'));
+            END
+            """,
+        ),
+    ),
+    (
+        7,
+        "technicians: on-duty flag for auto-assignment",
+        (
+            """
+            CREATE TABLE IF NOT EXISTS technicians (
+                tech_id INTEGER PRIMARY KEY,
+                tech_username TEXT,
+                available INTEGER NOT NULL DEFAULT 0,
+                updated_at TEXT
+            )
+            """,
+        ),
+    ),
+    (
+        8,
+        "tasks.priority and a partial index for the open-task backlog",
+        (
+            # 0 — высокий, 1 — обычный, 2 — низкий: ORDER BY priority, id сразу даёт «срочные, потом старые»
+            "ALTER TABLE tasks ADD COLUMN priority INTEGER NOT NULL DEFAULT 1",
+            # в индексе только открытые таски — он не растёт вместе с архивом
+            "CREATE INDEX IF NOT EXISTS idx_tasks_backlog ON tasks (priority, id) WHERE status IN ('new', 'in_progress', 'on_hold')",
+        ),
+    ),
+    (
+        9,
+        "tasks.card_version for signed callback_data",
+        (
+            # уже разосланные карточки остаются с версией 0 и старой callback_data "take:123";
+            # новые создаются с версией 1 (FIRST_CARD_VERSION)
+            "ALTER TABLE tasks ADD COLUMN card_version INTEGER NOT NULL DEFAULT 0",
+        ),
+    ),
+    (
+        10,
+        "tasks.tech_chat_id: card location when routing to several tech chats",
+        (
+            # NULL — карточка в чате по умолчанию (TECH_CHAT_ID), как у всех тасок до v10
+            "ALTER TABLE tasks ADD COLUMN tech_chat_id INTEGER",
+        ),
+    ),
+    (
+        11,
+        "task_attachments: Telegram file_id of photos/documents sent with /connect",
+        (
+            # только file_id: сами файлы лежат у Telegram, бот их не скачивает
+            """
+            CREATE TABLE IF NOT EXISTS task_attachments (
+                task_id INTEGER NOT NULL,
+                position INTEGER NOT NULL,
+                kind TEXT NOT NULL,
+                file_id TEXT NOT NULL,
+                file_unique_id TEXT,
+                PRIMARY KEY (task_id, position)
+            ) WITHOUT ROWID
+            """,
+        ),
+    ),
+    (
+        12,
+        "manager notification modes and the pending_notifications queue for digests",
+        (
+            # строки нет — режим по умолчанию (NOTIFY_MODE); notify_every_min только у batch
+            """
+            CREATE TABLE IF NOT EXISTS manager_settings (
+                manager_id INTEGER PRIMARY KEY,
+                notify_mode TEXT NOT NULL,
+                notify_every_min REAL,
+                updated_at TEXT
+            )
+            """,
+            # события ждут сводки; отправленная сводка удаляет свои строки
+            """
+            CREATE TABLE IF NOT EXISTS pending_notifications (
+                id INTEGER PRIMARY KEY,
+                manager_id INTEGER NOT NULL,
+                task_id INTEGER NOT NULL,
+                status_text TEXT NOT NULL,
+                created_at TEXT NOT NULL
+            )
+            """,
+            "CREATE INDEX IF NOT EXISTS idx_pending_notifications_manager ON pending_notifications (manager_id, id)",
+        ),
+    ),
+    (
+        13,
+        "backfill_progress: watermark and completion flag of each backfill",
+        (
+            # пройденные backfill-и при следующих стартах не запускаются вовсе
+            """
+            CREATE TABLE IF NOT EXISTS backfill_progress (
+                name TEXT PRIMARY KEY,
+                last_id INTEGER NOT NULL DEFAULT 0,
+                done INTEGER NOT NULL DEFAULT 0
+            ) WITHOUT ROWID
+            """,
+        ),
+    ),
+    (
+        14,
+        "tasks_fts: prefix index for 4-6 characters",
+        (
+            # fts_query ищет по префиксу только основы в 4-6 символов: под них
+            # и префиксный индекс, иначе FTS5 сливает doclist-ы всех слов на
+            # «кабинет*» при каждом запросе. prefix у fts5 не меняется —
+            # индекс пересоздаётся пустым, старые таски заполняет backfill,
+            # новые — триггер вставки v6 (он пишет в tasks_fts по имени).
+            "DROP TABLE IF EXISTS tasks_fts",
+            """
+            CREATE VIRTUAL TABLE tasks_fts USING fts5(
+                content,
+                content='tasks',
+                content_rowid='id',
+                tokenize='unicode61 remove_diacritics 2',
+                prefix='4 5 6'
+            )
+            """,
+            # 'delete' для таски, которой ещё нет в индексе, испортил бы его:
+            # пока идёт backfill, удаление и правка трогают только проиндексированные
+            # (у каждой есть строка в служебной tasks_fts_docsize)
+            "DROP TRIGGER IF EXISTS trg_tasks_fts_delete",
+            """
+            CREATE TRIGGER trg_tasks_fts_delete AFTER DELETE ON tasks
+            WHEN EXISTS (SELECT 1 FROM tasks_fts_docsize WHERE id = OLD.id)
+            BEGIN
+                INSERT INTO tasks_fts (tasks_fts, rowid, content) VALUES ('delete', OLD.id, replace(replace(OLD.content, 'ё', 'е'), 'Ё', 'Е'));
+            END
+            """,
+            "DROP TRIGGER IF EXISTS trg_tasks_fts_update",
+            """
+            CREATE TRIGGER trg_tasks_fts_update AFTER UPDATE OF content ON tasks
+            WHEN EXISTS (SELECT 1 FROM tasks_fts_docsize WHERE id = OLD.id)
+            BEGIN
+                INSERT INTO tasks_fts (tasks_fts, rowid, content) VALUES ('delete', OLD.id, replace(replace(OLD.content, 'ё', 'е'), 'Ё', 'Е'));
+                INSERT INTO tasks_fts (rowid, content) VALUES (NEW.id, replace(replace(NEW.content, 'ё', 'е'), 'Ё', 'Е'));
+            END
+            """,
+        ),
+    ),
+]
+
+# name — ключ в backfill_progress и для логов; sql — UPDATE/INSERT по строкам
+# tasks с id в полуинтервале (?, ?]. Пачка — следующие batch_size id после
+# сохранённого водяного знака, так что каждая транзакция трогает ограниченный
+# кусок таблицы, а прерванный backfill продолжается с того же места. Условие
+# всё равно должно быть идемпотентным (… WHERE new_col IS NULL …): пачка,
+# закоммиченная без водяного знака, не должна задвоиться. Backfill закончен,
+# когда за водяным знаком не осталось тасок.
+Backfill = namedtuple("Backfill", "name sql")
+
+BACKFILLS = [
+    # таски, созданные до v4: событие создания...
+    Backfill(
+        "task_events: created",
+        """
+        INSERT INTO task_events (task_id, status, actor_id, actor_username, at)
+        SELECT t.id, 'new', t.manager_id, t.manager_username, COALESCE(t.created_at, '')
+        FROM tasks t
+        WHERE t.id > ? AND t.id <= ?
+          AND NOT EXISTS (SELECT 1 FROM task_events e WHERE e.task_id = t.id AND +e.status = 'new')
+        """,
+    ),
+    # ...и текущий статус (промежуточные переходы до v4 не сохранились)
+    Backfill(
+        "task_events: current status",
+        """
+        INSERT INTO task_events (task_id, status, actor_id, actor_username, at)
+        SELECT t.id, t.status, t.tech_id, t.tech_username, COALESCE(t.updated_at, t.created_at, '')
+        FROM tasks t
+        WHERE t.id > ? AND t.id <= ? AND t.status IS NOT NULL AND t.status != 'new'
+          AND NOT EXISTS (SELECT 1 FROM task_events e WHERE e.task_id = t.id AND +e.status = t.status)
+        """,
+    ),
+    # полнотекстовый индекс (v14) для тасок, созданных до него; новые туда
+    # уже положил триггер вставки — они есть в tasks_fts_docsize
+    Backfill(
+        "tasks_fts: content",
+        """
+        INSERT INTO tasks_fts (rowid, content)
+        SELECT t.id, replace(replace(t.content, 'ё', 'е'), 'Ё', 'Е')
+        FROM tasks t
+        WHERE t.id > ? AND t.id <= ?
+          AND NOT EXISTS (SELECT 1 FROM tasks_fts_docsize d WHERE d.id = t.id)
+        """,
+    ),
+]
+
+LATEST_VERSION = MIGRATIONS[-1][0]
+
+
+def schema_version(conn: sqlite3.Connection) -> int:
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+
+def migrate(conn: sqlite3.Connection) -> int:
+    """Накатывает недостающие миграции; возвращает итоговую версию схемы."""
+    current = schema_version(conn)
+    if current > LATEST_VERSION:
+        raise RuntimeError(f"Схема БД v{current} новее, чем знает этот код (v{LATEST_VERSION})")
+    pending = [m for m in MIGRATIONS if m[0] > current]
+    if not pending:
+        return current
+
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        for version, description, statements in pending:
+            logger.info(f"Миграция БД v{version}: {description}")
+            for sql in statements:
+                conn.execute(sql)
+        # user_version пишется в заголовок файла в той же транзакции
+        conn.execute(f"PRAGMA user_version = {LATEST_VERSION}")
+    except BaseException:
+        conn.execute("ROLLBACK")
+        raise
+    conn.execute("COMMIT")
+    return LATEST_VERSION
+
+
+def finished_backfills(conn: sqlite3.Connection) -> set:
+    return {name for (name,) in conn.execute("SELECT name FROM backfill_progress WHERE done = 1")}
+
+
+def backfill_step(conn: sqlite3.Connection, backfill: Backfill, batch_size: int) -> tuple:
+    """
+    Одна пачка backfill в отдельной транзакции вместе с новым водяным знаком.
+
+    Возвращает (затронуто строк, закончен ли backfill).
+    """
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        row = conn.execute("SELECT last_id FROM backfill_progress WHERE name = ?", (backfill.name,)).fetchone()
+        last_id = row[0] if row else 0
+        upper = conn.execute("SELECT MAX(id) FROM (SELECT id FROM tasks WHERE id > ? ORDER BY id LIMIT ?)", (last_id, batch_size)).fetchone()[0]
+        changed = 0
+        if upper is not None:
+            changed = conn.execute(backfill.sql, (last_id, upper)).rowcount
+        conn.execute(
+            "INSERT INTO backfill_progress (name, last_id, done) VALUES (?, ?, ?) "
+            "ON CONFLICT (name) DO UPDATE SET last_id = excluded.last_id, done = excluded.done",
+            (backfill.name, last_id if upper is None else upper, int(upper is None)),
+        )
+    except BaseException:
+        conn.execute("ROLLBACK")
+        raise
+    conn.execute("COMMIT")
+    return changed, upper is None
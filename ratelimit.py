@@ -0,0 +1,261 @@
+# -*- coding: utf-8 -*-
+
+"""
+Исходящий rate limiter для Bot API (подключается через ApplicationBuilder.rate_limiter).
+
+Каждый запрос с chat_id проходит два token bucket-а: свой чат (группы —
+~20 сообщений в минуту, личка — ~1 в секунду) и общий на бота (~30 в
+секунду). Ожидающие запросы обслуживаются по приоритету: посты тасок
+в тех-чат раньше правок, правки раньше уведомлений менеджерам. Внутри
+бакета это порядок очереди, между бакетами — допуск к общему: запрос
+берёт глобальный токен, только когда нигде (ни в одном бакете чата)
+не ждёт запрос важнее. Иначе уведомление в личку, у которой свой
+свободный бакет, обгоняло бы таску, ждущую в бакете группы.
+
+RetryAfter (429) не роняет запрос: бакет, по которому он прилетел,
+уходит в «долг» на retry_after секунд, и запрос повторяется.
+"""
+
+import asyncio
+import heapq
+import itertools
+import logging
+import time
+from datetime import timedelta
+from typing import Any, Dict, Optional
+
+from telegram.error import BadRequest, Forbidden, RetryAfter, TimedOut
+from telegram.ext import BaseRateLimiter
+
+from metrics import BOT_API_REQUESTS, BOT_API_SECONDS, RATELIMIT_WAIT_SECONDS
+
+logger = logging.getLogger(__name__)
+
+# классы приоритета: меньше — важнее
+PRIORITY_TASK = 0  # новая таска в тех-чат
+PRIORITY_EDIT = 1  # правка карточки таски, ответы в чате
+PRIORITY_NOTIFY = 2  # уведомления менеджерам
+
+# эти методы не шлют сообщений в чаты и Telegram их не лимитирует
+UNLIMITED_ENDPOINTS = frozenset({"answerCallbackQuery", "answerInlineQuery", "getMe", "getUpdates", "setWebhook", "deleteWebhook", "getFile"})
+
+
+def _observe(endpoint: str, started: float, result: str) -> None:
+    BOT_API_SECONDS.labels(endpoint).observe(time.perf_counter() - started)
+    BOT_API_REQUESTS.labels(endpoint, result).inc()
+
+
+class TokenBucket:
+    """Token bucket с очередью ожидающих по приоритету (asyncio, один поток)."""
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self._waiters = []  # heap: (priority, seq, future)
+        self._seq = itertools.count()
+        self.penalized_until = 0.0  # time.monotonic(), до которого действует последний RetryAfter
+        self._timer: Optional[asyncio.TimerHandle] = None
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    @property
+    def idle(self) -> bool:
+        self._refill()
+        return not self._waiters and self.tokens >= self.capacity
+
+    def waiting(self) -> int:
+        return len(self._waiters)
+
+    async def acquire(self, priority: int = PRIORITY_EDIT) -> None:
+        self._refill()
+        if not self._waiters and self.tokens >= 1:
+            self.tokens -= 1
+            return
+        fut = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (priority, next(self._seq), fut))
+        self._dispatch()
+        try:
+            await fut
+        except asyncio.CancelledError:
+            if fut.done() and not fut.cancelled():
+                # токен уже выдали, но забрать его не успели — возвращаем
+                self.tokens = min(self.capacity, self.tokens + 1)
+                self._dispatch()
+            raise
+
+    def penalize(self, seconds: float) -> None:
+        """Уводит бакет в долг: следующий токен появится не раньше чем через seconds."""
+        self._refill()
+        self.tokens = min(self.tokens, 0) - seconds * self.rate
+        self.penalized_until = max(self.penalized_until, time.monotonic() + seconds)
+        self._dispatch()
+
+    def _dispatch(self) -> None:
+        self._refill()
+        while self._waiters and self.tokens >= 1:
+            _, _, fut = heapq.heappop(self._waiters)
+            if fut.done():  # ожидающий отменён
+                continue
+            self.tokens -= 1
+            fut.set_result(None)
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        if self._waiters:
+            delay = (1 - self.tokens) / self.rate
+            self._timer = asyncio.get_running_loop().call_later(delay, self._on_timer)
+
+    def _on_timer(self) -> None:
+        self._timer = None
+        self._dispatch()
+
+
+class TechTaskRateLimiter(BaseRateLimiter[Dict[str, Any]]):
+    """
+    rate_limit_args, которые понимает лимитер:
+        {"priority": PRIORITY_*} — класс приоритета запроса.
+    """
+
+    def __init__(
+        self,
+        global_per_sec: float = 30,
+        group_per_min: float = 20,
+        private_per_sec: float = 1,
+        max_retries: int = 3,
+        chat_overrides: Optional[Dict[int, float]] = None,
+        global_burst: Optional[float] = None,
+        group_burst: Optional[float] = None,
+        private_burst: Optional[float] = None,
+    ):
+        # burst — ёмкость бакета (сколько можно отправить залпом после простоя)
+        self.global_bucket = TokenBucket(global_per_sec, global_burst or global_per_sec)
+        self.group_per_min = group_per_min
+        self.group_burst = group_burst or group_per_min
+        self.private_per_sec = private_per_sec
+        self.private_burst = private_burst or max(1.0, private_per_sec * 3)
+        self.max_retries = max_retries
+        # chat_id -> своё число сообщений в минуту
+        self.chat_overrides = dict(chat_overrides or {})
+        self._chat_buckets: Dict[int, TokenBucket] = {}
+        # приоритет -> сколько запросов этого класса ещё не получили глобальный токен
+        self._pending: Dict[int, int] = {}
+        self._turn_waiters = []  # futures менее важных запросов, ждущих своей очереди
+        self.retries = 0
+
+    async def initialize(self) -> None:
+        pass
+
+    async def shutdown(self) -> None:
+        self._chat_buckets.clear()
+
+    def _chat_bucket(self, chat_id: int) -> TokenBucket:
+        bucket = self._chat_buckets.get(chat_id)
+        if bucket is None:
+            if len(self._chat_buckets) > 10_000:
+                # забываем полные и никем не ожидаемые бакеты, чтобы словарь не рос бесконечно
+                for key in [k for k, b in self._chat_buckets.items() if b.idle]:
+                    del self._chat_buckets[key]
+            if chat_id in self.chat_overrides:
+                per_min = self.chat_overrides[chat_id]
+                bucket = TokenBucket(per_min / 60, per_min)
+            elif chat_id < 0:
+                bucket = TokenBucket(self.group_per_min / 60, self.group_burst)
+            else:
+                bucket = TokenBucket(self.private_per_sec, self.private_burst)
+            self._chat_buckets[chat_id] = bucket
+        return bucket
+
+    def queue_depth(self) -> int:
+        return self.global_bucket.waiting() + sum(b.waiting() for b in self._chat_buckets.values()) + len(self._turn_waiters)
+
+    # ----------------- Допуск по приоритету между бакетами -----------------
+    def _enter(self, priority: int) -> None:
+        self._pending[priority] = self._pending.get(priority, 0) + 1
+
+    def _leave(self, priority: int) -> None:
+        left = self._pending[priority] - 1
+        if left:
+            self._pending[priority] = left
+            return
+        del self._pending[priority]
+        # класс опустел — ждущие своей очереди перепроверяют, не их ли она
+        waiters, self._turn_waiters = self._turn_waiters, []
+        for fut in waiters:
+            if not fut.done():
+                fut.set_result(None)
+
+    async def _wait_turn(self, priority: int) -> None:
+        while any(p < priority for p in self._pending):
+            fut = asyncio.get_running_loop().create_future()
+            self._turn_waiters.append(fut)
+            try:
+                await fut
+            finally:
+                if fut in self._turn_waiters:
+                    self._turn_waiters.remove(fut)
+
+    async def _acquire(self, chat_bucket: Optional[TokenBucket], priority: int) -> None:
+        self._enter(priority)
+        try:
+            # очередь — до токена чата: иначе взятый токен ждал бы здесь и мог
+            # уйти посреди штрафа RetryAfter, наложенного на этот чат
+            await self._wait_turn(priority)
+            if chat_bucket is not None:
+                await chat_bucket.acquire(priority)
+            await self.global_bucket.acquire(priority)
+            # токены выданы до 429, прилетевшего соседу по чату, — ждём конца штрафа
+            for bucket in (chat_bucket, self.global_bucket):
+                if bucket is not None and bucket.penalized_until > time.monotonic():
+                    await asyncio.sleep(bucket.penalized_until - time.monotonic())
+        finally:
+            self._leave(priority)
+
+    async def process_request(self, callback, args, kwargs, endpoint, data, rate_limit_args):
+        priority = (rate_limit_args or {}).get("priority", PRIORITY_EDIT)
+        chat_id = data.get("chat_id")
+        limited = endpoint not in UNLIMITED_ENDPOINTS
+        # chat_id может быть @username канала — такие чаты считаем только глобально
+        chat_bucket = self._chat_bucket(chat_id) if limited and isinstance(chat_id, int) else None
+
+        attempt = 0
+        while True:
+            if limited:
+                started = time.perf_counter()
+                await self._acquire(chat_bucket, priority)
+                RATELIMIT_WAIT_SECONDS.labels(endpoint).observe(time.perf_counter() - started)
+            started = time.perf_counter()
+            try:
+                response = await callback(*args, **kwargs)
+            except RetryAfter as e:
+                _observe(endpoint, started, "retry_after")
+                if attempt >= self.max_retries:
+                    raise
+                attempt += 1
+                self.retries += 1
+                delay = e.retry_after.total_seconds() if isinstance(e.retry_after, timedelta) else float(e.retry_after)
+                logger.warning(f"429 на {endpoint} (chat {chat_id}), повтор через {delay:.1f} с")
+                if limited:
+                    # следующий acquire сам дождётся конца штрафа, заодно притормозив соседей
+                    (chat_bucket or self.global_bucket).penalize(delay)
+                else:
+                    await asyncio.sleep(delay)
+            except BadRequest:
+                _observe(endpoint, started, "bad_request")
+                raise
+            except Forbidden:
+                _observe(endpoint, started, "forbidden")
+                raise
+            except TimedOut:
+                _observe(endpoint, started, "timeout")
+                raise
+            except Exception:
+                _observe(endpoint, started, "error")
+                raise
+            else:
+                _observe(endpoint, started, "ok")
+                return response
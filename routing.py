@@ -0,0 +1,125 @@
+# -*- coding: utf-8 -*-
+
+"""
+Маршрутизация тасок по нескольким тех-чатам.
+
+Правила — JSON в env ROUTING (строкой или @путь к файлу):
+
+    {
+      "chats": {"hw": -1001234567, "soft": -1007654321},
+      "budgets": {"hw": 30},
+      "rules": [
+        {"chat": "soft", "managers": [123456, "ivanov"]},
+        {"chat": "hw", "keywords": ["принтер", "картридж", "мфу"]},
+        {"chat": "soft", "keywords": ["1с", "почта"]}
+      ]
+    }
+
+chats — имя -> chat_id; имя же служит категорией: /connect #hw текст.
+budgets — своё число сообщений в минуту для чата (rate limiter-у), без
+него чат получает обычный групповой лимит. Чат выбирается так: явная
+категория, потом правило по менеджеру (id или username), потом ключевые
+слова (выигрывает правило выше в списке), иначе — чат по умолчанию
+(TECH_CHAT_ID).
+
+Ключевое слово — одно слово, совпадает с началом слова в тексте без учёта
+регистра: «принтер» ловит и «принтеры», и «Принтера». При старте все
+ключевые слова собираются в один словарь «префикс -> лучшее правило»:
+текст таски проходится один раз, на каждое его слово — несколько поисков
+в словаре (по числу разных длин ключевых слов), сколько бы ни было правил.
+Менеджеры и категории — тоже поиск в словаре.
+"""
+
+import json
+import re
+from typing import Dict, FrozenSet, Iterable, Optional
+
+
+_WORD = re.compile(r"\w+")
+
+
+def _norm(text: str) -> str:
+    return text.lower().replace("ё", "е")
+
+
+class Router:
+    def __init__(self, default_chat: int, chats: Optional[Dict[str, int]] = None, rules: Iterable[dict] = (), budgets: Optional[Dict[str, float]] = None):
+        self.default_chat = default_chat
+        self.chats: Dict[str, int] = {_norm(name): int(chat_id) for name, chat_id in (chats or {}).items()}
+        self.budgets: Dict[int, float] = {}
+        for name, per_min in (budgets or {}).items():
+            self.budgets[self._chat(name)] = float(per_min)
+        self.chat_ids: FrozenSet[int] = frozenset(self.chats.values()) | {default_chat}
+        self.names: Dict[int, str] = {chat_id: name for name, chat_id in self.chats.items()}
+
+        self._managers: Dict[object, int] = {}  # id или username в нижнем регистре -> chat_id
+        self._keywords: Dict[str, int] = {}  # ключевое слово -> номер первого правила с ним
+        self._rule_chats = []  # номер правила -> chat_id
+        for rule in rules:
+            chat_id = self._chat(rule.get("chat", ""))
+            for manager in rule.get("managers", ()):
+                key = _norm(str(manager).lstrip("@"))
+                key = int(key) if key.lstrip("-").isdigit() else key
+                self._managers.setdefault(key, chat_id)
+            for keyword in rule.get("keywords", ()):
+                keyword = _norm(str(keyword).strip())
+                if not _WORD.fullmatch(keyword):
+                    raise ValueError(f"ROUTING: ключевое слово должно быть одним словом: {keyword!r}")
+                self._keywords.setdefault(keyword, len(self._rule_chats))
+            self._rule_chats.append(chat_id)
+        # какие длины префиксов вообще стоит искать в словаре
+        self._lengths = sorted({len(keyword) for keyword in self._keywords})
+
+    def _chat(self, name: str) -> int:
+        chat_id = self.chats.get(_norm(str(name)))
+        if chat_id is None:
+            raise ValueError(f"ROUTING: неизвестный чат {name!r}, есть: {', '.join(self.chats) or '—'}")
+        return chat_id
+
+    @classmethod
+    def from_config(cls, default_chat: int, raw: str) -> "Router":
+        """raw — JSON или @путь к JSON-файлу; пустая строка — один чат по умолчанию."""
+        raw = raw.strip()
+        if not raw:
+            return cls(default_chat)
+        if raw.startswith("@"):
+            with open(raw[1:], encoding="utf-8") as f:
+                raw = f.read()
+        config = json.loads(raw)
+        return cls(default_chat, config.get("chats"), config.get("rules", ()), config.get("budgets"))
+
+    def is_tech_chat(self, chat_id: Optional[int]) -> bool:
+        return chat_id in self.chat_ids
+
+    def name(self, chat_id: int) -> str:
+        return self.names.get(chat_id, "default")
+
+    def route(self, content: str, manager_id: Optional[int] = None, manager_username: str = "", category: Optional[str] = None) -> int:
+        if category is not None:
+            return self._chat(category)
+        if self._managers:
+            chat_id = self._managers.get(manager_id)
+            if chat_id is None and manager_username:
+                chat_id = self._managers.get(_norm(manager_username))
+            if chat_id is not None:
+                return chat_id
+        if self._keywords:
+            keywords, lengths = self._keywords, self._lengths
+            best = len(self._rule_chats)
+            for word in _WORD.findall(_norm(content)):
+                for n in lengths:
+                    if n > len(word):
+                        break
+                    rule = keywords.get(word[:n])
+                    if rule is not None and rule < best:
+                        best = rule
+                if not best:
+                    break
+            if best < len(self._rule_chats):
+                return self._rule_chats[best]
+        return self.default_chat
+
+    def parse_category(self, tag: str) -> Optional[str]:
+        """'#HW' -> 'hw', если такой чат есть; иначе None."""
+        name = _norm(tag[1:]) if tag.startswith("#") else ""
+        return name if name in self.chats else None
@@ -0,0 +1,164 @@
+# -*- coding: utf-8 -*-
+
+"""
+Напоминания о зависших тасках (SLA).
+
+Таймеры живут в памяти в min-heap по дедлайну: поставить, передвинуть или
+снять таймер — O(log n), ближайший дедлайн — вершина кучи. Старые записи
+из кучи не выковыриваются: у таски есть номер поколения, и запись с чужим
+поколением при извлечении просто выбрасывается (ленивое удаление). Когда
+мусора становится больше, чем живых таймеров, куча перестраивается за O(n).
+
+При старте таймеры поднимаются из tasks одним проходом по индексу статуса,
+дальше их двигают create/take/смена статуса — периодических сканов БД нет.
+
+    timers = SlaTimers({"new": 1800, "on_hold": 86400})
+    timers.track(task_id, "new", since=created_ts)
+    timers.start(on_due)   # on_due(task_id, status, since, fired) — корутина
+
+Работает только из event loop, блокировок нет.
+"""
+
+import asyncio
+import heapq
+import itertools
+import logging
+import time
+from typing import Awaitable, Callable, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+# мусор в куче терпим, пока его не больше живых таймеров и не меньше этого числа
+COMPACT_MIN_STALE = 1024
+
+
+class SlaTimers:
+    def __init__(self, limits: Dict[str, float], clock: Callable[[], float] = time.time):
+        # limits: статус -> через сколько секунд напоминать (и потом повторять);
+        # статусы без лимита (или с 0) таймеров не получают
+        self.limits = {status: seconds for status, seconds in limits.items() if seconds > 0}
+        self.clock = clock
+        self._heap = []  # (дедлайн, порядковый номер, task_id, поколение)
+        self._seq = itertools.count()
+        # task_id -> [поколение, статус, с какого момента в статусе, сколько раз напомнили]
+        self._timers: Dict[int, list] = {}
+        self._generation = itertools.count(1)
+        self._wake = asyncio.Event()
+        self._worker: Optional[asyncio.Task] = None
+        self._tasks = set()
+        self.fired = 0
+
+    def __len__(self) -> int:
+        return len(self._timers)
+
+    @property
+    def stale(self) -> int:
+        """Записи в куче, которые уже ничего не значат."""
+        return len(self._heap) - len(self._timers)
+
+    def next_deadline(self) -> Optional[float]:
+        self._drop_stale_top()
+        return self._heap[0][0] if self._heap else None
+
+    # ----------------- Изменения тасок -----------------
+    def track(self, task_id: int, status: str, since: Optional[float] = None) -> None:
+        """
+        Таска перешла в status в момент since: ставит/двигает таймер или снимает его.
+
+        Интервалы, которые целиком прошли до вызова (таймеры поднимаются
+        после рестарта), считаются уже отработанными — иначе старт бота
+        после простоя вывалил бы в чат напоминания по всему бэклогу разом.
+        """
+        limit = self.limits.get(status)
+        if limit is None:
+            self.discard(task_id)
+            return
+        now = self.clock()
+        since = now if since is None else since
+        fired = max(0, int((now - since) // limit))
+        generation = next(self._generation)
+        self._timers[task_id] = [generation, status, since, fired]
+        self._push(since + limit * (fired + 1), task_id, generation)
+
+    def discard(self, task_id: int) -> None:
+        # сама запись остаётся в куче и будет выброшена при извлечении
+        if self._timers.pop(task_id, None) is not None:
+            self._maybe_compact()
+
+    def pop_due(self, now: Optional[float] = None) -> list:
+        """
+        Снимает все наступившие дедлайны: [(task_id, status, since, fired)].
+
+        Таймер сразу перевзводится на следующий интервал — напоминание
+        повторяется, пока таска не сменит статус.
+        """
+        now = self.clock() if now is None else now
+        due = []
+        while self._heap and self._heap[0][0] <= now:
+            _, _, task_id, generation = heapq.heappop(self._heap)
+            timer = self._timers.get(task_id)
+            if timer is None or timer[0] != generation:
+                continue
+            timer[3] += 1
+            _, status, since, fired = timer
+            due.append((task_id, status, since, fired))
+            self._push(since + self.limits[status] * (fired + 1), task_id, generation)
+        return due
+
+    def _push(self, deadline: float, task_id: int, generation: int) -> None:
+        top = self._heap[0][0] if self._heap else None
+        heapq.heappush(self._heap, (deadline, next(self._seq), task_id, generation))
+        if top is None or deadline < top:
+            # новый ближайший дедлайн — воркер должен проснуться раньше
+            self._wake.set()
+        self._maybe_compact()
+
+    def _drop_stale_top(self) -> None:
+        heap = self._heap
+        while heap:
+            timer = self._timers.get(heap[0][2])
+            if timer is not None and timer[0] == heap[0][3]:
+                return
+            heapq.heappop(heap)
+
+    def _maybe_compact(self) -> None:
+        stale = self.stale
+        if stale >= COMPACT_MIN_STALE and stale > len(self._timers):
+            timers = self._timers
+            self._heap = [e for e in self._heap if timers.get(e[2], (None,))[0] == e[3]]
+            heapq.heapify(self._heap)
+
+    # ----------------- Воркер -----------------
+    def start(self, on_due: Callable[[int, str, float, int], Awaitable[None]]) -> None:
+        self._worker = asyncio.create_task(self._run(on_due))
+
+    async def stop(self) -> None:
+        if self._worker:
+            self._worker.cancel()
+            self._worker = None
+        for task in list(self._tasks):
+            task.cancel()
+
+    async def _run(self, on_due) -> None:
+        while True:
+            self._wake.clear()
+            deadline = self.next_deadline()
+            timeout = None if deadline is None else max(0.0, deadline - self.clock())
+            if timeout is None or timeout > 0:
+                try:
+                    await asyncio.wait_for(self._wake.wait(), timeout)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            for task_id, status, since, fired in self.pop_due():
+                self.fired += 1
+                # отправка ждёт rate limiter — воркер на это время не блокируем
+                task = asyncio.create_task(self._fire(on_due, task_id, status, since, fired))
+                self._tasks.add(task)
+                task.add_done_callback(self._tasks.discard)
+
+    async def _fire(self, on_due, task_id: int, status: str, since: float, fired: int) -> None:
+        try:
+            await on_due(task_id, status, since, fired)
+        except Exception:
+            logger.exception(f"Не удалось напомнить о таске #{task_id}")
@@ -0,0 +1,110 @@
+# -*- coding: utf-8 -*-
+
+"""
+Кэш горячих тасок перед TaskStore.
+
+Кнопки живы у нескольких десятков тасок, а get_task дёргается на каждое
+нажатие. Кэш держит TaskRecord-ы в LRU, ограниченном и числом записей,
+и примерным объёмом памяти. Все изменения идут через AsyncTaskStore,
+который после commit-а кладёт свежую строку сюда же (write-through),
+поэтому инвалидация по времени не нужна.
+
+Работает только из event loop, блокировок нет.
+"""
+
+import sys
+from collections import OrderedDict
+from typing import Dict, List, Optional
+
+from task_store import TASK_COLUMNS, TaskRecord
+
+DEFAULT_MAX_ENTRIES = 2000
+DEFAULT_MAX_BYTES = 16 * 1024 * 1024
+
+
+def record_size(record: TaskRecord) -> int:
+    """Примерный размер записи в байтах: сам объект плюс его строки."""
+    size = sys.getsizeof(record)
+    for name in TASK_COLUMNS:
+        value = getattr(record, name)
+        if isinstance(value, str):
+            size += sys.getsizeof(value)
+    return size
+
+
+class TaskCache:
+    def __init__(self, max_entries: int = DEFAULT_MAX_ENTRIES, max_bytes: int = DEFAULT_MAX_BYTES):
+        self.max_entries = max(1, max_entries)
+        self.max_bytes = max_bytes
+        self._items: "OrderedDict[int, tuple]" = OrderedDict()  # id -> (record, size)
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        # id -> [сколько чтений из БД в полёте, счётчик записей за это время]
+        self._loading: Dict[int, List[int]] = {}
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+    def get(self, task_id: int) -> Optional[TaskRecord]:
+        item = self._items.get(task_id)
+        if item is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self._items.move_to_end(task_id)
+        return item[0]
+
+    def put(self, record: TaskRecord) -> None:
+        """Write-through: свежая строка после commit-а."""
+        self._bump(record.id)
+        self._store(record)
+
+    def invalidate(self, task_id: int) -> None:
+        self._bump(task_id)
+        item = self._items.pop(task_id, None)
+        if item is not None:
+            self.bytes -= item[1]
+
+    def update(self, task_id: int, **fields) -> None:
+        """Точечно правит закэшированную запись (для отложенных записей в БД)."""
+        self._bump(task_id)
+        item = self._items.get(task_id)
+        if item is not None:
+            for name, value in fields.items():
+                setattr(item[0], name, value)
+
+    # ----------------- Заполнение по промаху -----------------
+    # Чтение из БД идёт в другом потоке: пока оно летит, таску могут изменить,
+    # и тогда пришедшая строка уже устарела — класть её в кэш нельзя.
+    def start_load(self, task_id: int) -> int:
+        entry = self._loading.setdefault(task_id, [0, 0])
+        entry[0] += 1
+        return entry[1]
+
+    def finish_load(self, task_id: int, version: int, record: Optional[TaskRecord]) -> None:
+        entry = self._loading[task_id]
+        entry[0] -= 1
+        fresh = entry[1] == version
+        if not entry[0]:
+            del self._loading[task_id]
+        if fresh and record is not None and task_id not in self._items:
+            self._store(record)
+
+    def _bump(self, task_id: int) -> None:
+        entry = self._loading.get(task_id)
+        if entry is not None:
+            entry[1] += 1
+
+    def _store(self, record: TaskRecord) -> None:
+        size = record_size(record)
+        old = self._items.pop(record.id, None)
+        if old is not None:
+            self.bytes -= old[1]
+        self._items[record.id] = (record, size)
+        self.bytes += size
+        while len(self._items) > self.max_entries or (self.bytes > self.max_bytes and len(self._items) > 1):
+            _, (_, evicted_size) = self._items.popitem(last=False)
+            self.bytes -= evicted_size
+            self.evictions += 1
@@ -0,0 +1,912 @@
+# -*- coding: utf-8 -*-
+
+"""
+Хранилище тасок поверх SQLite.
+
+Держит небольшой пул долгоживущих соединений (WAL + подкрученные pragma)
+вместо sqlite3.connect на каждый вызов. Все SQL-строки лежат в одном
+словаре SQL, поэтому встроенный кэш подготовленных выражений sqlite3
+переиспользует их на каждом соединении.
+
+AsyncTaskStore — awaitable-обёртка для хэндлеров: запись идёт через один
+поток-писатель, чтение — через небольшой пул потоков, event loop не ждёт fsync.
+"""
+
+import asyncio
+import functools
+import json
+import logging
+import queue
+import re
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from collections import namedtuple
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Optional, Union
+
+import migrations
+from metrics import DB_SECONDS, REGISTRY
+
+logger = logging.getLogger(__name__)
+
+TASK_COLUMNS = (
+    "id",
+    "manager_id",
+    "manager_username",
+    "content",
+    "status",
+    "tech_id",
+    "tech_username",
+    "tech_chat_message_id",
+    "created_at",
+    "updated_at",
+    "priority",
+    "card_version",
+    "tech_chat_id",
+)
+
+# индекс — значение tasks.priority: чем меньше, тем срочнее
+TASK_PRIORITIES = ("high", "normal", "low")
+DEFAULT_PRIORITY = 1
+# версия карточки в тех-чате: растёт на каждом переходе, после которого меняются
+# её кнопки (см. callback_codec.py); 0 остался у карточек со старой callback_data
+FIRST_CARD_VERSION = 1
+# статусы, в которых у карточки есть кнопки
+CARD_STATUSES = ("new", "in_progress")
+
+EVENT_COLUMNS = ("id", "task_id", "status", "actor_id", "actor_username", "at")
+
+SQL = {
+    "insert_task": """
+        INSERT INTO tasks (manager_id, manager_username, content, status, priority, card_version, created_at, updated_at)
+        VALUES (?, ?, ?, 'new', ?, ?, ?, ?)
+        RETURNING """ + ", ".join(TASK_COLUMNS),
+    # вложения (migrations v11): (kind, file_id, file_unique_id) в порядке альбома
+    "insert_attachment": "INSERT INTO task_attachments (task_id, position, kind, file_id, file_unique_id) VALUES (?, ?, ?, ?, ?)",
+    # карточка таски — пара (чат, сообщение): тех-чатов может быть несколько (routing.py)
+    "set_tech_message_id": "UPDATE tasks SET tech_chat_id = ?, tech_chat_message_id = ?, updated_at = ? WHERE id = ?",
+    "get_task": "SELECT " + ", ".join(TASK_COLUMNS) + " FROM tasks WHERE id = ?",
+    # compare-and-set: берём только если таска всё ещё 'new'; RETURNING отдаёт
+    # строку сразу, без отдельного SELECT
+    "take_task": """
+        UPDATE tasks
+        SET tech_id = ?, tech_username = ?, status = 'in_progress', card_version = card_version + 1, updated_at = ?
+        WHERE id = ? AND status = 'new'
+        RETURNING """ + ", ".join(TASK_COLUMNS),
+    # RETURNING — свежая строка сразу уходит в кэш тасок (write-through)
+    "update_status_with_tech": """
+        UPDATE tasks
+        SET status = ?, tech_id = COALESCE(?, tech_id), tech_username = COALESCE(?, tech_username),
+            card_version = card_version + 1, updated_at = ?
+        WHERE id = ?
+        RETURNING """ + ", ".join(TASK_COLUMNS),
+    "update_status": "UPDATE tasks SET status = ?, card_version = card_version + 1, updated_at = ? WHERE id = ? RETURNING " + ", ".join(TASK_COLUMNS),
+    # keyset-пагинация /mytasks: older — страница «дальше в прошлое» (id < курсора),
+    # newer — обратно к свежим (id > курсора, потом разворачиваем в Python)
+    "manager_page_older": "SELECT id, content, status, tech_username, created_at FROM tasks WHERE manager_id = ? AND id < ? ORDER BY id DESC LIMIT ?",
+    "manager_page_newer": "SELECT id, content, status, tech_username, created_at FROM tasks WHERE manager_id = ? AND id > ? ORDER BY id LIMIT ?",
+    "manager_page_older_status": "SELECT id, content, status, tech_username, created_at FROM tasks WHERE manager_id = ? AND status = ? AND id < ? ORDER BY id DESC LIMIT ?",
+    "manager_page_newer_status": "SELECT id, content, status, tech_username, created_at FROM tasks WHERE manager_id = ? AND status = ? AND id > ? ORDER BY id LIMIT ?",
+    "list_status_tasks": "SELECT " + ", ".join(TASK_COLUMNS) + " FROM tasks WHERE status = ? ORDER BY id",
+    "list_tech_tasks": "SELECT id, status FROM tasks WHERE tech_id = ? ORDER BY id",
+    # /backlog: keyset внутри одного приоритета по частичному индексу idx_tasks_backlog.
+    # (priority, id) > (?, ?) индекс ищет только по priority, поэтому уровни
+    # приоритета обходятся по очереди (их всего три)
+    "backlog_after": """
+        SELECT id, content, status, tech_username, priority, created_at FROM tasks
+        WHERE status IN ('new', 'in_progress', 'on_hold') AND priority = ? AND id > ?
+        ORDER BY id LIMIT ?
+    """,
+    "backlog_before": """
+        SELECT id, content, status, tech_username, priority, created_at FROM tasks
+        WHERE status IN ('new', 'in_progress', 'on_hold') AND priority = ? AND id < ?
+        ORDER BY id DESC LIMIT ?
+    """,
+    # автоназначение (assign.py): кто из техников на смене
+    "set_tech_available": """
+        INSERT INTO technicians (tech_id, tech_username, available, updated_at) VALUES (?, ?, ?, ?)
+        ON CONFLICT (tech_id) DO UPDATE SET tech_username = excluded.tech_username, available = excluded.available, updated_at = excluded.updated_at
+    """,
+    "list_technicians": "SELECT tech_id, tech_username, available FROM technicians",
+    # сводки менеджерам (digest.py): режим и очередь событий до отправки
+    "set_notify_mode": """
+        INSERT INTO manager_settings (manager_id, notify_mode, notify_every_min, updated_at) VALUES (?, ?, ?, ?)
+        ON CONFLICT (manager_id) DO UPDATE SET notify_mode = excluded.notify_mode, notify_every_min = excluded.notify_every_min, updated_at = excluded.updated_at
+    """,
+    "list_notify_modes": "SELECT manager_id, notify_mode, notify_every_min FROM manager_settings",
+    "insert_notification": "INSERT INTO pending_notifications (manager_id, task_id, status_text, created_at) VALUES (?, ?, ?, ?)",
+    "pending_notifications": """
+        SELECT p.id, p.task_id, p.status_text, t.content FROM pending_notifications p
+        LEFT JOIN tasks t ON t.id = p.task_id
+        WHERE p.manager_id = ? ORDER BY p.id
+    """,
+    "delete_notifications": "DELETE FROM pending_notifications WHERE manager_id = ? AND id <= ?",
+    "pending_managers": "SELECT manager_id, MIN(created_at) FROM pending_notifications GROUP BY manager_id",
+    # с какого момента таска в статусе — для таймеров SLA (sla.py) при старте
+    "status_since": "SELECT id, CASE WHEN status = 'new' THEN created_at ELSE updated_at END, priority FROM tasks WHERE status = ?",
+    # версии живых карточек (с кнопками) — при старте, для проверки нажатий в памяти
+    "card_versions": "SELECT id, card_version FROM tasks WHERE status IN ('new', 'in_progress')",
+    # агрегаты для /stats: маленькие таблицы, которые держат в актуальном виде
+    # триггеры на tasks (migrations v5) в той же транзакции, что и сама запись
+    "status_counts": "SELECT status, n FROM task_status_counts",
+    "tech_counts": "SELECT tech_id, tech_username, status, n FROM tech_status_counts WHERE n > 0",
+    # полнотекстовый поиск (migrations v6, v14): rank — bm25 по всем совпадениям,
+    # сортирует сам FTS5 (без временного B-дерева). snippet — отдельным запросом
+    # только для id страницы (JSON-массив), а не для каждого совпадения
+    "search_all": """
+        SELECT t.id, t.status, t.tech_username, t.manager_username
+        FROM tasks_fts JOIN tasks t ON t.id = tasks_fts.rowid
+        WHERE tasks_fts MATCH ?
+        ORDER BY rank LIMIT ? OFFSET ?
+    """,
+    "search_user": """
+        SELECT t.id, t.status, t.tech_username, t.manager_username
+        FROM tasks_fts JOIN tasks t ON t.id = tasks_fts.rowid
+        WHERE tasks_fts MATCH ? AND (t.manager_id = ? OR t.tech_id = ?)
+        ORDER BY rank LIMIT ? OFFSET ?
+    """,
+    "search_snippets": """
+        SELECT rowid, snippet(tasks_fts, 0, '«', '»', '…', 12) FROM tasks_fts
+        WHERE tasks_fts MATCH ? AND rowid IN (SELECT value FROM json_each(?))
+    """,
+    # task_events: только INSERT, пишется в одной транзакции с переходом статуса
+    "insert_event": "INSERT INTO task_events (task_id, status, actor_id, actor_username, at) VALUES (?, ?, ?, ?, ?)",
+    "task_timeline": "SELECT " + ", ".join(EVENT_COLUMNS) + " FROM task_events WHERE task_id = ? ORDER BY at, id",
+    "actor_events": "SELECT " + ", ".join(EVENT_COLUMNS) + " FROM task_events WHERE actor_id = ? AND at >= ? AND at < ? ORDER BY at DESC LIMIT ?",
+    "count_status_events": "SELECT COUNT(*) FROM task_events WHERE status = ? AND at >= ? AND at < ?",
+    # +status: не даём планировщику уйти в idx_task_events_status — по технику окно всегда уже
+    "count_actor_status_events": "SELECT COUNT(*) FROM task_events WHERE actor_id = ? AND +status = ? AND at >= ? AND at < ?",
+}
+
+MAX_ID = 2 ** 63 - 1
+# граница «без верхнего предела» для окон по времени (at — ISO-строка)
+MAX_TS = "9999"
+TASK_STATUSES = ("new", "in_progress", "done", "on_hold", "cancelled")
+
+TaskEvent = namedtuple("TaskEvent", EVENT_COLUMNS)
+
+
+Timestamp = Union[datetime, str, None]
+
+SEARCH_MAX_TERMS = 8
+# грубое отсечение русских окончаний у слов запроса (стеммера в unicode61 нет)
+_RU_ENDING = re.compile(r"(ами|ями|ого|его|ому|ему|ыми|ими|ой|ей|ом|ем|ам|ям|ах|ях|ов|ев|ий|ый|ая|яя|ое|ее|ые|ие|[аяыиуюеоьй])$")
+
+
+# префиксы короче SEARCH_PREFIX_MIN раскрываются в слишком много слов, длиннее
+# SEARCH_PREFIX_MAX обрезаются: префиксный индекс tasks_fts (migrations v14) — ровно 4-6
+SEARCH_PREFIX_MIN = 4
+SEARCH_PREFIX_MAX = 6
+
+
+def _stem(word: str) -> str:
+    stem = _RU_ENDING.sub("", word.lower())
+    return stem if len(stem) >= SEARCH_PREFIX_MIN else word
+
+
+def _fts_term(word: str) -> str:
+    stem = _stem(word)
+    if stem.isalpha() and len(stem) >= SEARCH_PREFIX_MIN:
+        return f'"{stem[:SEARCH_PREFIX_MAX]}"*'
+    return f'"{word}"'
+
+
+def fts_query(text: str) -> str:
+    """
+    Пользовательский текст -> безопасный запрос FTS5.
+
+    Каждое слово берётся в кавычки (никакого синтаксиса FTS5 от пользователя),
+    теряет окончание и ищется по префиксу: «принтеры» найдёт и «принтер»,
+    и «принтера». Числа и короткие слова ищутся точно («499» не найдёт «4990»).
+    Пустая строка — искать нечего.
+    """
+    words = re.findall(r"\w+", text.replace("ё", "е").replace("Ё", "Е"))[:SEARCH_MAX_TERMS]
+    return " ".join(_fts_term(word) for word in words)
+
+
+def _ts(value: Timestamp, default: str) -> str:
+    if value is None:
+        return default
+    return value.isoformat() if isinstance(value, datetime) else value
+
+
+class TaskRecord:
+    """Строка tasks: __slots__ вместо dict — меньше памяти и без zip(keys, row) на каждое чтение."""
+
+    __slots__ = TASK_COLUMNS
+
+    def __init__(self, *values):
+        for name, value in zip(TASK_COLUMNS, values):
+            setattr(self, name, value)
+
+    @classmethod
+    def from_row(cls, row) -> Optional["TaskRecord"]:
+        return cls(*row) if row else None
+
+    def __repr__(self) -> str:
+        return f"TaskRecord(id={self.id}, status={self.status!r})"
+
+# горячие запросы и параметры-образцы для EXPLAIN QUERY PLAN
+HOT_QUERIES = {
+    "get_task": (1,),
+    "take_task": (1, "tech", "", 1),
+    "set_tech_message_id": (-1, 1, "", 1),
+    "update_status": ("done", "", 1),
+    "update_status_with_tech": ("done", 1, "tech", "", 1),
+    "manager_page_older": (1, MAX_ID, 10),
+    "manager_page_newer": (1, 0, 10),
+    "manager_page_older_status": (1, "new", MAX_ID, 10),
+    "manager_page_newer_status": (1, "new", 0, 10),
+    "list_status_tasks": ("new",),
+    "list_tech_tasks": (1,),
+    "backlog_after": (1, 0, 11),
+    "backlog_before": (1, MAX_ID, 11),
+    "status_since": ("new",),
+    "card_versions": (),
+    "pending_notifications": (1,),
+    "task_timeline": (1,),
+    "actor_events": (1, "", MAX_TS, 50),
+    "count_status_events": ("done", "", MAX_TS),
+    "count_actor_status_events": (1, "done", "", MAX_TS),
+    "search_all": ('"принте"*', 11, 0),
+    "search_user": ('"принте"*', 1, 1, 11, 0),
+    "search_snippets": ('"принте"*', "[1, 2]"),
+}
+
+# WAL: читатели не блокируют писателя. synchronous=FULL — fsync WAL на каждый
+# commit: переход, о котором бот уже ответил (тост, правка карточки), переживает
+# и отключение питания, а не только падение процесса, как при NORMAL. Цену fsync
+# делит вся пачка group commit-а; читатели ничего не коммитят и её не платят.
+PRAGMAS = (
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=FULL",
+    "PRAGMA cache_size=-16000",  # ~16 МБ страничного кэша на соединение
+    "PRAGMA mmap_size=134217728",  # 128 МБ
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA busy_timeout=5000",
+)
+
+DEFAULT_POOL_SIZE = 4
+DEFAULT_PAGE_SIZE = 10
+DEFAULT_READERS = 3
+# group commit: сколько ждём отложенные записи и сколько операций максимум в одной транзакции
+DEFAULT_BATCH_WINDOW = 0.005
+DEFAULT_BATCH_MAX = 100
+
+DB_COMMITS = REGISTRY.counter("tech_task_db_commits_total", "Транзакции записи (пачки)")
+DB_BATCH_SIZE = REGISTRY.histogram("tech_task_db_batch_size", "Операций записи в одной транзакции", buckets=(1, 2, 4, 8, 16, 32, 64, 128))
+
+
+class ConnectionPool:
+    """Пул соединений к одному файлу БД; соединения создаются лениво."""
+
+    def __init__(self, path: str, size: int = DEFAULT_POOL_SIZE):
+        self.path = path
+        self.size = max(1, size)
+        self._idle: "queue.LifoQueue[sqlite3.Connection]" = queue.LifoQueue()
+        self._all = []
+        self._lock = threading.Lock()
+
+    def _connect(self) -> sqlite3.Connection:
+        # isolation_level=None — транзакциями управляем сами (BEGIN IMMEDIATE),
+        # cached_statements с запасом, чтобы весь набор SQL оставался подготовленным.
+        conn = sqlite3.connect(
+            self.path,
+            check_same_thread=False,
+            isolation_level=None,
+            cached_statements=max(128, len(SQL) * 4),
+        )
+        for pragma in PRAGMAS:
+            conn.execute(pragma)
+        return conn
+
+    def acquire(self) -> sqlite3.Connection:
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+        with self._lock:
+            if len(self._all) < self.size:
+                conn = self._connect()
+                self._all.append(conn)
+                return conn
+        return self._idle.get()
+
+    def release(self, conn: sqlite3.Connection) -> None:
+        if conn.in_transaction:
+            conn.rollback()
+        self._idle.put(conn)
+
+    @contextmanager
+    def connection(self):
+        conn = self.acquire()
+        try:
+            yield conn
+        finally:
+            self.release(conn)
+
+    def close(self) -> None:
+        with self._lock:
+            for conn in self._all:
+                try:
+                    conn.close()
+                except sqlite3.Error:
+                    pass
+            self._all = []
+            self._idle = queue.LifoQueue()
+
+
+class TaskStore:
+    def __init__(self, path: str, pool_size: int = DEFAULT_POOL_SIZE):
+        self.path = path
+        self.pool = ConnectionPool(path, pool_size)
+
+    @contextmanager
+    def transaction(self):
+        # BEGIN IMMEDIATE сразу берёт RESERVED-лок, так что два писателя
+        # не упираются в SQLITE_BUSY при апгрейде лока посреди транзакции.
+        with self.pool.connection() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                yield conn
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+            conn.execute("COMMIT")
+
+    def init_schema(self) -> int:
+        """Накатывает миграции (см. migrations.py); возвращает версию схемы."""
+        with self.pool.connection() as conn:
+            version = migrations.migrate(conn)
+            # дешёвый ANALYZE только там, где статистика устарела
+            conn.execute("PRAGMA optimize")
+        return version
+
+    def backfill_step(self, backfill: "migrations.Backfill", batch_size: int) -> tuple:
+        with self.pool.connection() as conn:
+            return migrations.backfill_step(conn, backfill, batch_size)
+
+    def finished_backfills(self) -> set:
+        with self.pool.connection() as conn:
+            return migrations.finished_backfills(conn)
+
+    def check_query_plans(self) -> dict:
+        """
+        Прогоняет HOT_QUERIES через EXPLAIN QUERY PLAN.
+
+        Возвращает {имя: [строки плана]} для запросов, которые скатились
+        в полный скан таблицы или сортировку во временном B-дереве.
+        """
+        bad = {}
+        with self.pool.connection() as conn:
+            for name, params in HOT_QUERIES.items():
+                plan = [row[-1] for row in conn.execute("EXPLAIN QUERY PLAN " + SQL[name], params)]
+                # SCAN ... VIRTUAL TABLE INDEX — это поиск по индексу FTS5, а не скан таблицы
+                if any((step.startswith("SCAN") and "VIRTUAL TABLE INDEX" not in step) or "TEMP B-TREE" in step for step in plan):
+                    bad[name] = plan
+        return bad
+
+    def close(self) -> None:
+        self.pool.close()
+
+    # ----------------- Запись -----------------
+    # _-версии работают внутри уже открытой транзакции: ими же пачкой пользуется run_batch
+    def _create_task(self, conn: sqlite3.Connection, manager_id: int, manager_username: str, content: str, priority: int = DEFAULT_PRIORITY, attachments: tuple = ()) -> TaskRecord:
+        now = datetime.utcnow().isoformat()
+        record = TaskRecord.from_row(conn.execute(SQL["insert_task"], (manager_id, manager_username, content, priority, FIRST_CARD_VERSION, now, now)).fetchone())
+        conn.execute(SQL["insert_event"], (record.id, "new", manager_id, manager_username, now))
+        if attachments:
+            conn.executemany(SQL["insert_attachment"], ((record.id, i, *attachment) for i, attachment in enumerate(attachments)))
+        return record
+
+    def _set_tech_message_id(self, conn: sqlite3.Connection, task_id: int, chat_id: int, msg_id: int) -> None:
+        conn.execute(SQL["set_tech_message_id"], (chat_id, msg_id, datetime.utcnow().isoformat(), task_id))
+
+    def _take_task(self, conn: sqlite3.Connection, task_id: int, tech_id: int, tech_username: str) -> Optional[TaskRecord]:
+        now = datetime.utcnow().isoformat()
+        record = TaskRecord.from_row(conn.execute(SQL["take_task"], (tech_id, tech_username, now, task_id)).fetchone())
+        if record is not None:
+            conn.execute(SQL["insert_event"], (task_id, "in_progress", tech_id, tech_username, now))
+        return record
+
+    def _update_status(self, conn: sqlite3.Connection, task_id: int, status: str, tech_id: Optional[int] = None, tech_username: Optional[str] = None) -> Optional[TaskRecord]:
+        now = datetime.utcnow().isoformat()
+        if tech_id is not None or tech_username is not None:
+            row = conn.execute(SQL["update_status_with_tech"], (status, tech_id, tech_username, now, task_id)).fetchone()
+        else:
+            row = conn.execute(SQL["update_status"], (status, now, task_id)).fetchone()
+        if row is not None:
+            conn.execute(SQL["insert_event"], (task_id, status, tech_id, tech_username, now))
+        return TaskRecord.from_row(row)
+
+    def _set_tech_available(self, conn: sqlite3.Connection, tech_id: int, tech_username: str, available: bool) -> None:
+        conn.execute(SQL["set_tech_available"], (tech_id, tech_username, int(available), datetime.utcnow().isoformat()))
+
+    def _set_notify_mode(self, conn: sqlite3.Connection, manager_id: int, mode: str, every: Optional[float]) -> None:
+        conn.execute(SQL["set_notify_mode"], (manager_id, mode, every, datetime.utcnow().isoformat()))
+
+    def _queue_notification(self, conn: sqlite3.Connection, manager_id: int, task_id: int, status_text: str) -> None:
+        conn.execute(SQL["insert_notification"], (manager_id, task_id, status_text, datetime.utcnow().isoformat()))
+
+    def _delete_notifications(self, conn: sqlite3.Connection, manager_id: int, up_to_id: int) -> None:
+        conn.execute(SQL["delete_notifications"], (manager_id, up_to_id))
+
+    def create_task(self, manager_id: int, manager_username: str, content: str, priority: int = DEFAULT_PRIORITY, attachments: tuple = ()) -> int:
+        """attachments — [(kind, file_id, file_unique_id)], пишутся в той же транзакции."""
+        with self.transaction() as conn:
+            return self._create_task(conn, manager_id, manager_username, content, priority, attachments).id
+
+    def set_tech_message_id(self, task_id: int, chat_id: int, msg_id: int) -> None:
+        with self.transaction() as conn:
+            self._set_tech_message_id(conn, task_id, chat_id, msg_id)
+
+    def take_task(self, task_id: int, tech_id: int, tech_username: str) -> Optional[TaskRecord]:
+        """Атомарно берёт таску; None — если её нет или она уже не 'new'."""
+        with self.transaction() as conn:
+            return self._take_task(conn, task_id, tech_id, tech_username)
+
+    def update_status(self, task_id: int, status: str, tech_id: Optional[int] = None, tech_username: Optional[str] = None) -> Optional[TaskRecord]:
+        """Строка после смены статуса; None — таски нет."""
+        with self.transaction() as conn:
+            return self._update_status(conn, task_id, status, tech_id, tech_username)
+
+    def set_tech_available(self, tech_id: int, tech_username: str, available: bool) -> None:
+        with self.transaction() as conn:
+            self._set_tech_available(conn, tech_id, tech_username, available)
+
+    def set_notify_mode(self, manager_id: int, mode: str, every: Optional[float] = None) -> None:
+        with self.transaction() as conn:
+            self._set_notify_mode(conn, manager_id, mode, every)
+
+    def queue_notification(self, manager_id: int, task_id: int, status_text: str) -> None:
+        with self.transaction() as conn:
+            self._queue_notification(conn, manager_id, task_id, status_text)
+
+    def delete_notifications(self, manager_id: int, up_to_id: int) -> None:
+        """Снимает из очереди события менеджера по id включительно — то, что ушло в сводку."""
+        with self.transaction() as conn:
+            self._delete_notifications(conn, manager_id, up_to_id)
+
+    def run_batch(self, ops: list) -> list:
+        """
+        Применяет пачку записей [(имя, args), ...] одной транзакцией — один commit.
+
+        Каждая операция идёт в своём SAVEPOINT: упавшая откатывается одна,
+        остальные коммитятся. Возвращает результаты по порядку; на месте
+        упавшей операции — её исключение.
+        """
+        results = []
+        with self.transaction() as conn:
+            for name, args in ops:
+                conn.execute("SAVEPOINT op")
+                try:
+                    results.append(getattr(self, "_" + name)(conn, *args))
+                except Exception as e:
+                    conn.execute("ROLLBACK TO op")
+                    results.append(e)
+                conn.execute("RELEASE op")
+        return results
+
+    # ----------------- Чтение -----------------
+    def get_task(self, task_id: int) -> Optional[TaskRecord]:
+        with self.pool.connection() as conn:
+            return TaskRecord.from_row(conn.execute(SQL["get_task"], (task_id,)).fetchone())
+
+    def list_manager_tasks(
+        self,
+        manager_id: int,
+        status: Optional[str] = None,
+        before_id: Optional[int] = None,
+        after_id: Optional[int] = None,
+        limit: int = DEFAULT_PAGE_SIZE,
+    ) -> tuple:
+        """
+        Одна страница задач менеджера, от новых к старым.
+
+        before_id — показать задачи старше курсора, after_id — новее курсора.
+        Возвращает (rows, has_older, has_newer). Берём limit + 1 строку, чтобы
+        узнать, есть ли что-то дальше, не делая отдельный COUNT.
+        """
+        newer = after_id is not None
+        cursor = after_id if newer else (before_id or MAX_ID)
+        name = "manager_page_newer" if newer else "manager_page_older"
+        if status:
+            params = (manager_id, status, cursor, limit + 1)
+            name += "_status"
+        else:
+            params = (manager_id, cursor, limit + 1)
+        with self.pool.connection() as conn:
+            rows = conn.execute(SQL[name], params).fetchall()
+        more = len(rows) > limit
+        rows = rows[:limit]
+        if newer:
+            rows.reverse()
+            # пришли со старой страницы — значит, позади что-то есть
+            return rows, True, more
+        return rows, more, before_id is not None
+
+    def list_status_tasks(self, status: str) -> list:
+        with self.pool.connection() as conn:
+            rows = conn.execute(SQL["list_status_tasks"], (status,)).fetchall()
+        return [TaskRecord(*row) for row in rows]
+
+    def list_tech_tasks(self, tech_id: int):
+        with self.pool.connection() as conn:
+            return conn.execute(SQL["list_tech_tasks"], (tech_id,)).fetchall()
+
+    def backlog(self, after: Optional[tuple] = None, before: Optional[tuple] = None, limit: int = DEFAULT_PAGE_SIZE) -> tuple:
+        """
+        Страница открытых тасок: сначала срочные, внутри приоритета — старые первыми.
+
+        after/before — курсор (priority, id) последней/первой строки соседней
+        страницы. Возвращает (rows, has_prev, has_next); как и в
+        list_manager_tasks, берём limit + 1 строку вместо COUNT.
+        """
+        rows = []
+        with self.pool.connection() as conn:
+            if before is None:
+                priority, cursor = after or (0, 0)
+                for level in range(priority, len(TASK_PRIORITIES)):
+                    rows += conn.execute(SQL["backlog_after"], (level, cursor if level == priority else 0, limit + 1 - len(rows))).fetchall()
+                    if len(rows) > limit:
+                        break
+            else:
+                priority, cursor = before
+                for level in range(priority, -1, -1):
+                    rows += conn.execute(SQL["backlog_before"], (level, cursor if level == priority else MAX_ID, limit + 1 - len(rows))).fetchall()
+                    if len(rows) > limit:
+                        break
+        more = len(rows) > limit
+        rows = rows[:limit]
+        if before is not None:
+            rows.reverse()
+            return rows, more, True
+        return rows, after is not None, more
+
+    def status_since(self, status: str) -> list:
+        """[(id, с какого момента в статусе, priority)] всех тасок в status."""
+        with self.pool.connection() as conn:
+            return conn.execute(SQL["status_since"], (status,)).fetchall()
+
+    def card_versions(self) -> list:
+        """[(id, версия карточки)] тасок, у карточек которых есть кнопки."""
+        with self.pool.connection() as conn:
+            return conn.execute(SQL["card_versions"]).fetchall()
+
+    def list_technicians(self) -> list:
+        """[(tech_id, tech_username, на смене)]."""
+        with self.pool.connection() as conn:
+            return [(tech_id, username, bool(available)) for tech_id, username, available in conn.execute(SQL["list_technicians"])]
+
+    def list_notify_modes(self) -> list:
+        """[(manager_id, режим, минут в окне)] менеджеров, сменивших режим уведомлений."""
+        with self.pool.connection() as conn:
+            return conn.execute(SQL["list_notify_modes"]).fetchall()
+
+    def pending_notifications(self, manager_id: int) -> list:
+        """[(id, task_id, status_text, content)] событий в очереди менеджера, по порядку."""
+        with self.pool.connection() as conn:
+            return conn.execute(SQL["pending_notifications"], (manager_id,)).fetchall()
+
+    def pending_managers(self) -> list:
+        """[(manager_id, время первого события в очереди)] — при старте."""
+        with self.pool.connection() as conn:
+            return conn.execute(SQL["pending_managers"]).fetchall()
+
+    def search_tasks(self, text: str, user_id: Optional[int] = None, offset: int = 0, limit: int = DEFAULT_PAGE_SIZE) -> tuple:
+        """
+        Поиск по тексту тасок, лучшие совпадения первыми.
+
+        user_id — искать только среди тасок, которые пользователь создал или брал
+        (None — по всем). Возвращает (rows, has_more); строка —
+        (id, snippet, status, tech_username, manager_username).
+        """
+        match = fts_query(text)
+        if not match:
+            return [], False
+        with self.pool.connection() as conn:
+            if user_id is None:
+                page = conn.execute(SQL["search_all"], (match, limit + 1, offset)).fetchall()
+            else:
+                page = conn.execute(SQL["search_user"], (match, user_id, user_id, limit + 1, offset)).fetchall()
+            page, has_more = page[:limit], len(page) > limit
+            snippets = dict(conn.execute(SQL["search_snippets"], (match, json.dumps([row[0] for row in page]))).fetchall()) if page else {}
+        return [(task_id, snippets.get(task_id, ""), *rest) for task_id, *rest in page], has_more
+
+    def stats(self) -> tuple:
+        """
+        Сводка для /stats: ({status: n}, {tech_id: (username, {status: n})}).
+
+        Читает только агрегатные таблицы — время не зависит от размера tasks.
+        """
+        with self.pool.connection() as conn:
+            status_counts = dict(conn.execute(SQL["status_counts"]).fetchall())
+            techs = {}
+            for tech_id, tech_username, status, n in conn.execute(SQL["tech_counts"]):
+                techs.setdefault(tech_id, (tech_username, {}))[1][status] = n
+        return status_counts, techs
+
+    # ----------------- История (task_events) -----------------
+    def task_timeline(self, task_id: int) -> list:
+        """Все переходы таски по времени."""
+        with self.pool.connection() as conn:
+            return [TaskEvent(*row) for row in conn.execute(SQL["task_timeline"], (task_id,))]
+
+    def actor_events(self, actor_id: int, since: Timestamp = None, until: Timestamp = None, limit: int = 50) -> list:
+        """Последние действия пользователя (техника или менеджера) в окне [since, until), новые первыми."""
+        with self.pool.connection() as conn:
+            rows = conn.execute(SQL["actor_events"], (actor_id, _ts(since, ""), _ts(until, MAX_TS), limit)).fetchall()
+        return [TaskEvent(*row) for row in rows]
+
+    def count_events(self, since: Timestamp = None, until: Timestamp = None, actor_id: Optional[int] = None) -> dict:
+        """
+        Число переходов в каждый статус за окно [since, until), опционально — одного пользователя.
+
+        По отдельному COUNT на статус: каждый идёт диапазоном по индексу
+        (status, at) / (actor_id, at), без GROUP BY и сортировки на миллионах строк.
+        """
+        since, until = _ts(since, ""), _ts(until, MAX_TS)
+        counts = {}
+        with self.pool.connection() as conn:
+            for status in TASK_STATUSES:
+                if actor_id is None:
+                    row = conn.execute(SQL["count_status_events"], (status, since, until)).fetchone()
+                else:
+                    row = conn.execute(SQL["count_actor_status_events"], (actor_id, status, since, until)).fetchone()
+                counts[status] = row[0]
+        return counts
+
+
+class AsyncTaskStore:
+    """
+    Асинхронный фасад над TaskStore.
+
+    Все записи сериализуются на единственном потоке-писателе, поэтому
+    BEGIN IMMEDIATE внутри процесса никогда не конкурирует сам с собой;
+    чтения (WAL) идут параллельно на пуле читателей.
+
+    Записи копятся в пачку и уходят одной транзакцией (group commit):
+    пока писатель коммитит предыдущую пачку, новые операции ждут и
+    коммитятся следующей. Переходы статусов и создание тасок (критичные)
+    отдают результат только после commit-а своей пачки. Служебные записи
+    (set_tech_message_id) не ждут вовсе: они ложатся в пачку и коммитятся
+    через batch_window секунд, по набору batch_max операций или вместе
+    с ближайшей критичной записью — раньше неё, в той же транзакции.
+    При падении процесса теряются только они.
+
+    cache (task_cache.TaskCache) — необязательный кэш get_task: каждая
+    запись после commit-а обновляет его строкой из RETURNING.
+    """
+
+    def __init__(self, store: TaskStore, readers: int = DEFAULT_READERS, batch_window: float = DEFAULT_BATCH_WINDOW, batch_max: int = DEFAULT_BATCH_MAX, cache=None):
+        self.store = store
+        self.cache = cache
+        self.batch_window = batch_window
+        self.batch_max = max(1, batch_max)
+        self._writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="db-writer")
+        self._readers = ThreadPoolExecutor(max_workers=max(1, readers), thread_name_prefix="db-reader")
+        self._batch = []  # [(имя, args, future или None для отложенных)]
+        self._flushing = False
+        self._timer: Optional[asyncio.TimerHandle] = None
+        # ещё не закоммиченные карточки: task_id -> (chat_id, message_id), подмешиваются в чтения
+        self._pending_message_ids = {}
+        self.commits = 0
+
+    async def _run(self, executor: ThreadPoolExecutor, fn, *args, **kwargs):
+        loop = asyncio.get_running_loop()
+        started = time.perf_counter()
+        try:
+            return await loop.run_in_executor(executor, functools.partial(fn, *args, **kwargs))
+        finally:
+            # время вместе с ожиданием свободного потока — столько хэндлер и ждал БД
+            DB_SECONDS.labels(fn.__name__).observe(time.perf_counter() - started)
+
+    # ----------------- Пачки записей -----------------
+    async def _write(self, name: str, *args):
+        fut = asyncio.get_running_loop().create_future()
+        self._batch.append((name, args, fut))
+        self._flush_soon()
+        started = time.perf_counter()
+        try:
+            return await fut
+        finally:
+            DB_SECONDS.labels(name).observe(time.perf_counter() - started)
+
+    def _defer(self, name: str, *args) -> None:
+        self._batch.append((name, args, None))
+        if len(self._batch) >= self.batch_max:
+            self._flush_soon()
+        elif self._timer is None and not self._flushing:
+            self._timer = asyncio.get_running_loop().call_later(self.batch_window, self._flush_soon)
+
+    def _flush_soon(self) -> None:
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        if not self._flushing:
+            self._flushing = True
+            asyncio.ensure_future(self._flush())
+
+    async def _flush(self) -> None:
+        try:
+            while self._batch:
+                # не больше batch_max операций в транзакции, чтобы не держать лок долго
+                batch, self._batch = self._batch[: self.batch_max], self._batch[self.batch_max :]
+                try:
+                    results = await self._run(self._writer, self.store.run_batch, [(name, args) for name, args, _ in batch])
+                except Exception as e:
+                    logger.exception(f"Не удалось закоммитить пачку из {len(batch)} записей")
+                    results = [e] * len(batch)
+                self.commits += 1
+                DB_COMMITS.inc()
+                DB_BATCH_SIZE.observe(len(batch))
+                for (name, args, fut), result in zip(batch, results):
+                    if name == "set_tech_message_id" and self._pending_message_ids.get(args[0]) == args[1:]:
+                        del self._pending_message_ids[args[0]]
+                    if fut is None:
+                        if isinstance(result, Exception):
+                            logger.error(f"Отложенная запись {name}{args} не применилась: {result!r}")
+                    elif fut.done():
+                        pass  # ожидающего отменили — запись всё равно применена
+                    elif isinstance(result, Exception):
+                        fut.set_exception(result)
+                    else:
+                        fut.set_result(result)
+                # одни отложенные записи дальше ждут своего окна или набора пачки
+                if len(self._batch) < self.batch_max and all(fut is None for _, _, fut in self._batch):
+                    break
+        finally:
+            self._flushing = False
+            if self._batch and self._timer is None:
+                self._timer = asyncio.get_running_loop().call_later(self.batch_window, self._flush_soon)
+
+    def pending_writes(self) -> int:
+        return len(self._batch)
+
+    def _overlay(self, task: Optional[TaskRecord]) -> Optional[TaskRecord]:
+        if task is not None and task.id in self._pending_message_ids:
+            task.tech_chat_id, task.tech_chat_message_id = self._pending_message_ids[task.id]
+        return task
+
+    async def _write_through(self, task_id: Optional[int], name: str, *args) -> Optional[TaskRecord]:
+        try:
+            record = await self._write(name, *args)
+        except BaseException:
+            if self.cache is not None and task_id is not None:
+                self.cache.invalidate(task_id)
+            raise
+        if self.cache is not None:
+            if record is not None:
+                self.cache.put(record)
+            elif task_id is not None:
+                self.cache.invalidate(task_id)
+        return record
+
+    async def run_backfills(self, batch_size: int = 500, pause: float = 0.05) -> None:
+        """
+        Прогоняет migrations.BACKFILLS пачками по batch_size тасок.
+
+        Каждая пачка — короткая транзакция в общей очереди писателя, а между
+        пачками есть пауза, так что живые хэндлеры не ждут долгий лок.
+        Законченные backfill-и (backfill_progress.done) не трогаются вовсе,
+        прерванный остановкой продолжается со своего водяного знака.
+        """
+        finished = await self._run(self._readers, self.store.finished_backfills)
+        for backfill in migrations.BACKFILLS:
+            if backfill.name in finished:
+                continue
+            total = 0
+            while True:
+                changed, done = await self._run(self._writer, self.store.backfill_step, backfill, batch_size)
+                total += changed
+                if done:
+                    break
+                await asyncio.sleep(pause)
+            if total:
+                logger.info(f"Backfill {backfill.name}: {total} строк")
+
+    def close(self) -> None:
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        if self._batch:
+            # досылаем отложенные записи, которые не успели уйти до остановки
+            batch, self._batch = self._batch, []
+            self._writer.submit(self.store.run_batch, [(name, args) for name, args, _ in batch]).result()
+            self._pending_message_ids.clear()
+        self._writer.shutdown(wait=True)
+        self._readers.shutdown(wait=True)
+        self.store.close()
+
+    # ----------------- Запись -----------------
+    async def create_task(self, manager_id: int, manager_username: str, content: str, priority: int = DEFAULT_PRIORITY, attachments: tuple = ()) -> int:
+        record = await self._write_through(None, "create_task", manager_id, manager_username, content, priority, tuple(attachments))
+        return record.id
+
+    async def set_tech_message_id(self, task_id: int, chat_id: int, msg_id: int) -> None:
+        # отложенная: карточка нужна только для правок, до commit-а её отдают кэш и _overlay
+        self._pending_message_ids[task_id] = (chat_id, msg_id)
+        if self.cache is not None:
+            self.cache.update(task_id, tech_chat_id=chat_id, tech_chat_message_id=msg_id)
+        self._defer("set_tech_message_id", task_id, chat_id, msg_id)
+
+    async def take_task(self, task_id: int, tech_id: int, tech_username: str) -> Optional[TaskRecord]:
+        return await self._write_through(task_id, "take_task", task_id, tech_id, tech_username)
+
+    async def update_status(self, task_id: int, status: str, tech_id: Optional[int] = None, tech_username: Optional[str] = None) -> Optional[TaskRecord]:
+        return await self._write_through(task_id, "update_status", task_id, status, tech_id, tech_username)
+
+    async def set_tech_available(self, tech_id: int, tech_username: str, available: bool) -> None:
+        await self._write("set_tech_available", tech_id, tech_username, available)
+
+    async def set_notify_mode(self, manager_id: int, mode: str, every: Optional[float] = None) -> None:
+        await self._write("set_notify_mode", manager_id, mode, every)
+
+    async def queue_notification(self, manager_id: int, task_id: int, status_text: str) -> None:
+        await self._write("queue_notification", manager_id, task_id, status_text)
+
+    async def delete_notifications(self, manager_id: int, up_to_id: int) -> None:
+        await self._write("delete_notifications", manager_id, up_to_id)
+
+    # ----------------- Чтение -----------------
+    async def get_task(self, task_id: int) -> Optional[TaskRecord]:
+        if self.cache is None:
+            return self._overlay(await self._run(self._readers, self.store.get_task, task_id))
+        record = self.cache.get(task_id)
+        if record is not None:
+            return record
+        version = self.cache.start_load(task_id)
+        record = None
+        try:
+            record = self._overlay(await self._run(self._readers, self.store.get_task, task_id))
+        finally:
+            self.cache.finish_load(task_id, version, record)
+        return record
+
+    async def list_manager_tasks(self, manager_id: int, status: Optional[str] = None, before_id: Optional[int] = None, after_id: Optional[int] = None, limit: int = DEFAULT_PAGE_SIZE) -> tuple:
+        return await self._run(self._readers, self.store.list_manager_tasks, manager_id, status, before_id, after_id, limit)
+
+    async def list_status_tasks(self, status: str) -> list:
+        return [self._overlay(task) for task in await self._run(self._readers, self.store.list_status_tasks, status)]
+
+    async def list_tech_tasks(self, tech_id: int):
+        return await self._run(self._readers, self.store.list_tech_tasks, tech_id)
+
+    async def backlog(self, after: Optional[tuple] = None, before: Optional[tuple] = None, limit: int = DEFAULT_PAGE_SIZE) -> tuple:
+        return await self._run(self._readers, self.store.backlog, after, before, limit)
+
+    async def status_since(self, status: str) -> list:
+        return await self._run(self._readers, self.store.status_since, status)
+
+    async def card_versions(self) -> list:
+        return await self._run(self._readers, self.store.card_versions)
+
+    async def list_technicians(self) -> list:
+        return await self._run(self._readers, self.store.list_technicians)
+
+    async def list_notify_modes(self) -> list:
+        return await self._run(self._readers, self.store.list_notify_modes)
+
+    async def pending_notifications(self, manager_id: int) -> list:
+        return await self._run(self._readers, self.store.pending_notifications, manager_id)
+
+    async def pending_managers(self) -> list:
+        return await self._run(self._readers, self.store.pending_managers)
+
+    async def search_tasks(self, text: str, user_id: Optional[int] = None, offset: int = 0, limit: int = DEFAULT_PAGE_SIZE) -> tuple:
+        return await self._run(self._readers, self.store.search_tasks, text, user_id, offset, limit)
+
+    async def stats(self) -> tuple:
+        return await self._run(self._readers, self.store.stats)
+
+    async def task_timeline(self, task_id: int) -> list:
+        return await self._run(self._readers, self.store.task_timeline, task_id)
+
+    async def actor_events(self, actor_id: int, since: Timestamp = None, until: Timestamp = None, limit: int = 50) -> list:
+        return await self._run(self._readers, self.store.actor_events, actor_id, since, until, limit)
+
+    async def count_events(self, since: Timestamp = None, until: Timestamp = None, actor_id: Optional[int] = None) -> dict:
+        return await self._run(self._readers, self.store.count_events, since, until, actor_id)
@@ -0,0 +1,108 @@
+# -*- coding: utf-8 -*-
+
+"""
+Параллельная обработка апдейтов с сохранением порядка там, где он важен.
+
+Несвязанные апдейты идут параллельно (до max_concurrent_updates штук), а
+апдейты одной таски (task id из callback_data) и одного пользователя —
+строго в порядке поступления: следующий ждёт, пока закончится предыдущий.
+
+Порядок фиксируется синхронно в момент входа в do_process_update: Application
+создаёт задачи на апдейты в порядке их прихода, и до первого await каждая
+успевает встать в хвост своих очередей. Поэтому собственный лимит
+параллельности здесь — внутренний семафор, а семафор базового класса
+сделан заведомо большим, чтобы не переупорядочивать апдейты до нас.
+"""
+
+import asyncio
+import inspect
+from typing import Any, Awaitable, Callable, Dict, Hashable, Optional
+
+from telegram import Update
+from telegram.ext import BaseUpdateProcessor
+
+_UNBOUNDED = 2**31 - 1
+
+
+class OrderedUpdateProcessor(BaseUpdateProcessor):
+    def __init__(self, max_concurrent_updates: int, task_id_of: Optional[Callable[[str], Optional[int]]] = None):
+        if max_concurrent_updates < 1:
+            raise ValueError("`max_concurrent_updates` must be a positive integer!")
+        self._limit = max_concurrent_updates
+        super().__init__(_UNBOUNDED)
+        self._slots = asyncio.BoundedSemaphore(max_concurrent_updates)
+        # task_id_of(callback_data) -> id таски или None (формат callback_data знает main.py)
+        self._task_id_of = task_id_of
+        self._tails: Dict[Hashable, asyncio.Future] = {}
+        self.in_flight = 0
+        self.queued = 0
+
+    @property
+    def max_concurrent_updates(self) -> int:
+        return self._limit
+
+    async def initialize(self) -> None:
+        pass
+
+    async def shutdown(self) -> None:
+        pass
+
+    def ordering_keys(self, update: Any) -> tuple:
+        if not isinstance(update, Update):
+            return ()
+        keys = []
+        query = update.callback_query
+        if query is not None and query.data and self._task_id_of is not None:
+            task_id = self._task_id_of(query.data)
+            if task_id is not None:
+                keys.append(("task", task_id))
+        user = update.effective_user
+        if user is not None:
+            keys.append(("user", user.id))
+        return tuple(keys)
+
+    async def do_process_update(self, update: object, coroutine: Awaitable[Any]) -> None:
+        # всё до первого await выполняется в порядке прихода апдейтов
+        keys = self.ordering_keys(update)
+        done = asyncio.get_running_loop().create_future()
+        done.add_done_callback(lambda _: self._drop_tails(keys, done))
+        predecessors = []
+        for key in keys:
+            tail = self._tails.get(key)
+            if tail is not None and tail not in predecessors:
+                predecessors.append(tail)
+            self._tails[key] = done
+
+        started = False
+        self.queued += 1
+        try:
+            for fut in predecessors:
+                # shield: отмена этого апдейта не должна «отменять» чужой future
+                await asyncio.shield(fut)
+            async with self._slots:
+                self.queued -= 1
+                started = True
+                self.in_flight += 1
+                try:
+                    await coroutine
+                finally:
+                    self.in_flight -= 1
+        finally:
+            pending = []
+            if not started:
+                self.queued -= 1
+                if inspect.iscoroutine(coroutine):
+                    coroutine.close()
+                pending = [fut for fut in predecessors if not fut.done()]
+            if pending:
+                # апдейт отменили в очереди: следующие за ним всё равно должны
+                # дождаться тех, кто стоял впереди, поэтому отпускаем очередь позже
+                waiter = asyncio.ensure_future(asyncio.wait(pending))
+                waiter.add_done_callback(lambda _: done.set_result(None))
+            else:
+                done.set_result(None)
+
+    def _drop_tails(self, keys: tuple, done: asyncio.Future) -> None:
+        for key in keys:
+            if self._tails.get(key) is done:
+                del self._tails[key]
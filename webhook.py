@@ -0,0 +1,110 @@
+# -*- coding: utf-8 -*-
+
+"""
+Webhook-режим бота: один aiohttp-сервер на том же event loop, что и Application.
+
+    POST <WEBHOOK_PATH>  — апдейты от Telegram (проверяется X-Telegram-Bot-Api-Secret-Token)
+    GET  /healthz        — живость процесса и глубина очереди апдейтов
+    GET  /metrics        — метрики в текстовом формате Prometheus (см. metrics.py)
+
+Updater из python-telegram-bot тут не нужен: апдейты кладутся прямо
+в application.update_queue, дальше всё как при polling.
+"""
+
+import asyncio
+import hmac
+import json
+import logging
+import signal
+from typing import Optional
+
+from aiohttp import web
+from telegram import Update
+
+from metrics import REGISTRY
+
+logger = logging.getLogger(__name__)
+
+SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+
+WEBHOOK_UPDATES = REGISTRY.counter("tech_task_webhook_updates_total", "Апдейты, пришедшие на webhook", ("result",))
+
+
+def build_web_app(application, path: str, secret_token: Optional[str]) -> web.Application:
+    async def handle_update(request: web.Request) -> web.Response:
+        if secret_token and not hmac.compare_digest(request.headers.get(SECRET_HEADER, ""), secret_token):
+            WEBHOOK_UPDATES.labels("bad_secret").inc()
+            return web.Response(status=403)
+        try:
+            update = Update.de_json(await request.json(), application.bot)
+        except (ValueError, TypeError, KeyError, AttributeError):
+            WEBHOOK_UPDATES.labels("bad_payload").inc()
+            return web.Response(status=400)
+        if update is None:
+            WEBHOOK_UPDATES.labels("bad_payload").inc()
+            return web.Response(status=400)
+        WEBHOOK_UPDATES.labels("ok").inc()
+        # отвечаем Telegram сразу, обработка идёт из очереди
+        await application.update_queue.put(update)
+        return web.Response()
+
+    async def healthz(request: web.Request) -> web.Response:
+        body = {"status": "ok" if application.running else "starting", "update_queue": application.update_queue.qsize()}
+        return web.Response(text=json.dumps(body), content_type="application/json", status=200 if application.running else 503)
+
+    async def metrics(request: web.Request) -> web.Response:
+        return web.Response(text=REGISTRY.render(), content_type="text/plain", charset="utf-8")
+
+    web_app = web.Application()
+    web_app.router.add_post(path, handle_update)
+    web_app.router.add_get("/healthz", healthz)
+    web_app.router.add_get("/metrics", metrics)
+    return web_app
+
+
+async def serve(
+    application,
+    url: str,
+    path: str,
+    secret_token: Optional[str],
+    host: str = "0.0.0.0",
+    port: int = 8080,
+    set_webhook: bool = True,
+    stop: Optional[asyncio.Event] = None,
+) -> None:
+    """
+    Полный жизненный цикл Application в webhook-режиме (аналог run_polling).
+
+    url — публичный адрес сервиса без пути; Telegram будет слать апдейты на url + path.
+    Сервер работает до SIGINT/SIGTERM или до stop.set().
+    """
+    if stop is None:
+        stop = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            try:
+                loop.add_signal_handler(sig, stop.set)
+            except (NotImplementedError, RuntimeError):
+                pass
+
+    runner = web.AppRunner(build_web_app(application, path, secret_token), access_log=None)
+    await application.initialize()
+    if application.post_init:
+        await application.post_init(application)
+    try:
+        await runner.setup()
+        await web.TCPSite(runner, host, port).start()
+        if set_webhook:
+            await application.bot.set_webhook(url=url.rstrip("/") + path, secret_token=secret_token, allowed_updates=Update.ALL_TYPES)
+        await application.start()
+        logger.info(f"Webhook-сервер слушает {host}:{port}{path}")
+        await stop.wait()
+    finally:
+        await runner.cleanup()
+        if application.running:
+            await application.stop()
+        if application.post_stop:
+            await application.post_stop(application)
+        await application.shutdown()
+        if application.post_shutdown:
+            await application.post_shutdown(application)
@@ -0,0 +1,135 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Локальный прогон webhook-режима: POST-ит записанные Update JSON в бота.
+
+    python webhook_replay.py updates.jsonl
+    python webhook_replay.py --sample 50 --url http://127.0.0.1:8080/telegram
+
+Файл — JSON-массив апдейтов или JSONL (один апдейт на строку), например
+выгрузка getUpdates. --sample генерирует синтетические /connect и нажатия
+«Беру таску» — подписанные тем же ключом, что и карточки бота (CALLBACK_SECRET
+и BOT_TOKEN должны совпадать с запущенным ботом), в расчёте на пустую БД:
+таска i-го /connect получает id i + 1. Секрет по умолчанию тот же, что
+вычисляет main.py.
+"""
+
+import argparse
+import asyncio
+import json
+import time
+
+import aiohttp
+
+from callback_codec import CallbackCodec
+from task_store import FIRST_CARD_VERSION
+from webhook import SECRET_HEADER
+
+
+def load_updates(path: str) -> list:
+    with open(path, encoding="utf-8") as f:
+        raw = f.read().strip()
+    if raw.startswith("["):
+        return json.loads(raw)
+    return [json.loads(line) for line in raw.splitlines() if line.strip()]
+
+
+def user(user_id: int, name: str) -> dict:
+    return {"id": user_id, "is_bot": False, "first_name": name, "username": name.lower()}
+
+
+def message_update(update_id: int, sender: dict, text: str, message_id: int = 1) -> dict:
+    message = {
+        "message_id": message_id,
+        "date": int(time.time()),
+        "chat": {"id": sender["id"], "type": "private", "first_name": sender["first_name"]},
+        "from": sender,
+        "text": text,
+    }
+    if text.startswith("/"):
+        command = text.split(maxsplit=1)[0]
+        message["entities"] = [{"type": "bot_command", "offset": 0, "length": len(command)}]
+    return {"update_id": update_id, "message": message}
+
+
+def callback_update(update_id: int, query_id: str, sender: dict, data: str, chat_id: int, message_id: int) -> dict:
+    return {
+        "update_id": update_id,
+        "callback_query": {
+            "id": query_id,
+            "from": sender,
+            "chat_instance": "replay",
+            "data": data,
+            "message": {
+                "message_id": message_id,
+                "date": int(time.time()),
+                "chat": {"id": chat_id, "type": "group", "title": "tech"},
+                "text": "🛠",
+            },
+        },
+    }
+
+
+def sample_updates(n: int, tech_chat_id: int, codec: CallbackCodec, managers: int = 10, techs: int = 3) -> list:
+    # сначала все /connect, потом нажатия: нажатие раньше карточки бот отбросит как устаревшее
+    connects, takes = [], []
+    for i in range(n):
+        m, t = i % managers, i % techs
+        manager = user(100_000 + m, f"Manager{m}")
+        tech = user(200_000 + t, f"Tech{t}")
+        connects.append(message_update(10_000 + i, manager, f"/connect sample task {i}", message_id=1 + i))
+        data = codec.encode("take", 1 + i, FIRST_CARD_VERSION)
+        takes.append(callback_update(10_000 + n + i, str(50_000 + i), tech, data, tech_chat_id, 500 + i))
+    return connects + takes
+
+
+async def replay(url: str, secret: str, updates: list, concurrency: int) -> None:
+    statuses = {}
+    timings = []
+    sem = asyncio.Semaphore(concurrency)
+
+    async with aiohttp.ClientSession(headers={SECRET_HEADER: secret} if secret else None) as session:
+
+        async def post(update: dict) -> None:
+            async with sem:
+                started = time.perf_counter()
+                async with session.post(url, json=update) as resp:
+                    await resp.read()
+                    statuses[resp.status] = statuses.get(resp.status, 0) + 1
+                timings.append(time.perf_counter() - started)
+
+        started = time.perf_counter()
+        await asyncio.gather(*(post(u) for u in updates))
+        elapsed = time.perf_counter() - started
+
+    timings.sort()
+    print(f"Отправлено {len(updates)} апдейтов за {elapsed:.3f} с ({len(updates) / elapsed:.0f}/с)")
+    print("Коды ответов: " + ", ".join(f"{code}×{count}" for code, count in sorted(statuses.items())))
+    if timings:
+        p = lambda q: timings[min(len(timings) - 1, int(len(timings) * q))] * 1000
+        print(f"latency ms: p50={p(0.5):.1f} p95={p(0.95):.1f} p99={p(0.99):.1f}")
+
+
+def main() -> None:
+    import main as bot
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("file", nargs="?", help="JSON/JSONL с апдейтами")
+    parser.add_argument("--url", default=f"http://127.0.0.1:{bot.WEBHOOK_PORT}{bot.WEBHOOK_PATH}")
+    parser.add_argument("--secret", default=bot.WEBHOOK_SECRET)
+    parser.add_argument("--sample", type=int, default=0, help="сгенерировать N пар /connect + take")
+    parser.add_argument("--concurrency", type=int, default=10)
+    args = parser.parse_args()
+
+    if args.file:
+        updates = load_updates(args.file)
+    elif args.sample:
+        updates = sample_updates(args.sample, bot.TECH_CHAT_ID, bot.callback_codec)
+    else:
+        parser.error("нужен файл с апдейтами или --sample N")
+    asyncio.run(replay(args.url, args.secret, updates, args.concurrency))
+
+
+if __name__ == "__main__":
+    main()